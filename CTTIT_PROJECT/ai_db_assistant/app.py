@@ -2,15 +2,31 @@ from __future__ import annotations
 
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 import pandas as pd
 import streamlit as st
-
-from db import run_sql_query, tool_result_to_json
-from llm import LLMConfig, chat_once, load_config_from_env, make_client, extract_text
-from prompts import SYSTEM_PROMPT
+from openai import OpenAI
+
+from db import (
+    DEFAULT_POOL_SIZE,
+    SEARCH_DEFAULT_LIMIT,
+    SEARCH_MAX_LIMIT,
+    ReadOnlyPool,
+    get_pool,
+    iter_query_pages,
+    result_cache,
+    run_sql_query,
+    search_products,
+)
+from llm import LLMConfig, chat_once, chat_stream, load_config_from_env, make_client, extract_text
+from prompts import build_system_prompt
+from result_encoding import TOOL_RESULT_TOKEN_BUDGET, EncodedResult, encode_tool_result
+from schema import get_schema_hint
 
 
 def tool_spec_run_sql_query() -> dict[str, Any]:
@@ -21,7 +37,8 @@ def tool_spec_run_sql_query() -> dict[str, Any]:
             "name": "run_sql_query",
             "description": (
                 "Execute a READ-ONLY SQL query (SELECT/WITH) against the shop SQLite database "
-                "and return rows/columns. Use this to answer questions about products, prices, quantities, categories."
+                "and return rows/columns. Use this to answer questions about products, prices, quantities, categories. "
+                "Results are paged: if next_page_token is set, more rows are available."
             ),
             "parameters": {
                 "type": "object",
@@ -29,7 +46,11 @@ def tool_spec_run_sql_query() -> dict[str, Any]:
                     "query": {
                         "type": "string",
                         "description": "SQL query (only SELECT/WITH). Example: SELECT * FROM products LIMIT 5",
-                    }
+                    },
+                    "page_token": {
+                        "type": "string",
+                        "description": "next_page_token from a previous result of the same query, to get the following rows.",
+                    },
                 },
                 "required": ["query"],
                 "additionalProperties": False,
@@ -38,11 +59,147 @@ def tool_spec_run_sql_query() -> dict[str, Any]:
     }
 
 
+# Rows shown in the demo table; pages are rendered as they arrive
+UI_PAGE_SIZE = 500
+UI_MAX_ROWS = 5000
+# Min. interval between re-renders of a streaming answer (each one is a websocket message)
+STREAM_RENDER_INTERVAL_SEC = 0.05
+
+
+def tool_spec_search_products() -> dict[str, Any]:
+    return {
+        "type": "function",
+        "function": {
+            "name": "search_products",
+            "description": (
+                "Full-text search of products by words of the name/brand (prefixes work: 'iph 15' finds 'iPhone 15'), "
+                "ranked by relevance, with optional exact filters. Prefer this over LIKE '%...%' for fuzzy lookups."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string", "description": "Search words, e.g. 'galaxy s24' (may be empty if only filters)."},
+                    "filters": {
+                        "type": "object",
+                        "properties": {
+                            "category": {"type": "string", "description": "Exact category name"},
+                            "brand": {"type": "string"},
+                            "color": {"type": "string"},
+                            "min_price_cents": {"type": "integer"},
+                            "max_price_cents": {"type": "integer"},
+                            "in_stock": {"type": "boolean", "description": "Only quantity > 0"},
+                        },
+                        "additionalProperties": False,
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": f"Max results (default {SEARCH_DEFAULT_LIMIT}, max {SEARCH_MAX_LIMIT}).",
+                    },
+                },
+                "required": ["text"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
 def get_default_db_path() -> str:
     # Default db location: ./data/shop.db
     return str(Path(__file__).with_name("data") / "shop.db")
 
 
+@st.cache_resource
+def get_db_pool(db_path: str) -> ReadOnlyPool:
+    # One pool per DB file for the whole Streamlit server: survives reruns and sessions
+    return get_pool(db_path)
+
+
+@st.cache_resource
+def get_llm_client(base_url: str, api_key: str) -> OpenAI:
+    # One client (and its HTTP connection pool) per endpoint instead of one per prompt
+    return make_client(LLMConfig(base_url=base_url, api_key=api_key, model=""))
+
+
+def make_stream_renderer(placeholder: Any) -> Callable[[str], None]:
+    """Renders the partial answer into `placeholder` as an assistant bubble, throttled."""
+    last = 0.0
+
+    def render(text: str) -> None:
+        nonlocal last
+        now = time.perf_counter()
+        if now - last < STREAM_RENDER_INTERVAL_SEC:
+            return
+        last = now
+        with placeholder.container():
+            with st.chat_message("assistant"):
+                st.markdown(text + "▌")
+
+    return render
+
+
+@st.cache_resource
+def get_tool_executor() -> ThreadPoolExecutor:
+    # Shared by all sessions; one worker per pooled connection
+    return ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE, thread_name_prefix="tool-call")
+
+
+@dataclass
+class ToolCallOutcome:
+    tool_call_id: str
+    name: str
+    content: str                        # tool message for the model
+    query: str | None = None
+    result: dict[str, Any] | None = None
+    encoded: EncodedResult | None = None
+    elapsed_sec: float = 0.0
+
+
+def execute_tool_call(tc: Any, db_path: str, pool: ReadOnlyPool) -> ToolCallOutcome:
+    """
+    Run one tool call. Safe to call from worker threads: no Streamlit calls here,
+    rendering and session state updates happen in the script thread.
+    """
+    t0 = time.perf_counter()
+    fn = tc.function.name
+    if fn not in ("run_sql_query", "search_products"):
+        tool_out = {"ok": False, "error": f"Unknown tool: {fn}"}
+        return ToolCallOutcome(tc.id, fn, json.dumps(tool_out, ensure_ascii=False))
+
+    try:
+        args = json.loads(tc.function.arguments or "{}")
+    except json.JSONDecodeError as e:
+        tool_out = {"ok": False, "error": f"Invalid JSON args: {e}"}
+        return ToolCallOutcome(tc.id, fn, json.dumps(tool_out, ensure_ascii=False))
+
+    if fn == "search_products":
+        filters = args.get("filters") or {}
+        if not isinstance(filters, dict):
+            filters = {"invalid": filters}  # reported back as an unknown filter
+        result = search_products(
+            db_path=db_path,
+            text=str(args.get("text") or ""),
+            filters=filters,
+            limit=args.get("limit") or SEARCH_DEFAULT_LIMIT,
+            pool=pool,
+        )
+        query = result["query"]
+    else:
+        query = str(args.get("query", "")).strip()
+        page_token = str(args.get("page_token") or "").strip() or None
+        result = run_sql_query(db_path=db_path, query=query, pool=pool, page_token=page_token)
+    encoded = encode_tool_result(result)
+    return ToolCallOutcome(
+        tc.id, fn, encoded.text, query=query, result=result, encoded=encoded, elapsed_sec=time.perf_counter() - t0
+    )
+
+
+def execute_tool_calls(tool_calls: list[Any], db_path: str, pool: ReadOnlyPool) -> list[ToolCallOutcome]:
+    """Run tool calls concurrently (each takes its own pooled connection); outcomes keep the call order."""
+    if len(tool_calls) == 1:
+        return [execute_tool_call(tool_calls[0], db_path, pool)]
+    return list(get_tool_executor().map(lambda tc: execute_tool_call(tc, db_path, pool), tool_calls))
+
+
 def ensure_session_state() -> None:
     if "messages" not in st.session_state:
         st.session_state.messages = []  # chat history for the model
@@ -50,6 +207,11 @@ def ensure_session_state() -> None:
         st.session_state.ui_messages = []  # chat history for display (same content, but we can include extras)
     if "last_sql" not in st.session_state:
         st.session_state.last_sql = None
+    if "tool_tokens" not in st.session_state:
+        # prompt tokens of tool results: as sent vs. as plain JSON
+        st.session_state.tool_tokens = {"results": 0, "sent": 0, "json": 0, "summarized": 0}
+    if "last_turn_timing" not in st.session_state:
+        st.session_state.last_turn_timing = None
 
 
 def add_ui_message(role: str, content: str) -> None:
@@ -81,6 +243,7 @@ def main() -> None:
         base_url = st.text_input("LM Studio base_url", value=cfg_env.base_url)
         api_key = st.text_input("API key (любое для LM Studio)", value=cfg_env.api_key, type="password")
         model = st.text_input("Model", value=cfg_env.model)
+        stream = st.toggle("Стриминг ответа", value=True)
 
         db_path = st.text_input("SQLite DB path", value=os.getenv("DB_PATH", get_default_db_path()))
 
@@ -90,10 +253,26 @@ def main() -> None:
             st.caption("Последний SQL:")
             st.code(st.session_state.last_sql, language="sql")
 
+        with st.expander("Статистика БД"):
+            st.json({"pool": get_db_pool(db_path).snapshot(), "result_cache": result_cache.snapshot()})
+
+        with st.expander("Схема БД (для модели)"):
+            st.code(get_schema_hint(db_path, pool=get_db_pool(db_path)) or "БД недоступна: используется встроенная схема")
+
+        if st.session_state.last_turn_timing:
+            with st.expander("Время последнего ответа", expanded=True):
+                st.json({k: round(v, 1) for k, v in st.session_state.last_turn_timing.items()})
+
+        with st.expander("Токены результатов инструментов"):
+            tt = st.session_state.tool_tokens
+            st.caption(f"Бюджет на один результат: {TOOL_RESULT_TOKEN_BUDGET} токенов")
+            st.json({**tt, "saved": tt["json"] - tt["sent"]})
+
         if st.button("Очистить чат", type="secondary"):
             st.session_state.messages = []
             st.session_state.ui_messages = []
             st.session_state.last_sql = None
+            st.session_state.tool_tokens = {"results": 0, "sent": 0, "json": 0, "summarized": 0}
             st.rerun()
 
     # Quick demo button (slide 7 style)
@@ -108,12 +287,19 @@ def main() -> None:
             WHERE p.price_cents > 100000
             ORDER BY p.price_cents DESC
             """
-            res = run_sql_query(db_path=db_path, query=q)
-            if not res["ok"]:
-                st.error(res["error"])
-            else:
-                df = pd.DataFrame(res["rows"], columns=res["columns"])
-                st.dataframe(df, use_container_width=True)
+            table = st.empty()
+            frames: list[pd.DataFrame] = []
+            shown = 0
+            for page in iter_query_pages(db_path=db_path, query=q, page_size=UI_PAGE_SIZE, pool=get_db_pool(db_path)):
+                if not page["ok"]:
+                    st.error(page["error"])
+                    break
+                frames.append(pd.DataFrame(page["rows"], columns=page["columns"]))
+                shown += page["row_count"]
+                table.dataframe(pd.concat(frames, ignore_index=True), use_container_width=True)
+                if shown >= UI_MAX_ROWS:
+                    st.caption(f"Показаны первые {shown} строк.")
+                    break
 
     with col2:
         st.subheader("Чат с tool calls (LLM + SQLite)")
@@ -124,76 +310,102 @@ def main() -> None:
         if not user_text:
             return
 
-        # Display user message
+        # Display user message (now, not after the rerun: the answer streams below it)
         add_ui_message("user", user_text)
+        with st.chat_message("user"):
+            st.markdown(user_text)
 
-        # Add to model messages
+        # Add to model messages; the schema hint is re-read from the DB (cached per data version)
+        system_prompt = build_system_prompt(get_schema_hint(db_path, pool=get_db_pool(db_path)))
         if not st.session_state.messages:
-            add_model_message("system", SYSTEM_PROMPT)
+            add_model_message("system", system_prompt)
+        elif st.session_state.messages[0]["role"] == "system":
+            st.session_state.messages[0]["content"] = system_prompt
         add_model_message("user", user_text)
 
         cfg = LLMConfig(base_url=base_url, api_key=api_key, model=model)
-        client = make_client(cfg)
-        tools = [tool_spec_run_sql_query()]
+        client = get_llm_client(base_url, api_key)
+        tools = [tool_spec_run_sql_query(), tool_spec_search_products()]
+
+        # Per-turn wall clock: LLM calls vs. tool execution (tools run in parallel, so
+        # tools_wall_ms ~ max() of the calls while tools_sum_ms is what sequential would cost)
+        timing = {
+            "wall_ms": 0.0,
+            "first_token_ms": 0.0,
+            "llm_ms": 0.0,
+            "tools_wall_ms": 0.0,
+            "tools_sum_ms": 0.0,
+            "tool_calls": 0,
+        }
+        st.session_state.last_turn_timing = timing
+        turn_start = time.perf_counter()
 
         # Tool loop: allow a few iterations to avoid infinite loops
         max_tool_rounds = 3
         for _ in range(max_tool_rounds):
-            resp = chat_once(client=client, cfg=cfg, messages=st.session_state.messages, tools=tools)
-            msg = resp.choices[0].message
+            t0 = time.perf_counter()
+            placeholder = st.empty()
+            if stream:
+                render = make_stream_renderer(placeholder)
+
+                def on_text(text: str) -> None:
+                    if not timing["first_token_ms"]:
+                        timing["first_token_ms"] = (time.perf_counter() - turn_start) * 1000
+                    render(text)
+
+                msg = chat_stream(
+                    client=client, cfg=cfg, messages=st.session_state.messages, tools=tools, on_text=on_text
+                )
+            else:
+                resp = chat_once(client=client, cfg=cfg, messages=st.session_state.messages, tools=tools)
+                msg = resp.choices[0].message
+            timing["llm_ms"] += (time.perf_counter() - t0) * 1000
 
             tool_calls = getattr(msg, "tool_calls", None)
             if tool_calls:
+                # Text streamed before the tool calls is kept in the model history only
+                placeholder.empty()
+
                 # Record assistant message with tool calls (content may be empty)
                 add_model_message("assistant", extract_text(msg), tool_calls=[tc.model_dump() for tc in tool_calls])
 
-                # Execute each tool call
-                for tc in tool_calls:
-                    fn = tc.function.name
-                    if fn != "run_sql_query":
-                        tool_out = {"ok": False, "error": f"Unknown tool: {fn}"}
-                        add_model_message(
-                            role="tool",
-                            content=json.dumps(tool_out, ensure_ascii=False),
-                            tool_call_id=tc.id,
-                            name=fn,
-                        )
-                        continue
-
-                    try:
-                        args = json.loads(tc.function.arguments or "{}")
-                    except json.JSONDecodeError as e:
-                        tool_out = {"ok": False, "error": f"Invalid JSON args: {e}"}
-                        add_model_message(
-                            role="tool",
-                            content=json.dumps(tool_out, ensure_ascii=False),
-                            tool_call_id=tc.id,
-                            name=fn,
-                        )
-                        continue
-
-                    query = str(args.get("query", "")).strip()
-                    st.session_state.last_sql = query
-
-                    result = run_sql_query(db_path=db_path, query=query)
-                    tool_json = tool_result_to_json(result)
-
-                    # Show tool result to user (compact)
-                    with st.chat_message("assistant"):
-                        if result["ok"]:
-                            st.markdown("Я проверил базу данных.")
-                            df = pd.DataFrame(result["rows"], columns=result["columns"])
-                            st.dataframe(df, use_container_width=True)
-                        else:
-                            st.markdown("Не смог выполнить запрос к базе данных.")
-                            st.code(result["error"])
-
-                    # Send tool output back to model
+                # Execute all tool calls of this message concurrently
+                t0 = time.perf_counter()
+                outcomes = execute_tool_calls(list(tool_calls), db_path, get_db_pool(db_path))
+                timing["tools_wall_ms"] += (time.perf_counter() - t0) * 1000
+                timing["tools_sum_ms"] += sum(o.elapsed_sec for o in outcomes) * 1000
+                timing["tool_calls"] += len(outcomes)
+
+                # Render and send tool outputs back to the model in the original order
+                for outcome in outcomes:
+                    result, encoded = outcome.result, outcome.encoded
+                    if result is not None and encoded is not None:
+                        st.session_state.last_sql = outcome.query
+                        tt = st.session_state.tool_tokens
+                        tt["results"] += 1
+                        tt["sent"] += encoded.tokens
+                        tt["json"] += encoded.json_tokens
+                        tt["summarized"] += not encoded.lossless
+
+                        # Show tool result to user (compact)
+                        with st.chat_message("assistant"):
+                            if result["ok"]:
+                                st.markdown("Я проверил базу данных.")
+                                df = pd.DataFrame(result["rows"], columns=result["columns"])
+                                st.dataframe(df, use_container_width=True)
+                                st.caption(
+                                    f"Модели отправлено: {encoded.format}, {encoded.tokens} ток. "
+                                    f"вместо {encoded.json_tokens} в JSON ({encoded.counter})"
+                                )
+                            else:
+                                st.markdown("Не смог выполнить запрос к базе данных.")
+                                st.code(result["error"])
+
                     add_model_message(
                         role="tool",
-                        content=tool_json,
-                        tool_call_id=tc.id,
-                        name=fn,
+                        content=outcome.content,
+                        tool_call_id=outcome.tool_call_id,
+                        name=outcome.name,
                     )
 
                 # Continue loop: model should now answer using tool output
@@ -201,12 +413,17 @@ def main() -> None:
 
             # No tool call -> final assistant answer
             final_text = extract_text(msg).strip() or "(пустой ответ модели)"
+            with placeholder.container():
+                with st.chat_message("assistant"):
+                    st.markdown(final_text)
             add_model_message("assistant", final_text)
             add_ui_message("assistant", final_text)
+            timing["wall_ms"] = (time.perf_counter() - turn_start) * 1000
             st.rerun()
 
         # If we reached max_tool_rounds without a final answer
         add_ui_message("assistant", "Я получил данные из БД, но не смог сформировать финальный ответ за отведённое число шагов. Попробуй переформулировать вопрос короче.")
+        timing["wall_ms"] = (time.perf_counter() - turn_start) * 1000
         st.rerun()
 
 
@@ -0,0 +1,121 @@
+"""
+Benchmark: latency of representative LLM-style queries through run_sql_query.
+
+Build a large catalog first:
+    python init_db.py --synthetic --products 1000000
+
+Usage:
+    python bench_queries.py [--db data/bench.db] [--repeat 5] [--max-rows 200] [--cached]
+
+Each query is run once cold (first execution on a fresh pool), then --repeat times;
+the result cache is bypassed unless --cached is given.
+"""
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+from db import ReadOnlyPool, get_pool, result_cache, run_sql_query
+
+
+def pick_values(db_path: Path) -> dict[str, str]:
+    # Literals that exist in this DB, so filters return rows as real questions would
+    conn = sqlite3.connect(f"file:{db_path.as_posix()}?mode=ro", uri=True)
+    try:
+        (n_categories,) = conn.execute("SELECT count(*) FROM categories").fetchone()
+        (category,) = conn.execute("SELECT name FROM categories LIMIT 1 OFFSET ?", (n_categories // 2,)).fetchone()
+        (brand, name) = conn.execute("SELECT brand, name FROM products WHERE id = (SELECT max(id) / 2 FROM products)").fetchone()
+    finally:
+        conn.close()
+    fragment = " ".join(name.split()[1:3])  # e.g. "Watch Pro"
+    return {"category": category, "brand": brand, "fragment": fragment}
+
+
+def benchmark_queries(v: dict[str, str]) -> list[tuple[str, str]]:
+    category, brand, fragment = (s.replace("'", "''") for s in (v["category"], v["brand"], v["fragment"]))
+    return [
+        (
+            "point lookup by id",
+            "SELECT * FROM products WHERE id = 4242",
+        ),
+        (
+            "join: category by name",
+            f"SELECT p.name, p.brand, p.price_cents / 100.0 AS price FROM products p "
+            f"JOIN categories c ON c.id = p.category_id WHERE c.name = '{category}' ORDER BY p.price_cents DESC",
+        ),
+        (
+            "price range",
+            "SELECT name, brand, price_cents FROM products WHERE price_cents BETWEEN 50000 AND 51000 ORDER BY price_cents",
+        ),
+        (
+            "brand + in stock, top price",
+            f"SELECT name, color, quantity, price_cents FROM products WHERE brand = '{brand}' AND quantity > 0 "
+            "ORDER BY price_cents DESC LIMIT 10",
+        ),
+        (
+            "LIKE '%...%' on name",
+            f"SELECT id, name, price_cents FROM products WHERE name LIKE '%{fragment}%' LIMIT 20",
+        ),
+        (
+            "LIKE prefix on name",
+            f"SELECT id, name FROM products WHERE name LIKE '{brand} %' LIMIT 20",
+        ),
+        (
+            "GROUP BY brand",
+            "SELECT brand, count(*) AS n, avg(price_cents) / 100.0 AS avg_price FROM products "
+            "GROUP BY brand ORDER BY n DESC LIMIT 20",
+        ),
+        (
+            "GROUP BY category (join)",
+            "SELECT c.name, sum(p.quantity) AS stock FROM products p JOIN categories c ON c.id = p.category_id "
+            "GROUP BY c.id ORDER BY stock DESC LIMIT 10",
+        ),
+        (
+            "count by color",
+            "SELECT color, count(*) FROM products GROUP BY color ORDER BY 2 DESC",
+        ),
+    ]
+
+
+def time_query(db_path: Path, query: str, max_rows: int, pool: ReadOnlyPool, cached: bool) -> tuple[float, dict]:
+    t0 = time.perf_counter()
+    result = run_sql_query(str(db_path), query, max_rows=max_rows, pool=pool, cache=result_cache if cached else None)
+    return time.perf_counter() - t0, result
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default=str(Path(__file__).with_name("data") / "bench.db"))
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--max-rows", type=int, default=200)
+    ap.add_argument("--cached", action="store_true", help="go through the result cache (measures hits after the first run)")
+    args = ap.parse_args()
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        raise SystemExit(f"{db_path} not found; run: python init_db.py --synthetic --db {db_path}")
+    pool = get_pool(db_path)
+    (n_products,) = run_sql_query(str(db_path), "SELECT count(*) FROM products", pool=pool, cache=None)["rows"][0]
+    print(f"DB: {db_path} ({n_products} products), repeat={args.repeat}, cache={'on' if args.cached else 'off'}")
+
+    print(f"{'query':<30} | {'rows':>5} | {'cold ms':>9} | {'median ms':>9} | {'min ms':>8} | {'max ms':>8}")
+    print("-" * 84)
+    for label, query in benchmark_queries(pick_values(db_path)):
+        cold, result = time_query(db_path, query, args.max_rows, pool, args.cached)
+        if not result["ok"]:
+            print(f"{label:<30} | ERROR: {result['error']}")
+            continue
+        times = [time_query(db_path, query, args.max_rows, pool, args.cached)[0] for _ in range(args.repeat)]
+        print(
+            f"{label:<30} | {result['row_count']:>5} | {cold * 1000:>9.2f} | {statistics.median(times) * 1000:>9.2f} | "
+            f"{min(times) * 1000:>8.2f} | {max(times) * 1000:>8.2f}"
+        )
+    if args.cached:
+        print(f"result cache: {result_cache.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
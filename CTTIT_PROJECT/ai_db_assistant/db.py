@@ -1,120 +1,454 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+import queue
 import re
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
 
 
 class UnsafeSQLError(ValueError):
     """Raised when the SQL query is not allowed (non read-only / multi-statement / dangerous)."""
 
 
-_DISALLOWED_KEYWORDS = (
-    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "REPLACE", "VACUUM",
-    "ATTACH", "DETACH", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "TRUNCATE",
+class PageTokenError(ValueError):
+    """Raised when a page_token is malformed, belongs to another query or has expired."""
+
+
+# Single pass over the query that only stops at string literals, quoted identifiers and
+# comments; the code between them is handled with C-level str/re operations. The result is
+# the normalized text plus an aligned copy with literals masked, so keyword checks never
+# look inside strings or identifiers like "limit" or [order].
+_LEXEME_RE = re.compile(
+    r"""
+      '(?:[^']|'')*(?:'|\Z)
+    | "(?:[^"]|"")*(?:"|\Z)
+    | `(?:[^`]|``)*(?:`|\Z)
+    | \[[^\]]*(?:\]|\Z)
+    | --[^\n]*
+    | /\*.*?(?:\*/|\Z)
+    """,
+    re.DOTALL | re.VERBOSE,
 )
-_DISALLOWED_RE = re.compile(r"\b(" + "|".join(_DISALLOWED_KEYWORDS) + r")\b", re.IGNORECASE)
-
-
-def _strip_sql_comments(sql: str) -> str:
-    # Remove -- line comments
-    sql = re.sub(r"--[^\n]*", "", sql)
-    # Remove /* block comments */
-    sql = re.sub(r"/\*.*?\*/", "", sql, flags=re.DOTALL)
-    return sql
-
-
-def _mask_sql_string_literals(sql: str) -> str:
-    """
-    Replace content of string literals so keyword checks don't trigger inside strings.
-    Handles single quotes; keeps length/structure roughly stable.
-    """
-    out: list[str] = []
-    i = 0
-    n = len(sql)
-    while i < n:
-        ch = sql[i]
-        if ch == "'":
-            out.append("'")
-            i += 1
-            # SQL single-quote escaping is '' (two single quotes)
-            while i < n:
-                if sql[i] == "'":
-                    if i + 1 < n and sql[i + 1] == "'":
-                        out.append("''")
-                        i += 2
-                        continue
-                    out.append("'")
-                    i += 1
-                    break
-                out.append("x")
-                i += 1
-        else:
-            out.append(ch)
-            i += 1
-    return "".join(out)
+_WS_RE = re.compile(r"\s+")
+_FIRST_WORD_RE = re.compile(r"\w+")
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_LIMIT_ARG_RE = re.compile(r"\w+|\S")
+
+
+@dataclass
+class _SQLScan:
+    sql: str                  # comments removed, whitespace collapsed, outer ';' dropped
+    masked: str               # same length as sql, literals/quoted identifiers replaced by NULs
+    first_keyword: str
+    statements: int           # non-empty statements separated by ';'
+    limit_tokens: list[str]   # tokens after a top-level LIMIT (empty if there is none)
+
+
+def _scan_sql(sql: str) -> _SQLScan:
+    text_parts: list[str] = []
+    mask_parts: list[str] = []
+    code: list[str] = []
+    pos = 0
+    for m in _LEXEME_RE.finditer(sql):
+        code.append(sql[pos:m.start()])
+        lexeme = m.group()
+        pos = m.end()
+        if lexeme[0] in "-/":  # comment
+            code.append(" ")
+            continue
+        segment = _WS_RE.sub(" ", "".join(code))
+        code.clear()
+        text_parts += (segment, lexeme)
+        mask_parts += (segment, "\0" * len(lexeme))
+    code.append(sql[pos:])
+    segment = _WS_RE.sub(" ", "".join(code))
+    text_parts.append(segment)
+    mask_parts.append(segment)
+
+    masked = "".join(mask_parts)
+    lead = len(masked) - len(masked.lstrip(" ;"))
+    masked = masked.strip(" ;")
+    text = "".join(text_parts)[lead:lead + len(masked)]
+
+    word = _FIRST_WORD_RE.match(masked)
+    first_keyword = word.group().upper() if word else text[:1]
+    statements = sum(1 for part in masked.split(";") if part.strip())
+    limit_tokens: list[str] = []
+    for m in _LIMIT_RE.finditer(masked):
+        at = m.start()
+        if masked.count("(", 0, at) == masked.count(")", 0, at):
+            limit_tokens = _LIMIT_ARG_RE.findall(text, m.end())
+    return _SQLScan(text, masked, first_keyword, statements, limit_tokens)
 
 
 def _normalize_sql(sql: str) -> str:
-    sql = sql.strip()
-    sql = _strip_sql_comments(sql)
-    sql = sql.strip()
-    # Remove a single trailing semicolon (common)
-    sql = re.sub(r";\s*$", "", sql)
-    return sql.strip()
+    return _scan_sql(sql).sql
 
 
-def _ensure_single_statement(sql: str) -> None:
-    # After removing trailing semicolon, any remaining semicolon implies multiple statements
-    if ";" in sql:
+def _ensure_single_statement(scan: _SQLScan) -> None:
+    if scan.statements > 1:
         raise UnsafeSQLError("Multiple SQL statements are not allowed.")
+    # complete_statement is False for an unterminated string, identifier or trigger body
+    if scan.sql and not sqlite3.complete_statement(scan.sql + ";"):
+        raise UnsafeSQLError("Incomplete SQL statement.")
 
 
-def _ensure_readonly(sql: str) -> None:
-    if not sql:
+def _ensure_readonly(scan: _SQLScan) -> None:
+    """
+    Cheap early rejection with a clear message. The actual guarantee is the
+    connection's authorizer (see _readonly_authorizer), which also covers
+    writes hidden in CTEs and everything the keyword check cannot see.
+    """
+    if not scan.sql:
         raise UnsafeSQLError("Empty SQL is not allowed.")
+    if scan.first_keyword not in ("SELECT", "WITH"):
+        raise UnsafeSQLError("Only SELECT/WITH queries are allowed.")
 
-    masked = _mask_sql_string_literals(sql)
-    if _DISALLOWED_RE.search(masked):
-        raise UnsafeSQLError("Only read-only queries are allowed (SELECT/WITH).")
 
-    first_token = re.split(r"\s+", masked.strip(), maxsplit=1)[0].upper()
-    if first_token not in ("SELECT", "WITH"):
-        raise UnsafeSQLError("Only SELECT/WITH queries are allowed.")
+def _limit_count(tokens: list[str]) -> int | None:
+    # LIMIT n | LIMIT n OFFSET m | LIMIT m, n  (literal counts only)
+    if len(tokens) == 1 or (len(tokens) == 3 and tokens[1].upper() == "OFFSET"):
+        count = tokens[0]
+    elif len(tokens) == 3 and tokens[1] == ",":
+        count = tokens[2]
+    else:
+        return None
+    return int(count) if count.isdigit() else None
 
 
-def _apply_row_limit(sql: str, limit: int) -> str:
+def _apply_row_limit(scan: _SQLScan, limit: int, offset: int = 0) -> str:
     """
     Enforce a hard limit to avoid huge outputs.
-    If SQL already contains LIMIT (best-effort), keep it.
-    Otherwise wrap with SELECT * FROM ( ... ) LIMIT N.
+    On the first page a top-level LIMIT with a literal count within the limit is
+    kept as is; otherwise (no LIMIT, LIMIT only in a subquery, larger or computed
+    LIMIT, later pages) the query is wrapped with SELECT * FROM ( ... ) LIMIT N OFFSET M.
+    """
+    count = _limit_count(scan.limit_tokens)
+    if not offset and count is not None and count <= limit:
+        return scan.sql
+    sql = f"SELECT * FROM ({scan.sql}) LIMIT {int(limit)}"
+    return f"{sql} OFFSET {int(offset)}" if offset else sql
+
+
+def _page_digest(sql: str, version: Any) -> str:
+    # Ties a page token to the query text and the data it was computed on
+    return hashlib.sha1(f"{version!r}\0{sql}".encode("utf-8")).hexdigest()[:12]
+
+
+def _make_page_token(sql: str, version: Any, offset: int) -> str:
+    return f"{offset}.{_page_digest(sql, version)}"
+
+
+def _parse_page_token(token: str, sql: str, version: Any) -> int:
+    """
+    Returns the row offset encoded in `token`.
+    Raises PageTokenError if the token is malformed, belongs to another query
+    or the database changed since it was issued (offsets would no longer line up).
     """
-    masked = _mask_sql_string_literals(sql)
-    if re.search(r"\bLIMIT\b", masked, flags=re.IGNORECASE):
-        return sql
-    return f"SELECT * FROM ({sql}) LIMIT {int(limit)}"
+    offset, _, digest = token.strip().partition(".")
+    if not offset.isdigit() or digest != _page_digest(sql, version):
+        raise PageTokenError("Invalid or expired page_token: run the query again without page_token.")
+    return int(offset)
+
+
+_AUTHORIZED_ACTIONS = frozenset(
+    (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE)
+)
+# Introspection pragmas that only read (also reachable as pragma_table_info(...) etc.)
+_AUTHORIZED_PRAGMAS = frozenset(
+    ("data_version", "table_info", "table_xinfo", "index_list", "index_info", "index_xinfo", "foreign_key_list")
+)
+
+
+def _readonly_authorizer(action: int, arg1: str | None, arg2: str | None, db_name: str | None, source: str | None) -> int:
+    """Engine-level allow-list: reads, functions, recursive CTEs and introspection pragmas."""
+    if action in _AUTHORIZED_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master" and source is None:
+        # Connecting a virtual table (FTS5, pragma_* functions) on first use is authorized as an
+        # UPDATE of sqlite_master. Real writes to it cannot happen here: mode=ro, query_only,
+        # and writable_schema is a PRAGMA the allow-list rejects.
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and (arg1 or "").lower() in _AUTHORIZED_PRAGMAS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _is_auth_error(e: sqlite3.Error) -> bool:
+    return getattr(e, "sqlite_errorname", None) == "SQLITE_AUTH" or str(e) == "not authorized"
+
+
+# Per-connection tuning for a read-mostly workload (values are pragmas, see sqlite.org/pragma.html)
+READONLY_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA cache_size = -16384",      # 16 MiB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MiB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256
+FETCH_BATCH_SIZE = 256
+DEFAULT_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("DB_RESULT_CACHE_MAX_ENTRIES", "512"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("DB_RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
 
 
 def _connect_readonly(db_path: Path) -> sqlite3.Connection:
     # Read-only connection using SQLite URI
     uri = f"file:{db_path.as_posix()}?mode=ro"
-    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in READONLY_PRAGMAS:
+        conn.execute(pragma)
+    conn.set_authorizer(_readonly_authorizer)
     return conn
 
 
-def run_sql_query(db_path: str, query: str, max_rows: int = 200) -> dict[str, Any]:
+@dataclass
+class PoolStats:
+    hits: int = 0        # connection reused from the pool
+    misses: int = 0      # new connection had to be opened
+    discarded: int = 0   # closed: pool full or the database file was replaced
+    in_use: int = 0
+
+
+class ReadOnlyPool:
+    """
+    Thread-safe pool of read-only connections to one SQLite file.
+
+    Reused connections keep SQLite's page cache and prepared-statement cache warm.
+    If the file is replaced (e.g. `python init_db.py` on a fresh path) the pooled
+    connections still point at the old inode, so the pool is flushed; connections
+    checked out at that moment are closed when released instead of being pooled.
+    """
+
+    def __init__(self, db_path: Path, max_size: int = DEFAULT_POOL_SIZE) -> None:
+        self.db_path = db_path
+        self.max_size = max(1, max_size)
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._file_id = self._stat_id()
+        self._generation = 0  # bumped on every flush
+        self._version_lock = threading.Lock()
+        self._version_conn: sqlite3.Connection | None = None
+        self.stats = PoolStats()
+
+    def _stat_id(self) -> tuple[int, int] | None:
+        try:
+            st = self.db_path.stat()
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def _flush_if_replaced(self) -> None:
+        file_id = self._stat_id()
+        if file_id == self._file_id:
+            return
+        with self._lock:
+            self._file_id = file_id
+            self._generation += 1
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+        self.close_all()
+
+    def data_version(self) -> tuple[Any, int]:
+        """
+        Changes whenever the database content may have changed.
+
+        PRAGMA data_version is only comparable on the same connection, so one
+        connection is kept for it; the file identity covers a replaced file.
+        """
+        self._flush_if_replaced()
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = _connect_readonly(self.db_path)
+            (version,) = self._version_conn.execute("PRAGMA data_version").fetchone()
+        return self._file_id, int(version)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        self._flush_if_replaced()
+        with self._lock:
+            generation = self._generation
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.stats.hits += 1
+        except queue.Empty:
+            conn = _connect_readonly(self.db_path)
+            with self._lock:
+                self.stats.misses += 1
+        with self._lock:
+            self.stats.in_use += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self.stats.in_use -= 1
+                # under the lock: a flush either sees this connection in _idle or bumped the generation
+                keep = generation == self._generation and self._idle.qsize() < self.max_size
+                if keep:
+                    self._idle.put(conn)
+                else:
+                    self.stats.discarded += 1
+            if not keep:
+                conn.close()
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+            with self._lock:
+                self.stats.discarded += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            total = self.stats.hits + self.stats.misses
+            return {
+                "db_path": str(self.db_path),
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "hit_rate": round(self.stats.hits / total, 3) if total else 0.0,
+                "discarded": self.stats.discarded,
+                "in_use": self.stats.in_use,
+                "idle": self._idle.qsize(),
+                "max_size": self.max_size,
+            }
+
+
+_POOLS: dict[str, ReadOnlyPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(db_path: str | Path, max_size: int = DEFAULT_POOL_SIZE) -> ReadOnlyPool:
+    """Process-wide pool per database file."""
+    p = Path(db_path).resolve()
+    with _POOLS_LOCK:
+        pool = _POOLS.get(str(p))
+        if pool is None:
+            pool = _POOLS[str(p)] = ReadOnlyPool(p, max_size=max_size)
+        return pool
+
+
+def pool_stats() -> list[dict[str, Any]]:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return [pool.snapshot() for pool in pools]
+
+
+# (db file, normalized SQL, max_rows, offset)
+_CacheKey = tuple[str, str, int, int]
+
+
+class QueryResultCache:
+    """
+    LRU of successful run_sql_query results keyed by (db file, normalized SQL, max_rows, offset).
+
+    An entry is valid only for the data version it was read at (see ReadOnlyPool.data_version),
+    so any commit to the database invalidates it. Bounded by entry count and by the JSON size
+    of the results. Cached results are shared: callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES) -> None:
+        self.max_entries = max(0, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self._entries: OrderedDict[_CacheKey, tuple[Any, dict[str, Any], int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key: _CacheKey, version: Any) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                self._drop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: _CacheKey, version: Any, result: dict[str, Any]) -> None:
+        size = len(tool_result_to_json(result))
+        if size > self.max_bytes or not self.max_entries:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key: _CacheKey) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+result_cache = QueryResultCache()
+
+
+def run_sql_query(
+    db_path: str,
+    query: str,
+    max_rows: int = 200,
+    pool: ReadOnlyPool | None = None,
+    cache: QueryResultCache | None = result_cache,
+    page_token: str | None = None,
+) -> dict[str, Any]:
     """
-    Execute a read-only SQL query against SQLite and return a JSON-serializable result.
+    Execute a read-only SQL query against SQLite and return one page of a JSON-serializable result.
 
     Security:
     - Only allows SELECT/WITH
-    - Blocks common write/DDL keywords
+    - Read-only enforced by the connection's SQLite authorizer (and mode=ro)
     - Blocks multi-statement queries
-    - Enforces max row limit
+    - Enforces max row limit (page size)
+
+    Pagination: if more rows follow, "next_page_token" is set; call again with the
+    same query and page_token=<that value> for the next page. Tokens expire when the
+    database changes. Only max_rows + 1 rows are ever read from SQLite per call.
+
+    Connections come from `pool` (default: the process-wide pool for db_path).
+    Successful results are served from `cache` while the database is unchanged
+    (pass cache=None to always hit the database).
 
     Returns:
       {
@@ -123,6 +457,7 @@ def run_sql_query(db_path: str, query: str, max_rows: int = 200) -> dict[str, An
         "columns": [str, ...],
         "rows": [[...], ...],
         "row_count": int,
+        "next_page_token": str | null,
         "error": str | null
       }
     """
@@ -134,31 +469,54 @@ def run_sql_query(db_path: str, query: str, max_rows: int = 200) -> dict[str, An
             "columns": [],
             "rows": [],
             "row_count": 0,
+            "next_page_token": None,
             "error": f"Database file not found: {p}",
         }
 
-    normalized = _normalize_sql(query)
+    scan = _scan_sql(query)
+    normalized = scan.sql
+    max_rows = max(1, int(max_rows))
     try:
-        _ensure_single_statement(normalized)
-        _ensure_readonly(normalized)
-        limited = _apply_row_limit(normalized, max_rows)
+        pool = pool or get_pool(p)
+        version = pool.data_version()
+        offset = _parse_page_token(page_token, normalized, version) if page_token else 0
+        # only validated queries are ever cached, so a hit skips validation too
+        cache_key = (str(pool.db_path), normalized, max_rows, offset)
+        if cache is not None:
+            cached = cache.get(cache_key, version)
+            if cached is not None:
+                return cached
 
-        conn = _connect_readonly(p)
-        try:
-            cur = conn.execute(limited)
-            fetched = cur.fetchall()
+        _ensure_single_statement(scan)
+        _ensure_readonly(scan)
+        limited = _apply_row_limit(scan, max_rows, offset)
+        # one extra row tells whether another page exists; a kept user LIMIT is the last page
+        executed = limited if limited == normalized else _apply_row_limit(scan, max_rows + 1, offset)
+
+        rows: list[tuple[Any, ...]] = []
+        with pool.connection() as conn:
+            cur = conn.execute(executed)
             columns = [d[0] for d in cur.description] if cur.description else []
-            rows = [[row[col] for col in columns] for row in fetched]
-            return {
-                "ok": True,
-                "query": limited,
-                "columns": columns,
-                "rows": rows,
-                "row_count": len(rows),
-                "error": None,
-            }
-        finally:
-            conn.close()
+            while len(rows) <= max_rows:
+                batch = cur.fetchmany(min(FETCH_BATCH_SIZE, max_rows + 1 - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+            cur.close()
+        has_more = len(rows) > max_rows
+        del rows[max_rows:]
+        result = {
+            "ok": True,
+            "query": limited,
+            "columns": columns,
+            "rows": rows,
+            "row_count": len(rows),
+            "next_page_token": _make_page_token(normalized, version, offset + max_rows) if has_more else None,
+            "error": None,
+        }
+        if cache is not None:
+            cache.put(cache_key, version, result)
+        return result
 
     except UnsafeSQLError as e:
         return {
@@ -167,8 +525,19 @@ def run_sql_query(db_path: str, query: str, max_rows: int = 200) -> dict[str, An
             "columns": [],
             "rows": [],
             "row_count": 0,
+            "next_page_token": None,
             "error": f"Unsafe SQL: {e}",
         }
+    except PageTokenError as e:
+        return {
+            "ok": False,
+            "query": normalized,
+            "columns": [],
+            "rows": [],
+            "row_count": 0,
+            "next_page_token": None,
+            "error": str(e),
+        }
     except sqlite3.Error as e:
         return {
             "ok": False,
@@ -176,10 +545,125 @@ def run_sql_query(db_path: str, query: str, max_rows: int = 200) -> dict[str, An
             "columns": [],
             "rows": [],
             "row_count": 0,
-            "error": f"SQLite error: {e}",
+            "next_page_token": None,
+            "error": f"Unsafe SQL: {e}" if _is_auth_error(e) else f"SQLite error: {e}",
         }
 
 
+def iter_query_pages(
+    db_path: str,
+    query: str,
+    page_size: int = 200,
+    pool: ReadOnlyPool | None = None,
+    cache: QueryResultCache | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield run_sql_query results page by page (stops after the last page or the first error).
+    Pages bypass the result cache by default: a streamed large result is usually read once.
+    """
+    token: str | None = None
+    while True:
+        page = run_sql_query(db_path, query, max_rows=page_size, pool=pool, cache=cache, page_token=token)
+        yield page
+        token = page["next_page_token"]
+        if not page["ok"] or not token:
+            return
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+_SEARCH_FILTERS = ("category", "brand", "color", "min_price_cents", "max_price_cents", "in_stock")
+_SEARCH_TERM_RE = re.compile(r"\w+")
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def search_products(
+    db_path: str,
+    text: str,
+    filters: dict[str, Any] | None = None,
+    limit: int = SEARCH_DEFAULT_LIMIT,
+    pool: ReadOnlyPool | None = None,
+    cache: QueryResultCache | None = result_cache,
+) -> dict[str, Any]:
+    """
+    Find products by words of their name/brand, ranked by relevance.
+
+    Every word must match as a prefix ("iph 15" finds "iPhone 15 Pro"). Uses the
+    products_fts index (see init_db.SCHEMA_FTS_SQL); databases created before it
+    fall back to LIKE scans. `filters` may contain category, brand, color (exact,
+    case-insensitive), min_price_cents, max_price_cents and in_stock.
+
+    Returns:
+      run_sql_query result (executed SQL in "query") plus
+      "engine": "fts5" | "like" | "filters" (no search words given)
+    """
+    filters = filters or {}
+    unknown = sorted(set(filters) - set(_SEARCH_FILTERS))
+    terms = _SEARCH_TERM_RE.findall(text or "")
+    try:
+        if unknown:
+            raise ValueError(f"Unknown filter(s): {', '.join(unknown)}. Allowed: {', '.join(_SEARCH_FILTERS)}")
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+        where: list[str] = []
+        for key, column in (("category", "c.name"), ("brand", "p.brand"), ("color", "p.color")):
+            if filters.get(key) not in (None, ""):
+                where.append(f"{column} = {_sql_literal(str(filters[key]))} COLLATE NOCASE")
+        if filters.get("min_price_cents") is not None:
+            where.append(f"p.price_cents >= {int(filters['min_price_cents'])}")
+        if filters.get("max_price_cents") is not None:
+            where.append(f"p.price_cents <= {int(filters['max_price_cents'])}")
+        if filters.get("in_stock"):
+            where.append("p.quantity > 0")
+    except (TypeError, ValueError) as e:
+        return {
+            "ok": False,
+            "query": text,
+            "columns": [],
+            "rows": [],
+            "row_count": 0,
+            "next_page_token": None,
+            "error": f"Invalid search arguments: {e}",
+            "engine": None,
+        }
+
+    source = "products p"
+    order = "p.name"
+    engine = "filters"
+    brand_terms = _SEARCH_TERM_RE.findall(str(filters.get("brand") or ""))
+    if terms or brand_terms:
+        fts = run_sql_query(
+            db_path,
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'",
+            pool=pool,
+            cache=cache,
+        )
+        if fts["ok"] and fts["row_count"]:
+            # The brand column filter only narrows candidates through the index (brand = ... COLLATE
+            # NOCASE cannot use idx_products_brand); the exact brand check above still applies.
+            engine = "fts5" if terms else "filters"
+            source = "products_fts JOIN products p ON p.id = products_fts.rowid"
+            order = "products_fts.rank" if terms else "p.name"
+            match = " ".join([f'"{t}"*' for t in terms] + [f'brand : "{t}"' for t in brand_terms])
+            where.insert(0, f"products_fts MATCH {_sql_literal(match)}")  # \w+ terms never contain quotes
+        elif terms:
+            engine = "like"
+            for t in terms:
+                pattern = _sql_literal("%" + t.replace("_", "\\_") + "%")
+                where.insert(0, f"(p.name LIKE {pattern} ESCAPE '\\' OR p.brand LIKE {pattern} ESCAPE '\\')")
+
+    sql = (
+        "SELECT p.id, p.name, c.name AS category, p.brand, p.color, p.quantity, p.price_cents "
+        f"FROM {source} JOIN categories c ON c.id = p.category_id"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + f" ORDER BY {order} LIMIT {limit}"
+    )
+    result = run_sql_query(db_path, sql, max_rows=limit, pool=pool, cache=cache)
+    return {**result, "engine": engine}
+
+
 def tool_result_to_json(result: dict[str, Any]) -> str:
     """Stable JSON for sending back to the model as tool output."""
     return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
\ No newline at end of file
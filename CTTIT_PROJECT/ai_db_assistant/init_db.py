@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import argparse
+import itertools
 import os
+import random
 import sqlite3
+import time
 from pathlib import Path
+from typing import Iterator
 
 
-SCHEMA_SQL = """
+SCHEMA_TABLES_SQL = """
 PRAGMA foreign_keys = ON;
 
 CREATE TABLE IF NOT EXISTS categories (
@@ -23,11 +28,42 @@ CREATE TABLE IF NOT EXISTS products (
     brand TEXT,
     FOREIGN KEY (category_id) REFERENCES categories(id)
 );
+"""
 
+# Kept separate so bulk loads can build indexes once, after the data is in
+SCHEMA_INDEXES_SQL = """
 CREATE INDEX IF NOT EXISTS idx_products_category_id ON products(category_id);
 CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+CREATE INDEX IF NOT EXISTS idx_products_price_cents ON products(price_cents);
+CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand);
 """
 
+# Full-text index over product name/brand (external content: text lives only in products).
+# Triggers keep it in sync; prefix indexes make "iph*"-style lookups cheap.
+SCHEMA_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, brand,
+    content='products', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name, brand) VALUES (new.id, new.name, new.brand);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand);
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, brand ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand);
+    INSERT INTO products_fts (rowid, name, brand) VALUES (new.id, new.name, new.brand);
+END;
+"""
+
+SCHEMA_SQL = SCHEMA_TABLES_SQL + SCHEMA_INDEXES_SQL + SCHEMA_FTS_SQL
+
 
 SEED_SQL = """
 INSERT OR IGNORE INTO categories (name) VALUES
@@ -59,6 +95,15 @@ INSERT OR IGNORE INTO products (name, category_id, price_cents, quantity, color,
 """
 
 
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def rebuild_fts(conn: sqlite3.Connection) -> None:
+    # Re-index all products (FTS table created after the rows, or suspected out of sync)
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
 def init_db(db_path: Path) -> None:
     db_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -66,16 +111,159 @@ def init_db(db_path: Path) -> None:
     try:
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
+        had_fts = _has_table(conn, "products_fts")
         conn.executescript(SCHEMA_SQL)
+        if not had_fts:
+            rebuild_fts(conn)  # DB created before the FTS index existed
         conn.executescript(SEED_SQL)
         conn.commit()
     finally:
         conn.close()
 
 
+# ---- Synthetic catalog (benchmarks) ----
+
+_NOUNS = (
+    "Phone", "Laptop", "Tablet", "Headphones", "Earbuds", "Watch", "Monitor", "Keyboard", "Mouse", "Charger",
+    "Cable", "Case", "Speaker", "Camera", "Router", "Drive", "Console", "Projector", "Microphone", "Dock",
+)
+_SERIES = ("Pro", "Max", "Air", "Mini", "Ultra", "Lite", "Plus", "X", "S", "Neo", "Edge", "One")
+_COLORS = (
+    "Black", "White", "Gray", "Silver", "Gold", "Blue", "Navy", "Red", "Green", "Olive", "Yellow", "Orange",
+    "Pink", "Purple", "Beige", "Brown", "Graphite", "Midnight", "Starlight", "Teal",
+)
+_SYLLABLES = ("ka", "lo", "mi", "ra", "to", "ne", "vi", "zu", "an", "or", "el", "ix", "sa", "po", "de", "qu")
+
+
+def _make_names(rng: random.Random, count: int, syllables: int) -> list[str]:
+    names: set[str] = set()
+    space = len(_SYLLABLES) ** syllables
+    while len(names) < count:
+        name = "".join(rng.choice(_SYLLABLES) for _ in range(syllables)).capitalize()
+        if len(names) >= space // 2:  # running out of combinations: disambiguate with a number
+            name = f"{name} {len(names)}"
+        names.add(name)
+    return sorted(names)
+
+
+def _product_rows(
+    rng: random.Random, count: int, category_ids: list[int], brands: list[str]
+) -> Iterator[tuple[str, int, int, int, str, str]]:
+    # (name, category_id, price_cents, quantity, color, brand); prices are log-uniform 1.00 .. 10000.00
+    for _ in range(count):
+        brand = rng.choice(brands)
+        name = f"{brand} {rng.choice(_NOUNS)} {rng.choice(_SERIES)} {rng.randint(1, 999)}"
+        price_cents = int(10 ** rng.uniform(2, 6))
+        yield name, rng.choice(category_ids), price_cents, rng.randint(0, 500), rng.choice(_COLORS), brand
+
+
+def generate_catalog(
+    db_path: Path,
+    products: int = 1_000_000,
+    categories: int = 2_000,
+    brands: int = 500,
+    seed: int = 42,
+    batch_size: int = 50_000,
+) -> dict[str, float]:
+    """
+    Build a large synthetic shop DB (same schema as init_db) for benchmarks.
+
+    Loads with journal_mode=OFF / synchronous=OFF in large executemany transactions,
+    creates the indexes and the FTS index after the data is in (one rebuild instead of a
+    trigger per row), runs ANALYZE and leaves the DB in WAL mode.
+    The target file must not exist. Deterministic for a given seed.
+
+    Returns:
+      {"load_sec": float, "index_sec": float, "fts_sec": float, "analyze_sec": float, "rows_per_sec": float}
+    """
+    if db_path.exists():
+        raise FileExistsError(f"{db_path} already exists; remove it or choose another path")
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Nothing to protect while loading a throwaway file: no journal, no fsync
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-262144")  # 256 MiB, mostly for index builds
+        conn.executescript(SCHEMA_TABLES_SQL)
+
+        t0 = time.perf_counter()
+        category_names = [f"{noun} {name}" for noun, name in zip(
+            itertools.cycle(_NOUNS), _make_names(rng, categories, 3)
+        )]
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO categories (name) VALUES (?)", ((n,) for n in category_names))
+        conn.execute("COMMIT")
+        category_ids = [row[0] for row in conn.execute("SELECT id FROM categories")]
+        brand_names = _make_names(rng, brands, 3)
+
+        rows = _product_rows(rng, products, category_ids, brand_names)
+        while batch := list(itertools.islice(rows, batch_size)):
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO products (name, category_id, price_cents, quantity, color, brand) VALUES (?, ?, ?, ?, ?, ?)",
+                batch,
+            )
+            conn.execute("COMMIT")
+        load_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        conn.executescript(SCHEMA_INDEXES_SQL)
+        index_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        conn.executescript(SCHEMA_FTS_SQL)
+        rebuild_fts(conn)
+        fts_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        conn.execute("ANALYZE")  # sqlite_stat1: better plans and row estimates for the schema hint
+        analyze_sec = time.perf_counter() - t0
+
+        conn.execute("PRAGMA locking_mode=NORMAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    finally:
+        conn.close()
+    return {
+        "load_sec": round(load_sec, 2),
+        "index_sec": round(index_sec, 2),
+        "fts_sec": round(fts_sec, 2),
+        "analyze_sec": round(analyze_sec, 2),
+        "rows_per_sec": round(products / load_sec) if load_sec else 0.0,
+    }
+
+
 def main() -> None:
+    ap = argparse.ArgumentParser(description="Create the shop DB (demo seed or a large synthetic catalog).")
+    ap.add_argument("--synthetic", action="store_true", help="generate a large synthetic catalog instead of the demo seed")
+    ap.add_argument("--db", default=None, help="DB path (default: $DB_PATH or data/shop.db; data/bench.db with --synthetic)")
+    ap.add_argument("--products", type=int, default=1_000_000)
+    ap.add_argument("--categories", type=int, default=2_000)
+    ap.add_argument("--brands", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--batch-size", type=int, default=50_000)
+    args = ap.parse_args()
+
+    if args.synthetic:
+        db_path = Path(args.db or Path(__file__).with_name("data") / "bench.db")
+        stats = generate_catalog(
+            db_path,
+            products=args.products,
+            categories=args.categories,
+            brands=args.brands,
+            seed=args.seed,
+            batch_size=args.batch_size,
+        )
+        print(f"OK: generated {args.products} products at: {db_path} {stats}")
+        return
+
     # Default: ./data/shop.db
-    db_path = Path(os.getenv("DB_PATH", Path(__file__).with_name("data") / "shop.db"))
+    db_path = Path(args.db or os.getenv("DB_PATH", Path(__file__).with_name("data") / "shop.db"))
     init_db(db_path)
     print(f"OK: initialized DB at: {db_path}")
 
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import dataclass
-from typing import Any, Optional
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
 
 from openai import OpenAI
 
@@ -59,4 +59,108 @@ def chat_once(
         kwargs["tools"] = tools
         kwargs["tool_choice"] = "auto"
 
-    return client.chat.completions.create(**kwargs)
\ No newline at end of file
+    return client.chat.completions.create(**kwargs)
+
+
+@dataclass
+class StreamedFunction:
+    name: str = ""
+    arguments: str = ""
+
+
+@dataclass
+class StreamedToolCall:
+    id: str = ""
+    type: str = "function"
+    function: StreamedFunction = field(default_factory=StreamedFunction)
+
+    def model_dump(self) -> dict[str, Any]:
+        # Same shape as the SDK's ChatCompletionMessageToolCall.model_dump()
+        return {
+            "id": self.id,
+            "type": self.type,
+            "function": {"name": self.function.name, "arguments": self.function.arguments},
+        }
+
+
+@dataclass
+class StreamedMessage:
+    """Assistant message assembled from stream chunks; duck-types the SDK message for extract_text/tool_calls."""
+
+    role: str = "assistant"
+    content: str = ""
+    tool_calls: Optional[list[StreamedToolCall]] = None
+    finish_reason: Optional[str] = None
+
+
+def _merge_tool_call_deltas(calls: list[StreamedToolCall], deltas: list[Any]) -> None:
+    """
+    Tool calls arrive in fragments: the first delta of a call carries its index, id and
+    name, later ones only more `arguments` text. Some local servers omit `index`
+    (then a delta with a new id starts a new call) or repeat id/name in every chunk.
+    """
+    for d in deltas:
+        index = getattr(d, "index", None)
+        d_id = getattr(d, "id", None)
+        if index is None:
+            starts_new = not calls or bool(d_id and calls[-1].id and calls[-1].id != d_id)
+            index = len(calls) if starts_new else len(calls) - 1
+        while len(calls) <= index:
+            calls.append(StreamedToolCall())
+        call = calls[index]
+        if d_id and not call.id:
+            call.id = d_id
+        fn = getattr(d, "function", None)
+        if fn is not None:
+            if fn.name and not call.function.name:
+                call.function.name = fn.name
+            if fn.arguments:
+                call.function.arguments += fn.arguments
+
+
+def chat_stream(
+    client: OpenAI,
+    cfg: LLMConfig,
+    messages: list[dict[str, Any]],
+    tools: Optional[list[dict[str, Any]]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+) -> StreamedMessage:
+    """
+    Streaming variant of chat_once. `on_text` is called with the accumulated
+    content after every text delta; the assembled message is returned at the end.
+    """
+    kwargs: dict[str, Any] = {
+        "model": cfg.model,
+        "messages": messages,
+        "temperature": cfg.temperature,
+        "max_tokens": cfg.max_tokens,
+        "stream": True,
+    }
+    if tools is not None:
+        kwargs["tools"] = tools
+        kwargs["tool_choice"] = "auto"
+
+    msg = StreamedMessage()
+    text = ""
+    calls: list[StreamedToolCall] = []
+    for chunk in client.chat.completions.create(**kwargs):
+        if not chunk.choices:
+            continue  # e.g. a trailing usage-only chunk
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta is not None:
+            if delta.content:
+                text += delta.content
+                if on_text is not None:
+                    on_text(text)
+            if delta.tool_calls:
+                _merge_tool_call_deltas(calls, delta.tool_calls)
+        if choice.finish_reason:
+            msg.finish_reason = choice.finish_reason
+
+    msg.content = text
+    for i, call in enumerate(calls):
+        if not call.id:
+            call.id = f"call_{i}"  # some local servers do not send ids; the tool message needs one
+    msg.tool_calls = calls or None
+    return msg
@@ -16,23 +16,41 @@ Table: products
 - quantity INTEGER NOT NULL
 - color TEXT
 - brand TEXT
+"""
 
+# Domain knowledge that introspection cannot recover; appended to any schema hint
+DB_SCHEMA_NOTES = """
 Notes:
 - Use JOIN products.category_id = categories.id to filter by category name.
 - price is stored in cents; if user asks in rubles/dollars, you can still present price_cents/100 with explanation.
 """
 
 
-SYSTEM_PROMPT = f"""
+SYSTEM_PROMPT_TEMPLATE = """
 Ты — ассистент магазина гаджетов. Твоя задача — отвечать на вопросы пользователя на основе данных из SQLite.
 Если для ответа нужны актуальные данные из БД — используй инструмент run_sql_query.
+Для поиска товаров по словам из названия или бренда используй search_products (быстрый полнотекстовый поиск) вместо LIKE '%...%'.
 
 Жёсткие правила:
 - Никогда не выдумывай наличие/цены/остатки. Если нужны данные — делай запрос к БД.
 - Разрешены только SELECT/WITH запросы. Никаких INSERT/UPDATE/DELETE/DDL.
 - Возвращай компактные ответы. Если список длинный — покажи топ/первые позиции и предложи уточнить.
 - Для больших выборок добавляй фильтры и сортировку.
+- Результат инструмента постраничный: если есть next_page_token, следующие строки можно получить тем же query с page_token.
+- Результат приходит компактно (tsv/csv/columns; \\N в tsv — это NULL). format: summary значит, что показаны только первые строки и статистика по столбцам.
 - Учитывай, что цена хранится в price_cents (в центах).
 
-{DB_SCHEMA_HINT}
-""".strip()
\ No newline at end of file
+{schema_hint}
+""".strip()
+
+
+def build_system_prompt(schema_hint: str | None = None) -> str:
+    """
+    System prompt with the given schema hint (normally schema.get_schema_hint for the
+    current DB); falls back to the hand-written DB_SCHEMA_HINT.
+    """
+    hint = (schema_hint or DB_SCHEMA_HINT).strip()
+    return SYSTEM_PROMPT_TEMPLATE.format(schema_hint=hint + "\n" + DB_SCHEMA_NOTES)
+
+
+SYSTEM_PROMPT = build_system_prompt()
\ No newline at end of file
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from db import tool_result_to_json
+
+try:  # optional: exact token counts for OpenAI-style BPE vocabularies
+    import tiktoken
+except ImportError:  # pragma: no cover - depends on the environment
+    tiktoken = None
+
+
+# Prompt tokens a single tool result may take; larger results are summarized
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "1500"))
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "cl100k_base")
+SUMMARY_TOP_VALUES = 3
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens with tiktoken when it is installed, otherwise
+    estimates them as UTF-8 bytes / 4 (method tells which one is used).
+    """
+
+    def __init__(self, encoding_name: str = TIKTOKEN_ENCODING) -> None:
+        self._encoding = None
+        self.method = "bytes/4"
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+                self.method = f"tiktoken:{encoding_name}"
+            except Exception:
+                self._encoding = None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return (len(text.encode("utf-8")) + 3) // 4
+
+
+_default_counter: TokenCounter | None = None
+
+
+def get_token_counter() -> TokenCounter:
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+@dataclass(frozen=True)
+class EncodedResult:
+    text: str
+    format: str           # json | tsv | csv | columns | summary
+    tokens: int
+    json_tokens: int      # what the plain tool_result_to_json output would cost
+    lossless: bool        # False for summary (rows were dropped)
+    counter: str          # token counting method
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.json_tokens - self.tokens
+
+
+def _header(result: dict[str, Any], fmt: str, shown: int | None = None) -> str:
+    lines = [f"ok: true; format: {fmt}; rows: {result['row_count']}"]
+    if shown is not None and shown < result["row_count"]:
+        lines.append(f"showing first {shown} rows; refine the query (filters/aggregates) to see the rest")
+    if result.get("next_page_token"):
+        lines.append(f"more rows available: next_page_token={result['next_page_token']}")
+    return "\n".join(lines) + "\n"
+
+
+def _tsv_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def encode_tsv(result: dict[str, Any], rows: list[Any] | None = None, fmt: str = "tsv") -> str:
+    # NULL is written as \N, tabs/newlines inside values are escaped
+    rows = result["rows"] if rows is None else rows
+    body = ["\t".join(result["columns"])]
+    body.extend("\t".join(_tsv_value(v) for v in row) for row in rows)
+    shown = len(rows) if fmt == "summary" else None
+    return _header(result, fmt, shown) + "\n".join(body)
+
+
+def encode_csv(result: dict[str, Any]) -> str:
+    # RFC 4180 quoting; NULL is an empty field
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(result["columns"])
+    writer.writerows(result["rows"])
+    return _header(result, "csv") + buf.getvalue().rstrip("\n")
+
+
+def encode_columns(result: dict[str, Any]) -> str:
+    # Column-major JSON: each column name once, values as arrays
+    columns = {name: [row[i] for row in result["rows"]] for i, name in enumerate(result["columns"])}
+    return _header(result, "columns") + json.dumps(columns, ensure_ascii=False, separators=(",", ":"))
+
+
+def column_stats(result: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """
+    Per-column stats over the returned rows.
+
+    Returns:
+      {column: {"nulls": int, "min": .., "max": .., "avg": ..}}            (numeric)
+      {column: {"nulls": int, "distinct": int, "top": [[value, count], ...]}}  (other)
+    """
+    stats: dict[str, dict[str, Any]] = {}
+    for i, name in enumerate(result["columns"]):
+        values = [row[i] for row in result["rows"]]
+        present = [v for v in values if v is not None]
+        col: dict[str, Any] = {"nulls": len(values) - len(present)}
+        if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            col.update(min=min(present), max=max(present), avg=round(sum(present) / len(present), 4))
+        else:
+            counts = Counter(str(v) for v in present)
+            col["distinct"] = len(counts)
+            col["top"] = [[v, n] for v, n in counts.most_common(SUMMARY_TOP_VALUES)]
+        stats[name] = col
+    return stats
+
+
+def encode_summary(result: dict[str, Any], top_n: int, stats: dict[str, dict[str, Any]] | None = None) -> str:
+    stats = column_stats(result) if stats is None else stats
+    table = encode_tsv(result, rows=result["rows"][:top_n], fmt="summary")
+    return table + "\ncolumn stats (over all returned rows): " + json.dumps(
+        stats, ensure_ascii=False, separators=(",", ":"), default=str
+    )
+
+
+_LOSSLESS_ENCODERS: dict[str, Callable[[dict[str, Any]], str]] = {
+    "tsv": encode_tsv,
+    "csv": encode_csv,
+    "columns": encode_columns,
+}
+
+
+def encode_tool_result(
+    result: dict[str, Any],
+    budget_tokens: int = TOOL_RESULT_TOKEN_BUDGET,
+    counter: TokenCounter | None = None,
+) -> EncodedResult:
+    """
+    Encode a run_sql_query result for the model in as few prompt tokens as possible.
+
+    The cheapest lossless encoding (TSV/CSV/column-major) is used if it fits
+    `budget_tokens`; otherwise a summary with row count, per-column stats and as many
+    leading rows as fit. Errors are sent as plain JSON.
+    """
+    counter = counter or get_token_counter()
+    baseline = tool_result_to_json(result)
+    json_tokens = counter.count(baseline)
+    if not result.get("ok") or not result.get("columns"):
+        return EncodedResult(baseline, "json", json_tokens, json_tokens, True, counter.method)
+
+    best_text, best_fmt, best_tokens = baseline, "json", json_tokens
+    for fmt, encoder in _LOSSLESS_ENCODERS.items():
+        text = encoder(result)
+        tokens = counter.count(text)
+        if tokens < best_tokens:
+            best_text, best_fmt, best_tokens = text, fmt, tokens
+    if best_tokens <= budget_tokens or not result["rows"]:
+        return EncodedResult(best_text, best_fmt, best_tokens, json_tokens, True, counter.method)
+
+    # Largest top-N that keeps the summary within budget (at least the stats are sent)
+    stats = column_stats(result)
+    lo, hi = 0, len(result["rows"]) - 1
+    text = encode_summary(result, 0, stats)
+    tokens = counter.count(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = encode_summary(result, mid, stats)
+        candidate_tokens = counter.count(candidate)
+        if candidate_tokens <= budget_tokens:
+            lo, text, tokens = mid, candidate, candidate_tokens
+        else:
+            hi = mid - 1
+    return EncodedResult(text, "summary", tokens, json_tokens, False, counter.method)
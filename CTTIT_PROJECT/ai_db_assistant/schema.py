@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from db import ReadOnlyPool, get_pool
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    type: str
+    notnull: bool
+    pk: bool
+    default: str | None
+
+
+@dataclass(frozen=True)
+class IndexInfo:
+    name: str
+    columns: tuple[str, ...]
+    unique: bool
+    origin: str  # c = CREATE INDEX, u = UNIQUE constraint, pk = PRIMARY KEY
+
+
+@dataclass(frozen=True)
+class ForeignKeyInfo:
+    column: str
+    ref_table: str
+    ref_column: str | None
+
+
+@dataclass(frozen=True)
+class TableInfo:
+    name: str
+    kind: str  # table | view | virtual
+    columns: tuple[ColumnInfo, ...]
+    indexes: tuple[IndexInfo, ...] = ()
+    foreign_keys: tuple[ForeignKeyInfo, ...] = ()
+    row_estimate: int | None = None
+    module: str | None = None  # virtual tables: fts5, rtree, ...
+
+
+_VIRTUAL_MODULE_RE = re.compile(r"^\s*CREATE\s+VIRTUAL\s+TABLE\b.*?\bUSING\s+(\w+)", re.IGNORECASE | re.DOTALL)
+# Storage tables SQLite creates for FTS / R-Tree virtual tables; never queried directly
+_SHADOW_SUFFIXES = ("_data", "_idx", "_content", "_docsize", "_config", "_node", "_parent", "_rowid")
+
+
+@dataclass
+class SchemaSnapshot:
+    version: Any
+    tables: list[TableInfo] = field(default_factory=list)
+    hint: str = ""
+
+
+def _row_estimate(conn: sqlite3.Connection, table: str) -> int | None:
+    """
+    Cheap row count: sqlite_stat1 (after ANALYZE) if present, else max(rowid),
+    which is an index lookup and exact unless rows were deleted.
+    """
+    try:
+        row = conn.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1", (table,)
+        ).fetchone()
+        if row and row[0]:
+            return int(str(row[0]).split()[0])
+    except sqlite3.Error:
+        pass  # no sqlite_stat1 (ANALYZE never ran)
+    try:
+        row = conn.execute(f'SELECT max(rowid) FROM "{table.replace(chr(34), chr(34) * 2)}"').fetchone()
+    except sqlite3.Error:
+        return None  # WITHOUT ROWID table
+    return int(row[0] or 0)
+
+
+def introspect_schema(conn: sqlite3.Connection) -> list[TableInfo]:
+    """Read tables/views, columns, indexes, foreign keys and row estimates from an open connection."""
+    objects = conn.execute(
+        "SELECT name, type, sql FROM sqlite_master "
+        "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY type, name"
+    ).fetchall()
+    modules = {name: m.group(1).lower() for name, _, sql in objects if (m := _VIRTUAL_MODULE_RE.match(sql or ""))}
+    shadows = {v + suffix for v in modules for suffix in _SHADOW_SUFFIXES}
+    tables: list[TableInfo] = []
+    for name, kind, _sql in objects:
+        if name in shadows:
+            continue
+        columns = tuple(
+            ColumnInfo(name=c_name, type=c_type or "", notnull=bool(notnull), pk=bool(pk), default=dflt)
+            for _cid, c_name, c_type, notnull, dflt, pk in conn.execute(
+                "SELECT cid, name, type, \"notnull\", dflt_value, pk FROM pragma_table_info(?) ORDER BY cid", (name,)
+            )
+        )
+        if kind == "view":
+            tables.append(TableInfo(name=name, kind=kind, columns=columns))
+            continue
+        if name in modules:
+            tables.append(TableInfo(name=name, kind="virtual", columns=columns, module=modules[name]))
+            continue
+
+        indexes = []
+        for idx_name, unique, origin in conn.execute(
+            "SELECT name, \"unique\", origin FROM pragma_index_list(?) ORDER BY name", (name,)
+        ).fetchall():
+            idx_columns = tuple(
+                c for (c,) in conn.execute("SELECT name FROM pragma_index_info(?) ORDER BY seqno", (idx_name,))
+            )
+            indexes.append(IndexInfo(name=idx_name, columns=idx_columns, unique=bool(unique), origin=origin))
+        foreign_keys = tuple(
+            ForeignKeyInfo(column=col, ref_table=ref_table, ref_column=ref_col)
+            for col, ref_table, ref_col in conn.execute(
+                "SELECT \"from\", \"table\", \"to\" FROM pragma_foreign_key_list(?) ORDER BY id, seq", (name,)
+            )
+        )
+        tables.append(
+            TableInfo(
+                name=name,
+                kind=kind,
+                columns=columns,
+                indexes=tuple(indexes),
+                foreign_keys=foreign_keys,
+                row_estimate=_row_estimate(conn, name),
+            )
+        )
+    return tables
+
+
+def render_schema_hint(tables: list[TableInfo]) -> str:
+    """
+    Compact, prompt-friendly schema description. One line per table:
+      products (~13 rows): id INTEGER PK, category_id INTEGER NOT NULL -> categories.id, ...
+    followed by the explicitly created indexes.
+    """
+    lines = ["SQLite schema:"]
+    for t in tables:
+        fks = {fk.column: fk for fk in t.foreign_keys}
+        unique_cols = {i.columns[0] for i in t.indexes if i.unique and len(i.columns) == 1}
+        parts = []
+        for c in t.columns:
+            desc = f"{c.name} {c.type}".rstrip()
+            if c.pk:
+                desc += " PK"
+            elif c.notnull:
+                desc += " NOT NULL"
+            if c.name in unique_cols and not c.pk:
+                desc += " UNIQUE"
+            fk = fks.get(c.name)
+            if fk is not None:
+                desc += f" -> {fk.ref_table}.{fk.ref_column or 'id'}"
+            parts.append(desc)
+        size = f" (~{t.row_estimate} rows)" if t.row_estimate is not None else ""
+        label = {"view": "view ", "virtual": f"virtual ({t.module}) "}.get(t.kind, "")
+        lines.append(f"{label}{t.name}{size}: " + ", ".join(parts))
+        created = [i for i in t.indexes if i.origin == "c"]
+        if created:
+            lines.append("  indexes: " + ", ".join(f"{i.name}({', '.join(i.columns)})" for i in created))
+    return "\n".join(lines)
+
+
+_SCHEMAS: dict[str, SchemaSnapshot] = {}
+_SCHEMAS_LOCK = threading.Lock()
+
+
+def get_schema(db_path: str | Path, pool: ReadOnlyPool | None = None) -> SchemaSnapshot:
+    """
+    Schema of db_path, introspected once per database version (see ReadOnlyPool.data_version)
+    and cached for the process. Raises sqlite3.Error if the database cannot be read.
+    """
+    pool = pool or get_pool(db_path)
+    version = pool.data_version()
+    key = str(pool.db_path)
+    with _SCHEMAS_LOCK:
+        cached = _SCHEMAS.get(key)
+    if cached is not None and cached.version == version:
+        return cached
+
+    with pool.connection() as conn:
+        tables = introspect_schema(conn)
+    snapshot = SchemaSnapshot(version=version, tables=tables, hint=render_schema_hint(tables))
+    with _SCHEMAS_LOCK:
+        _SCHEMAS[key] = snapshot
+    return snapshot
+
+
+def get_schema_hint(db_path: str | Path, pool: ReadOnlyPool | None = None) -> str | None:
+    """Rendered schema hint, or None if the database is missing or unreadable."""
+    if not Path(db_path).exists():
+        return None
+    try:
+        return get_schema(db_path, pool=pool).hint
+    except sqlite3.Error:
+        return None
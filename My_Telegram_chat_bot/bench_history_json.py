@@ -0,0 +1,80 @@
+"""
+Benchmark: history file write time vs history size.
+
+Compares the serializers used by bot6.atomic_write_json:
+  - indent=4 (stdlib json, old format)
+  - compact (orjson if installed, otherwise stdlib json without whitespace)
+
+Usage:
+    python bench_history_json.py [--sizes 100,1000,5000,20000] [--repeat 5]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+# bot6 reads its config at import time: keep the benchmark away from real data.
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_history_")
+os.environ.setdefault("HISTORY_DIR", os.path.join(_TMP_DIR, "history_users"))
+os.environ.setdefault("HISTORY_FILE", os.path.join(_TMP_DIR, "history.json"))
+os.environ.setdefault("SETTINGS_FILE", os.path.join(_TMP_DIR, "settings.json"))
+
+from bot6 import atomic_write_json, load_json_file, orjson  # noqa: E402
+
+
+def make_history(n_messages: int) -> List[Dict[str, Any]]:
+    history: List[Dict[str, Any]] = [{"role": "system", "content": "Ты полезный ассистент. " * 20}]
+    for i in range(n_messages):
+        if i % 2 == 0:
+            history.append({"role": "user", "content": [{"type": "text", "text": f"Вопрос №{i}: " + "как дела? " * 15}]})
+        else:
+            history.append({"role": "assistant", "content": f"Ответ №{i}: " + "всё хорошо, спасибо. " * 30})
+    return history
+
+
+def bench_write(path: str, data: Any, compact: bool, repeat: int) -> float:
+    times: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        atomic_write_json(path, data, compact=compact)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="100,1000,5000,20000", help="history sizes (messages), comma separated")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    compact_name = "orjson" if orjson is not None else "json(compact)"
+
+    print(f"{'messages':>9} | {'indent ms':>10} {'indent KB':>10} | {compact_name + ' ms':>14} {'compact KB':>10} | {'speedup':>7}")
+    print("-" * 75)
+    for n in sizes:
+        data = make_history(n)
+        p_indent = os.path.join(_TMP_DIR, f"indent_{n}.json")
+        p_compact = os.path.join(_TMP_DIR, f"compact_{n}.json")
+
+        t_indent = bench_write(p_indent, data, compact=False, repeat=args.repeat)
+        t_compact = bench_write(p_compact, data, compact=True, repeat=args.repeat)
+
+        # sanity: both formats load back to the same data
+        assert load_json_file(p_indent) == load_json_file(p_compact) == data
+
+        kb_indent = os.path.getsize(p_indent) / 1024
+        kb_compact = os.path.getsize(p_compact) / 1024
+        speedup = t_indent / t_compact if t_compact > 0 else float("inf")
+        print(
+            f"{n:>9} | {t_indent * 1000:>10.2f} {kb_indent:>10.0f} | "
+            f"{t_compact * 1000:>14.2f} {kb_compact:>10.0f} | {speedup:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: token counting throughput per tokenizer backend.
+
+Backends (see bot6.TokenEstimator):
+  - chars     len(text) // 3
+  - tiktoken  cl100k_base (if tiktoken is installed)
+  - hf        every *.json in TOKENIZERS_DIR / --files (if tokenizers is installed)
+
+For each backend: one text per call (cold cache), encode_batch over all texts
+(cold cache) and a second pass that is served from the LRU cache.
+
+Usage:
+    python bench_tokenizers.py [--messages 2000] [--files tokenizers/qwen2.json,...]
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import tempfile
+import time
+from typing import Callable, List
+
+# bot6 reads its config at import time: keep the benchmark away from real data.
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_tokenizers_")
+os.environ.setdefault("HISTORY_DIR", os.path.join(_TMP_DIR, "history_users"))
+os.environ.setdefault("HISTORY_FILE", os.path.join(_TMP_DIR, "history.json"))
+os.environ.setdefault("SETTINGS_FILE", os.path.join(_TMP_DIR, "settings.json"))
+
+from bot6 import TOKENIZERS_DIR, TokenEstimator, hf_tokenizers_module, tiktoken_module  # noqa: E402
+
+
+def make_texts(n: int) -> List[str]:
+    texts: List[str] = []
+    for i in range(n):
+        if i % 3 == 0:
+            texts.append(f"Вопрос №{i}: как настроить nginx reverse proxy? " * 4)
+        elif i % 3 == 1:
+            texts.append(f"Answer #{i}: use `proxy_pass http://127.0.0.1:8080;` inside location / {{ }}. " * 6)
+        else:
+            texts.append(f"def f_{i}(x):\n    return [y * 2 for y in range(x) if y % 3]\n" * 3)
+    return texts
+
+
+def timed(fn: Callable[[], object]) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def bench(name: str, make: Callable[[], TokenEstimator], texts: List[str]) -> None:
+    mb = sum(len(t.encode("utf-8")) for t in texts) / (1024 * 1024)
+    cache = len(texts) * 2
+
+    single = make()
+    single.cache_size = cache
+    t_single = timed(lambda: [single.count_text_tokens(t) for t in texts])
+
+    batch = make()
+    batch.cache_size = cache
+    t_batch = timed(lambda: batch.encode_batch(texts))
+    t_cached = timed(lambda: batch.encode_batch(texts))
+    tokens = sum(batch.encode_batch(texts))
+
+    def rate(sec: float) -> str:
+        return f"{len(texts) / sec:>10.0f} {mb / sec:>7.1f}" if sec > 0 else f"{'inf':>10} {'inf':>7}"
+
+    print(f"{name:<24} | {rate(t_single)} | {rate(t_batch)} | {rate(t_cached)} | {tokens:>9}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=2000, help="number of texts to count")
+    ap.add_argument("--files", default="", help="tokenizer.json files, comma separated (default: TOKENIZERS_DIR/*.json)")
+    args = ap.parse_args()
+
+    texts = make_texts(args.messages)
+    files = [f for f in args.files.split(",") if f.strip()] or sorted(glob.glob(os.path.join(TOKENIZERS_DIR, "*.json")))
+
+    print(f"{'backend':<24} | {'single: texts/s':>10} {'MB/s':>7} | {'batch: texts/s':>10} {'MB/s':>7} | "
+          f"{'cached: texts/s':>10} {'MB/s':>7} | {'tokens':>9}")
+    print("-" * 104)
+    bench("chars", lambda: TokenEstimator("chars"), texts)
+    if tiktoken_module.get() is not None:
+        bench("tiktoken cl100k_base", lambda: TokenEstimator("tiktoken"), texts)
+    else:
+        print("tiktoken: not installed")
+    if hf_tokenizers_module.get() is None:
+        print("hf: `tokenizers` not installed")
+        return
+    for path in files:
+        bench(f"hf {os.path.basename(path)}", lambda p=path: TokenEstimator("hf", p), texts)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,26 +3,54 @@ from __future__ import annotations
 import atexit
 import base64
 import copy
-import io
+import fnmatch
+import gzip
+import hashlib
+import itertools
 import json
 import logging
+import math
 import os
+import queue
+import random
+import re
 import signal
+import sys
 import tempfile
 import threading
 import time
-from collections import defaultdict, deque
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future
 from dataclasses import dataclass, field
-from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
 
-import telebot
-from telebot import types
-from openai import OpenAI
+# name -> seconds, printed by --profile-startup.
+# openai / tiktoken / tokenizers are imported lazily (warmup thread or first use).
+_T_START = time.perf_counter()
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+import telebot  # noqa: E402
+from telebot import types  # noqa: E402
+
+STARTUP_TIMINGS["import telebot"] = time.perf_counter() - _T_START
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None  # type: ignore
 
 try:
-    from tiktoken import get_encoding  # type: ignore
+    import httpx  # type: ignore
 except Exception:  # pragma: no cover
-    get_encoding = None  # type: ignore
+    httpx = None  # type: ignore
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+STARTUP_TIMINGS["import httpx/orjson/zstd"] = time.perf_counter() - _T_START - STARTUP_TIMINGS["import telebot"]
 
 
 # =============================================================================
@@ -38,12 +66,24 @@ if not API_TOKEN:
     raise RuntimeError("Bot token is empty. Set TELEGRAM_BOT_TOKEN or hardcode API_TOKEN.")
 
 BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:1234/v1").strip()
+# второй LM Studio (зеркало с той же моделью) для hedged-запросов; пусто = выключено
+BASE_URL_SECONDARY = os.getenv("OPENAI_BASE_URL_SECONDARY", "").strip()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "lm-studio").strip()
 
-HISTORY_FILE = os.getenv("HISTORY_FILE", "history.json").strip()
+HISTORY_FILE = os.getenv("HISTORY_FILE", "history.json").strip()   # legacy single-file history (migrated once)
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history_users").strip()      # per-user history files
 SETTINGS_FILE = os.getenv("SETTINGS_FILE", "settings.json").strip()
 
+# fallback/потолок контекста, если LM Studio не сообщает loaded context length модели
 TOKEN_LIMIT = int(os.getenv("TOKEN_LIMIT", "16834"))
+# ручные лимиты контекста: "qwen2.5-7b-instruct=32768,llama-3*=8192" (fnmatch, важнее LM Studio)
+MODEL_CONTEXT_OVERRIDES = os.getenv("MODEL_CONTEXT_OVERRIDES", "").strip()
+OUTPUT_TOKENS_RESERVE = int(os.getenv("OUTPUT_TOKENS_RESERVE", "2048"))   # место под ответ, если max_tokens не задан
+
+# Токенизаторы HuggingFace (tokenizer.json) по моделям; без файла — tiktoken cl100k_base
+TOKENIZERS_DIR = os.getenv("TOKENIZERS_DIR", "tokenizers").strip()   # файлы <arch>.json подхватываются сами
+TOKENIZER_MAP = os.getenv("TOKENIZER_MAP", "").strip()               # "qwen2.5-*=qwen2.5.json,mistral-*=mistral.json"
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))  # LRU текст -> число токенов
 
 # Владелец бота (для приоритета).
 BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID", "5178568186"))
@@ -69,6 +109,13 @@ DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "2000"))
 LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "120"))
 LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
 LLM_RETRY_BACKOFF_SEC = float(os.getenv("LLM_RETRY_BACKOFF_SEC", "0.8"))
+LLM_RETRY_BACKOFF_MAX_SEC = float(os.getenv("LLM_RETRY_BACKOFF_MAX_SEC", "10"))
+LLM_CONNECT_TIMEOUT_SEC = float(os.getenv("LLM_CONNECT_TIMEOUT_SEC", "5"))
+LLM_TTFT_TIMEOUT_SEC = float(os.getenv("LLM_TTFT_TIMEOUT_SEC", "60"))       # time to first token (stream); then LLM_TIMEOUT_SEC between chunks
+
+# Hedged requests to BASE_URL_SECONDARY (delay = p95 of TTFT, not less than min)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY_SEC = float(os.getenv("LLM_HEDGE_MIN_DELAY_SEC", "1.5"))
 
 # Circuit breaker
 CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", "3"))     # сколько подряд ошибок, чтобы "открыться"
@@ -83,21 +130,72 @@ MIN_TEXT_TOKENS_TO_KEEP = int(os.getenv("MIN_TEXT_TOKENS_TO_KEEP", "256"))
 # ---- JSON rotation ----
 HISTORY_ROTATE_MAX_BYTES = int(os.getenv("HISTORY_ROTATE_MAX_BYTES", str(5 * 1024 * 1024)))  # 5 MB
 HISTORY_ROTATE_BACKUPS = int(os.getenv("HISTORY_ROTATE_BACKUPS", "3"))
+# компактный JSON (без отступов, orjson если установлен) для файлов истории
+HISTORY_JSON_COMPACT = os.getenv("HISTORY_JSON_COMPACT", "1").strip().lower() in ("1", "true", "yes")
+
+# ---- History archive (вместо полных копий .1/.2/.3: сжатые сегменты без дублей) ----
+HISTORY_ARCHIVE_ENABLED = os.getenv("HISTORY_ARCHIVE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "history_archive").strip()
+HISTORY_ARCHIVE_CODEC = os.getenv("HISTORY_ARCHIVE_CODEC", "auto").strip().lower()   # auto | zstd | gzip
+# <uid>.archive.jsonl (выпавшие из контекста сообщения) больше этого -> в сжатый сегмент
+HISTORY_ARCHIVE_JSONL_MAX_BYTES = int(os.getenv("HISTORY_ARCHIVE_JSONL_MAX_BYTES", str(1024 * 1024)))
+
+# ---- History paging (lazy per-user load + LRU eviction) ----
+HISTORY_IDLE_TTL_SEC = float(os.getenv("HISTORY_IDLE_TTL_SEC", "1800"))        # выгружать из RAM после простоя
+HISTORY_MAX_RESIDENT_USERS = int(os.getenv("HISTORY_MAX_RESIDENT_USERS", "200"))
 
 # ---- Priority ----
 IMAGE_PRIORITY_PENALTY = int(os.getenv("IMAGE_PRIORITY_PENALTY", "3000"))
 TOKENS_PRIORITY_WEIGHT = int(os.getenv("TOKENS_PRIORITY_WEIGHT", "2"))
 USED_TOKENS_WEIGHT = int(os.getenv("USED_TOKENS_WEIGHT", "1"))
 
+# ---- Fast lane (короткие запросы не ждут длинную генерацию) ----
+FAST_LANE_ENABLED = os.getenv("FAST_LANE_ENABLED", "0").strip().lower() in ("1", "true", "yes")
+FAST_LANE_SLOTS = int(os.getenv("FAST_LANE_SLOTS", "1"))                          # слоты сверх MAX_ACTIVE_GLOBAL
+FAST_LANE_MAX_PROMPT_TOKENS = int(os.getenv("FAST_LANE_MAX_PROMPT_TOKENS", "1500"))
+FAST_LANE_MAX_TOKENS = int(os.getenv("FAST_LANE_MAX_TOKENS", "256"))              # max_tokens ответа в fast lane
+FAST_LANE_MODEL = os.getenv("FAST_LANE_MODEL", "").strip()                        # пусто = текущая модель LM Studio
+# fast-задача может занять свободный обычный слот раньше обычных задач (обычные задачи не прерываются)
+FAST_LANE_BORROW_NORMAL_SLOTS = os.getenv("FAST_LANE_BORROW_NORMAL_SLOTS", "1").strip().lower() in ("1", "true", "yes")
+# ответ упёрся в FAST_LANE_MAX_TOKENS -> дописать его на обычном слоте без лимита (иначе только пометка об обрезке)
+FAST_LANE_CONTINUE_ON_LENGTH = os.getenv("FAST_LANE_CONTINUE_ON_LENGTH", "1").strip().lower() in ("1", "true", "yes")
+
+# ---- Telegram outbound flood limits ----
+TG_PER_CHAT_RATE = float(os.getenv("TG_PER_CHAT_RATE", "1.0"))     # сообщений/сек в один чат
+TG_PER_CHAT_BURST = float(os.getenv("TG_PER_CHAT_BURST", "3"))
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))          # сообщений/сек на весь бот
+TG_MAX_429_RETRIES = int(os.getenv("TG_MAX_429_RETRIES", "5"))
+
+# ---- Ответ в Telegram: HTML (код в <pre>) + живое превью при стриминге ----
+TG_MESSAGE_MAX_LEN = int(os.getenv("TG_MESSAGE_MAX_LEN", "3900"))
+STREAM_PREVIEW_ENABLED = os.getenv("STREAM_PREVIEW_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL_SEC = float(os.getenv("STREAM_EDIT_INTERVAL_SEC", "2.0"))
+
+# ---- /export ----
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(1024 * 1024)))  # больше — на диск
+
 # ---- Smart stop ----
 SMART_STOP_DISCARD_PARTIAL = os.getenv("SMART_STOP_DISCARD_PARTIAL", "1").strip().lower() in ("1", "true", "yes")
 
 # ---- Memory ----
 MAX_MEMORY_ITEMS = int(os.getenv("MAX_MEMORY_ITEMS", "20"))
 MAX_MEMORY_ITEM_LEN = int(os.getenv("MAX_MEMORY_ITEM_LEN", "500"))
-
-# ---- LM Studio model id cache ----
-MODEL_ID_TTL_SEC = float(os.getenv("MODEL_ID_TTL_SEC", "30"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "5"))                        # сколько пунктов памяти в промпт (BM25)
+MEMORY_INDEX_CACHE_SIZE = int(os.getenv("MEMORY_INDEX_CACHE_SIZE", "256"))  # индексов памяти в RAM (по юзерам)
+
+# ---- Recall: поиск (BM25) по выпавшим из контекста сообщениям и бэкапам истории ----
+RECALL_ENABLED = os.getenv("RECALL_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+RECALL_TOP_K = int(os.getenv("RECALL_TOP_K", "3"))
+RECALL_TOKEN_BUDGET = int(os.getenv("RECALL_TOKEN_BUDGET", "300"))         # потолок токенов на фрагменты
+RECALL_SNIPPET_CHARS = int(os.getenv("RECALL_SNIPPET_CHARS", "400"))
+RECALL_MAX_DOCS_PER_USER = int(os.getenv("RECALL_MAX_DOCS_PER_USER", "5000"))
+RECALL_MAX_USERS = int(os.getenv("RECALL_MAX_USERS", "50"))                # индексов в RAM
+
+# ---- LM Studio model catalog (фоновое обновление, пользовательские пути не ждут сеть) ----
+MODEL_ID_TTL_SEC = float(os.getenv("MODEL_ID_TTL_SEC", "30"))                # период обновления каталога
+MODEL_CATALOG_TIMEOUT_SEC = float(os.getenv("MODEL_CATALOG_TIMEOUT_SEC", "10"))
+# REST API LM Studio с state/context length; пусто = <OPENAI_BASE_URL без /v1>/api/v0/models
+LMSTUDIO_REST_MODELS_URL = os.getenv("LMSTUDIO_REST_MODELS_URL", "").strip()
 
 # ---- Фото: авто-описание только если caption пустой ----
 AUTO_IMAGE_DESCRIPTION_5S = (
@@ -206,6 +304,15 @@ def record_error(msg: str) -> None:
     RECENT_ERRORS.append((time.time(), msg))
 
 
+# stop -> slot freed latency, seconds (for /status)
+STOP_LATENCIES: Deque[float] = deque(maxlen=100)
+
+
+def record_stop_latency(job_id: int, seconds: float) -> None:
+    STOP_LATENCIES.append(seconds)
+    logger.info("Job %d stopped: slot freed in %.2fs", job_id, seconds)
+
+
 # =============================================================================
 # LOCKS / STATE
 # =============================================================================
@@ -233,14 +340,64 @@ def uid(user_id: Union[int, str]) -> str:
     return str(user_id)
 
 
-def atomic_write_json(path: str, data: Any) -> None:
+class LazyInit:
+    """
+    One-time initialization on first get(), shared by the warmup thread and user paths:
+    whoever comes first builds the value, the others wait for it (not for the whole warmup).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]) -> None:
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._done = False
+        self._value: Any = None
+
+    @property
+    def ready(self) -> bool:
+        return self._done
+
+    def get(self) -> Any:
+        if self._done:
+            return self._value
+        with self._lock:
+            if not self._done:
+                t0 = time.perf_counter()
+                self._value = self._factory()
+                self._done = True
+                STARTUP_TIMINGS[self.name] = time.perf_counter() - t0
+        return self._value
+
+
+def dumps_json_bytes(data: Any, compact: bool = False) -> bytes:
+    if not compact:
+        return json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def load_json_file(path: str) -> Any:
+    # Both the indented and the compact format are plain JSON, so one loader reads either.
+    with open(path, "rb") as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
+
+
+def atomic_write_json(path: str, data: Any, compact: bool = False) -> None:
+    atomic_write_bytes(path, dumps_json_bytes(data, compact=compact))
+
+
+def atomic_write_bytes(path: str, payload: bytes) -> None:
     directory = os.path.dirname(os.path.abspath(path)) or "."
     os.makedirs(directory, exist_ok=True)
 
-    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=os.path.splitext(path)[1], dir=directory)
     try:
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
             f.flush()
             os.fsync(f.fileno())
         os.replace(tmp_path, path)
@@ -252,6 +409,19 @@ def atomic_write_json(path: str, data: Any) -> None:
             pass
 
 
+def message_key(role: str, ts: Any, text: str, src: Optional[str] = None) -> str:
+    """
+    Backups, the archive and the live history overlap: one message = one key.
+    Legacy messages have no _ts, and role|text would merge every repeated "да"/"ok";
+    when their origin is known (src = "<source id>#<index>") it is part of the key.
+    """
+    if ts:
+        return f"{role}|{ts}"
+    if src:
+        return "src|" + hashlib.sha1(f"{src}|{role}|{text}".encode("utf-8")).hexdigest()
+    return f"{role}|{text}"
+
+
 def rotate_file(path: str, max_bytes: int, backups: int) -> None:
     if backups <= 0:
         return
@@ -284,6 +454,165 @@ def rotate_file(path: str, max_bytes: int, backups: int) -> None:
         logger.warning("Rotation failed for %s: %s", path, e)
 
 
+class HistoryArchive:
+    """
+    Compressed, deduplicated archive of past messages:
+
+        <dir>/<user_id>/<first_ts>-<last_ts>-<n>.jsonl.zst   (.jsonl.gz without zstandard)
+
+    One JSON object per line {"ts", "role", "text"[, "content"][, "src"]}, sorted by ts. Segments
+    are immutable and a new one holds only messages not archived before, so the directory is the
+    per-user index and the file names are the time index. Rows without ts are deduplicated only
+    by their origin "src" (a re-converted backup), never by text.
+    """
+
+    def __init__(self, directory: str, codec: str = "auto", key_cache_users: int = 32) -> None:
+        self.directory = directory
+        self.codec = "zstd" if zstandard is not None and codec in ("auto", "zstd") else "gzip"
+        if codec == "zstd" and zstandard is None:
+            logger.warning("HISTORY_ARCHIVE_CODEC=zstd but zstandard is not installed: using gzip")
+        self._lock = threading.RLock()
+        self._keys: "OrderedDict[str, set[str]]" = OrderedDict()
+        self.key_cache_users = max(1, key_cache_users)
+
+    def _user_dir(self, user_id: Union[int, str]) -> str:
+        safe = "".join(ch for ch in uid(user_id) if ch.isalnum() or ch in "-_") or "_"
+        return os.path.join(self.directory, safe)
+
+    def users(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(d for d in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, d)))
+
+    @staticmethod
+    def _segment_range(name: str) -> Optional[Tuple[float, float]]:
+        try:
+            first, last = name.split("-")[:2]
+            return float(first), float(last)
+        except ValueError:
+            return None
+
+    def segments(self, user_id: Union[int, str], since: Optional[float] = None, until: Optional[float] = None) -> List[str]:
+        d = self._user_dir(user_id)
+        if not os.path.isdir(d):
+            return []
+        out: List[Tuple[float, str]] = []
+        for name in os.listdir(d):
+            if not (name.endswith(".jsonl.zst") or name.endswith(".jsonl.gz")):
+                continue
+            rng = self._segment_range(name)
+            if rng is None:
+                continue
+            # rows without ts are stored as 0: such segments always match
+            if since is not None and rng[1] and rng[1] < since:
+                continue
+            if until is not None and rng[0] > until:
+                continue
+            out.append((rng[0], os.path.join(d, name)))
+        return [p for _, p in sorted(out)]
+
+    @staticmethod
+    def read_segment(path: str) -> List[Dict[str, Any]]:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"{path}: zstandard is not installed")
+            raw = zstandard.ZstdDecompressor().decompress(raw)
+        else:
+            raw = gzip.decompress(raw)
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    def iter_rows(
+        self, user_id: Union[int, str], since: Optional[float] = None, until: Optional[float] = None
+    ) -> Iterator[Dict[str, Any]]:
+        for path in self.segments(user_id, since, until):
+            for row in self.read_segment(path):
+                ts = row.get("ts") or 0
+                if since is not None and ts and ts < since:
+                    continue
+                if until is not None and ts > until:
+                    continue
+                yield row
+
+    def _known_keys(self, k: str) -> set[str]:
+        keys = self._keys.get(k)
+        if keys is None:
+            keys = {self._row_key(r) for r in self.iter_rows(k)}
+            self._keys[k] = keys
+        self._keys.move_to_end(k)
+        while len(self._keys) > self.key_cache_users:
+            self._keys.popitem(last=False)
+        return keys
+
+    @staticmethod
+    def _row_key(r: Dict[str, Any]) -> str:
+        return message_key(str(r.get("role") or ""), r.get("ts"), str(r.get("text") or ""), r.get("src"))
+
+    def add_rows(self, user_id: Union[int, str], rows: List[Dict[str, Any]]) -> int:
+        """Write rows not archived yet as a new segment; returns how many were new."""
+        k = uid(user_id)
+        with self._lock:
+            keys = self._known_keys(k)
+            new: List[Dict[str, Any]] = []
+            for r in rows:
+                if not r.get("ts") and not r.get("src"):
+                    new.append(r)  # nothing identifies it: a duplicate is better than a lost message
+                    continue
+                key = self._row_key(r)
+                if key in keys:
+                    continue
+                keys.add(key)
+                new.append(r)
+            if not new:
+                return 0
+            new.sort(key=lambda r: r.get("ts") or 0)
+            payload = b"".join(dumps_json_bytes(r, compact=True) + b"\n" for r in new)
+            if self.codec == "zstd":
+                data, ext = zstandard.ZstdCompressor(level=10).compress(payload), "jsonl.zst"
+            else:
+                data, ext = gzip.compress(payload, compresslevel=9), "jsonl.gz"
+            first, last = int(new[0].get("ts") or 0), int(new[-1].get("ts") or 0)
+            name = f"{first}-{last}-{time.time_ns()}.{ext}"
+            atomic_write_bytes(os.path.join(self._user_dir(k), name), data)
+            return len(new)
+
+    def has_rows(self, user_id: Union[int, str], rows: List[Dict[str, Any]]) -> bool:
+        """True if every row (with ts or src) is in the segments on disk, not just in the key cache."""
+        k = uid(user_id)
+        with self._lock:
+            self._keys.pop(k, None)
+            keys = self._known_keys(k)
+            return all(self._row_key(r) in keys for r in rows)
+
+    @staticmethod
+    def history_rows(history: Any, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Archive rows of a chat history; messages without _ts get src="<source>#<index>"."""
+        rows: List[Dict[str, Any]] = []
+        for i, m in enumerate(history if isinstance(history, list) else []):
+            if not isinstance(m, dict) or m.get("role") not in ("user", "assistant"):
+                continue
+            text = _content_to_plain_text(m)
+            if not text:
+                continue
+            row: Dict[str, Any] = {"ts": m.get("_ts"), "role": m["role"], "text": text}
+            if not isinstance(m.get("content"), str):
+                row["content"] = m.get("content")  # photo blocks etc.
+            if not row["ts"] and source:
+                row["src"] = f"{source}#{i}"
+            rows.append(row)
+        return rows
+
+    def disk_usage(self) -> Tuple[int, int]:
+        """(segments, bytes)"""
+        n = size = 0
+        for u in self.users():
+            for p in self.segments(u):
+                n += 1
+                size += os.path.getsize(p)
+        return n, size
+
+
 class JsonStore:
     def __init__(self, path: str, default: Any, rotate_max_bytes: Optional[int] = None, rotate_backups: int = 0):
         self.path = path
@@ -291,29 +620,219 @@ class JsonStore:
         self.rotate_max_bytes = rotate_max_bytes
         self.rotate_backups = rotate_backups
         self._lock = threading.RLock()
-        self.data = self._load()
+        self._data: Any = None
+        self._loaded = False
+
+    @property
+    def data(self) -> Any:
+        # loaded on first use (warmup thread or the first handler that needs settings)
+        with self._lock:
+            if not self._loaded:
+                t0 = time.perf_counter()
+                self._data = self._load()
+                self._loaded = True
+                STARTUP_TIMINGS[f"load {os.path.basename(self.path)}"] = time.perf_counter() - t0
+            return self._data
 
     def _load(self) -> Any:
         if not os.path.exists(self.path):
             return self.default
         try:
-            with open(self.path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return load_json_file(self.path)
         except Exception as e:
             logger.warning("Failed to load %s (%s). Using default.", self.path, e)
             return self.default
 
     def save(self) -> None:
         with self._lock:
+            if not self._loaded:
+                return
             if self.rotate_max_bytes is not None:
                 rotate_file(self.path, self.rotate_max_bytes, self.rotate_backups)
-            atomic_write_json(self.path, self.data)
+            atomic_write_json(self.path, self._data)
 
     def get(self) -> Any:
         with self._lock:
             return self.data
 
 
+class HistoryPager:
+    """
+    Per-user history files (<dir>/<user_id>.json) with lazy loading.
+
+    A user's history is read from disk on first access and kept in an LRU of
+    resident users. Users idle longer than idle_ttl_sec (or beyond max_resident)
+    are flushed and evicted on the next save(). Any accessed user is treated as
+    dirty, because callers mutate the returned lists in place.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        legacy_path: Optional[str] = None,
+        idle_ttl_sec: float = 1800.0,
+        max_resident: int = 200,
+        rotate_max_bytes: Optional[int] = None,
+        rotate_backups: int = 0,
+        compact: bool = False,
+    ):
+        self.directory = directory
+        self.idle_ttl_sec = max(1.0, idle_ttl_sec)
+        self.max_resident = max(1, max_resident)
+        self.rotate_max_bytes = rotate_max_bytes
+        self.rotate_backups = rotate_backups
+        self.compact = compact
+        self._lock = threading.RLock()
+        self._resident: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._dirty: set[str] = set()
+        self.stats: Dict[str, int] = {"loads": 0, "misses": 0, "evictions": 0, "writes": 0}
+        self._legacy_path = legacy_path
+        self._ready = False
+
+    def warm(self) -> None:
+        # directory + one-time legacy migration; must run before any per-user file is touched
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            t0 = time.perf_counter()
+            os.makedirs(self.directory, exist_ok=True)
+            if self._legacy_path:
+                self._migrate_legacy(self._legacy_path)
+            self._ready = True
+            STARTUP_TIMINGS["history dir"] = time.perf_counter() - t0
+
+    def _path(self, k: str) -> str:
+        safe = "".join(ch for ch in k if ch.isalnum() or ch in "-_") or "_"
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def archive_path(self, user_id: Union[int, str]) -> str:
+        # messages that left the history (trim/compression/new chat), one JSON object per line
+        return self._path(uid(user_id))[: -len(".json")] + ".archive.jsonl"
+
+    def backup_paths(self, user_id: Union[int, str]) -> List[str]:
+        path = self._path(uid(user_id))
+        return [f"{path}.{i}" for i in range(1, self.rotate_backups + 1) if os.path.exists(f"{path}.{i}")]
+
+    def _migrate_legacy(self, legacy_path: str) -> None:
+        # one-time split of the old single-file history.json into per-user files
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            legacy = load_json_file(legacy_path)
+        except Exception as e:
+            logger.warning("Failed to read legacy history %s (%s). Skipping migration.", legacy_path, e)
+            return
+        if not isinstance(legacy, dict):
+            return
+
+        migrated = 0
+        for k, history in legacy.items():
+            path = self._path(uid(k))
+            if os.path.exists(path) or not isinstance(history, list):
+                continue
+            atomic_write_json(path, history, compact=self.compact)
+            migrated += 1
+
+        try:
+            os.replace(legacy_path, f"{legacy_path}.migrated")
+        except Exception as e:
+            logger.warning("Failed to rename legacy history %s: %s", legacy_path, e)
+        logger.info("Migrated %d user histories from %s to %s", migrated, legacy_path, self.directory)
+
+    def _touch(self, k: str) -> None:
+        self._resident.move_to_end(k)
+        self._last_access[k] = time.time()
+        self._dirty.add(k)
+
+    def _load(self, k: str) -> Optional[List[Dict[str, Any]]]:
+        self.warm()
+        if k in self._resident:
+            self._touch(k)
+            return self._resident[k]
+
+        path = self._path(k)
+        if not os.path.exists(path):
+            self.stats["misses"] += 1
+            return None
+        try:
+            history = load_json_file(path)
+        except Exception as e:
+            logger.warning("Failed to load %s (%s). Using empty history.", path, e)
+            history = []
+        if not isinstance(history, list):
+            history = []
+
+        self.stats["loads"] += 1
+        self._resident[k] = history
+        self._touch(k)
+        return history
+
+    def __contains__(self, user_id: object) -> bool:
+        k = uid(user_id)  # type: ignore[arg-type]
+        with self._lock:
+            self.warm()
+            if k in self._resident:
+                return True
+            return os.path.exists(self._path(k))
+
+    def get(self, user_id: Union[int, str], default: Any = None) -> Any:
+        with self._lock:
+            history = self._load(uid(user_id))
+            return default if history is None else history
+
+    def __getitem__(self, user_id: Union[int, str]) -> List[Dict[str, Any]]:
+        with self._lock:
+            history = self._load(uid(user_id))
+            if history is None:
+                raise KeyError(user_id)
+            return history
+
+    def __setitem__(self, user_id: Union[int, str], history: List[Dict[str, Any]]) -> None:
+        k = uid(user_id)
+        with self._lock:
+            self.warm()
+            self._resident[k] = history
+            self._touch(k)
+
+    def resident_count(self) -> int:
+        with self._lock:
+            return len(self._resident)
+
+    def _write(self, k: str) -> None:
+        path = self._path(k)
+        if self.rotate_max_bytes is not None:
+            rotate_file(path, self.rotate_max_bytes, self.rotate_backups)
+        atomic_write_json(path, self._resident[k], compact=self.compact)
+        self.stats["writes"] += 1
+
+    def _evict_idle(self) -> None:
+        now = time.time()
+        while self._resident:
+            k = next(iter(self._resident))
+            idle = now - self._last_access.get(k, 0.0)
+            if idle < self.idle_ttl_sec and len(self._resident) <= self.max_resident:
+                break
+            if k in self._dirty:
+                self._write(k)
+                self._dirty.discard(k)
+            self._resident.pop(k, None)
+            self._last_access.pop(k, None)
+            self.stats["evictions"] += 1
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._ready:
+                return
+            for k in list(self._dirty):
+                if k in self._resident:
+                    self._write(k)
+            self._dirty.clear()
+            self._evict_idle()
+
+
 # =============================================================================
 # TOKEN ESTIMATION
 # =============================================================================
@@ -322,37 +841,129 @@ class JsonStore:
 class TokenStatus:
     used: int
     left: int
+    limit: int
+
+
+def _import_tiktoken() -> Optional[Callable[[str], Any]]:
+    try:
+        from tiktoken import get_encoding  # type: ignore
+    except Exception:  # pragma: no cover
+        return None
+    return get_encoding
+
+
+def _import_hf_tokenizers() -> Optional[Any]:
+    try:
+        from tokenizers import Tokenizer  # type: ignore
+    except Exception:  # pragma: no cover
+        return None
+    return Tokenizer
+
+
+tiktoken_module = LazyInit("import tiktoken", _import_tiktoken)
+hf_tokenizers_module = LazyInit("import tokenizers", _import_hf_tokenizers)
 
 
 class TokenEstimator:
-    def __init__(self) -> None:
+    """
+    Token counter for one tokenizer backend:
+      tiktoken  - cl100k_base (OpenAI family, the old default)
+      hf        - HuggingFace `tokenizers` JSON file (tokenizer.json of the model)
+      chars     - len(text) // 3 when nothing else is available
+    Counts are cached per text (LRU): history messages are re-counted on every trim.
+    """
+
+    def __init__(self, backend: str = "tiktoken", path: str = "", cache_size: int = 4096) -> None:
+        self.backend = "chars"
+        self.name = "chars"
         self._enc = None
-        if get_encoding is not None:
+        self._hf = None
+        hf_tokenizer = hf_tokenizers_module.get() if backend == "hf" else None
+        get_encoding = tiktoken_module.get() if backend == "tiktoken" else None
+        if hf_tokenizer is not None and path:
+            self._hf = hf_tokenizer.from_file(path)  # errors -> caller falls back
+            self.backend = "hf"
+            self.name = os.path.basename(path)
+        elif get_encoding is not None:
             try:
                 self._enc = get_encoding("cl100k_base")
+                self.backend = "tiktoken"
+                self.name = "cl100k_base"
             except Exception as e:
                 logger.warning("tiktoken init failed: %s", e)
                 self._enc = None
+        self.cache_size = max(0, cache_size)
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def _encode(self, text: str) -> List[int]:
+        if self._hf is not None:
+            return self._hf.encode(text, add_special_tokens=False).ids
+        return self._enc.encode_ordinary(text)
+
+    def _decode(self, ids: List[int]) -> str:
+        if self._hf is not None:
+            return self._hf.decode(ids)
+        return self._enc.decode(ids)
+
+    def _count_uncached(self, texts: List[str]) -> List[int]:
+        if self.backend == "chars":
+            return [max(1, len(t) // 3) for t in texts]
+        if self._hf is not None:
+            return [len(e.ids) for e in self._hf.encode_batch(texts, add_special_tokens=False)]
+        if len(texts) == 1:
+            return [len(self._enc.encode_ordinary(texts[0]))]
+        return [len(ids) for ids in self._enc.encode_ordinary_batch(texts)]
+
+    def encode_batch(self, texts: List[str]) -> List[int]:
+        """Token counts for many texts: cache lookups first, one backend call for the misses."""
+        out: List[int] = [0] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        with self._cache_lock:
+            for i, t in enumerate(texts):
+                if not t:
+                    continue
+                n = self._cache.get(t)
+                if n is None:
+                    missing.setdefault(t, []).append(i)
+                else:
+                    self._cache.move_to_end(t)
+                    out[i] = n
+            self.stats["hits"] += sum(1 for t in texts if t) - sum(len(v) for v in missing.values())
+            self.stats["misses"] += len(missing)
+        if not missing:
+            return out
+
+        keys = list(missing)
+        counts = self._count_uncached(keys)
+        with self._cache_lock:
+            for t, n in zip(keys, counts):
+                for i in missing[t]:
+                    out[i] = n
+                if self.cache_size:
+                    self._cache[t] = n
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return out
 
     def count_text_tokens(self, text: str) -> int:
         if not text:
             return 0
-        if self._enc is None:
-            return max(1, len(text) // 3)
-        return len(self._enc.encode(text))
+        return self.encode_batch([text])[0]
 
     def truncate_text_to_tokens_keep_tail(self, text: str, max_tokens: int) -> str:
         if max_tokens <= 0 or not text:
             return ""
-        if self._enc is None:
+        if self.backend == "chars":
             max_chars = max(1, max_tokens * 3)
             if len(text) <= max_chars:
                 return text
             return "… " + text[-max_chars:]
-        toks = self._enc.encode(text)
+        toks = self._encode(text)
         if len(toks) <= max_tokens:
             return text
-        return "… " + self._enc.decode(toks[-max_tokens:])
+        return "… " + self._decode(toks[-max_tokens:])
 
     @staticmethod
     def _iter_text_blocks(content: Any) -> List[str]:
@@ -380,16 +991,93 @@ class TokenEstimator:
 
     def estimate_messages(self, messages: List[Dict[str, Any]]) -> int:
         total = TOKENS_PRIMING_OVERHEAD
+        texts: List[str] = []
         for m in messages:
             total += TOKENS_PER_MESSAGE_OVERHEAD
             content = m.get("content")
-            for part in self._iter_text_blocks(content):
-                total += self.count_text_tokens(part)
+            texts.extend(self._iter_text_blocks(content))
             total += self._count_images(content) * IMAGE_TOKEN_ESTIMATE
-        return total
+        return total + sum(self.encode_batch(texts))
+
+
+def _parse_pattern_map(raw: str, env_name: str) -> List[Tuple[str, str]]:
+    # "pattern=value,pattern2=value2" -> [(pattern, value)]
+    out: List[Tuple[str, str]] = []
+    for item in raw.split(","):
+        pattern, _, value = item.partition("=")
+        if pattern.strip() and value.strip():
+            out.append((pattern.strip(), value.strip()))
+        elif item.strip():
+            logger.warning("%s: bad entry %r", env_name, item)
+    return out
 
 
-token_estimator = TokenEstimator()
+class TokenizerRegistry:
+    """
+    Model id -> TokenEstimator. Tokenizer files are looked up in TOKENIZERS_DIR:
+      1) TOKENIZER_MAP patterns (fnmatch on model id) -> file name
+      2) <arch>.json, arch as reported by LM Studio (qwen2, llama, mistral, ...)
+    Files are loaded lazily on first use; anything missing/broken falls back to tiktoken.
+    """
+
+    def __init__(self, directory: str, mapping: List[Tuple[str, str]], cache_size: int) -> None:
+        self.directory = directory
+        self.mapping = mapping
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._by_path: Dict[str, TokenEstimator] = {}
+        self._default: Optional[TokenEstimator] = None
+
+    def default(self) -> TokenEstimator:
+        with self._lock:
+            if self._default is None:
+                self._default = TokenEstimator("tiktoken", cache_size=self.cache_size)
+            return self._default
+
+    def _resolve_path(self, model_id: str, arch: str) -> Optional[str]:
+        for pattern, fname in self.mapping:
+            if fnmatch.fnmatchcase(model_id, pattern):
+                return os.path.join(self.directory, fname)
+        if arch:
+            p = os.path.join(self.directory, f"{arch}.json")
+            if os.path.exists(p):
+                return p
+        return None
+
+    def for_model(self, model_id: Optional[str] = None) -> TokenEstimator:
+        if hf_tokenizers_module.get() is None:
+            return self.default()
+        snap = model_catalog.snapshot()
+        model_id = model_id or snap.active_id
+        info = snap.get(model_id)
+        path = self._resolve_path(model_id, info.arch if info is not None else "")
+        if path is None:
+            return self.default()
+        with self._lock:
+            est = self._by_path.get(path)
+        if est is not None:
+            return est
+        try:
+            t0 = time.perf_counter()
+            est = TokenEstimator("hf", path, cache_size=self.cache_size)
+            logger.info("Tokenizer %s loaded in %.0f ms", path, (time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            logger.warning("Tokenizer %s failed to load, using tiktoken: %s", path, e)
+            record_error(f"tokenizer {os.path.basename(path)}: {type(e).__name__}: {e}")
+            est = self.default()
+        with self._lock:
+            return self._by_path.setdefault(path, est)
+
+
+tokenizer_registry = TokenizerRegistry(
+    TOKENIZERS_DIR,
+    _parse_pattern_map(TOKENIZER_MAP, "TOKENIZER_MAP"),
+    TOKEN_COUNT_CACHE_SIZE,
+)
+
+
+def get_token_estimator(model_id: Optional[str] = None) -> TokenEstimator:
+    return tokenizer_registry.for_model(model_id)
 
 
 # =============================================================================
@@ -397,23 +1085,40 @@ token_estimator = TokenEstimator()
 # =============================================================================
 
 settings_store = JsonStore(SETTINGS_FILE, default={})
-history_store = JsonStore(
-    HISTORY_FILE,
-    default={},
-    rotate_max_bytes=HISTORY_ROTATE_MAX_BYTES,
+history_archive: Optional[HistoryArchive] = (
+    HistoryArchive(HISTORY_ARCHIVE_DIR, HISTORY_ARCHIVE_CODEC) if HISTORY_ARCHIVE_ENABLED else None
+)
+history_store = HistoryPager(
+    HISTORY_DIR,
+    legacy_path=HISTORY_FILE,
+    idle_ttl_sec=HISTORY_IDLE_TTL_SEC,
+    max_resident=HISTORY_MAX_RESIDENT_USERS,
+    # with the archive every message that leaves a history file is archived, full copies are redundant
+    rotate_max_bytes=None if history_archive is not None else HISTORY_ROTATE_MAX_BYTES,
     rotate_backups=HISTORY_ROTATE_BACKUPS,
+    compact=HISTORY_JSON_COMPACT,
 )
 
-user_settings: Dict[str, Dict[str, Any]] = settings_store.get()
-chat_histories: Dict[str, List[Dict[str, Any]]] = history_store.get()
+chat_histories: HistoryPager = history_store
 
 bot = telebot.TeleBot(API_TOKEN)
 
-# OpenAI client (LM Studio)
-try:
-    client = OpenAI(base_url=BASE_URL, api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT_SEC)  # type: ignore[arg-type]
-except TypeError:
-    client = OpenAI(base_url=BASE_URL, api_key=OPENAI_API_KEY)
+
+# OpenAI client (LM Studio). `import openai` costs more than the rest of the bot,
+# so the clients are built by the warmup thread (or the first LLM call).
+def _make_openai_client(base_url: str) -> Any:
+    if not base_url:
+        return None
+    from openai import OpenAI
+
+    try:
+        return OpenAI(base_url=base_url, api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT_SEC)  # type: ignore[arg-type]
+    except TypeError:
+        return OpenAI(base_url=base_url, api_key=OPENAI_API_KEY)
+
+
+primary_llm = LazyInit("openai client", lambda: _make_openai_client(BASE_URL))
+secondary_llm = LazyInit("openai client (secondary)", lambda: _make_openai_client(BASE_URL_SECONDARY))
 
 
 # =============================================================================
@@ -467,21 +1172,85 @@ CB = CircuitBreaker(CB_FAILURE_THRESHOLD, CB_RESET_TIMEOUT_SEC)
 # SAFE OPENAI CALLS (timeouts/retries)
 # =============================================================================
 
-def _openai_models_list() -> Any:
+def _llm_timeout(read_sec: float) -> Any:
+    # separate connect/read deadlines: a dead server fails in seconds, not after LLM_TIMEOUT_SEC
+    if httpx is None:
+        return LLM_TIMEOUT_SEC
+    return httpx.Timeout(LLM_TIMEOUT_SEC, connect=LLM_CONNECT_TIMEOUT_SEC, read=read_sec)
+
+
+def _openai_models_list(timeout_sec: float = LLM_TIMEOUT_SEC) -> Any:
     try:
-        return client.models.list(timeout=LLM_TIMEOUT_SEC)  # type: ignore[call-arg]
+        return primary_llm.get().models.list(timeout=_llm_timeout(timeout_sec))  # type: ignore[call-arg]
     except TypeError:
-        return client.models.list()
+        return primary_llm.get().models.list()
 
 
-def _openai_chat_create(**kwargs: Any) -> Any:
+def _openai_chat_create(llm: Optional[Any] = None, timeout: Optional[Any] = None, **kwargs: Any) -> Any:
+    api = llm if llm is not None else primary_llm.get()
     try:
-        return client.chat.completions.create(timeout=LLM_TIMEOUT_SEC, **kwargs)  # type: ignore[call-arg]
+        return api.chat.completions.create(timeout=timeout or _llm_timeout(LLM_TIMEOUT_SEC), **kwargs)  # type: ignore[call-arg]
     except TypeError:
-        return client.chat.completions.create(**kwargs)
+        return api.chat.completions.create(**kwargs)
+
+
+def _cancellable_client(base: Optional[Any] = None) -> Tuple[Any, Optional[Callable[[], None]]]:
+    """
+    Client with its own HTTP connection pool, so /stop can tear the connection down
+    from another thread (LM Studio then stops generating for the dead request).
+    Retries are left to call_with_retries (max_retries=0).
+    """
+    base = base if base is not None else primary_llm.get()
+    if httpx is None:
+        return base, None
+    try:
+        http_client = httpx.Client(timeout=_llm_timeout(LLM_TIMEOUT_SEC))
+        return base.with_options(http_client=http_client, max_retries=0), http_client.close
+    except Exception as e:
+        record_error(f"cancellable client init failed: {type(e).__name__}: {e}")
+        return base, None
+
+
+# error kinds -> counters (for /status)
+LLM_ERROR_KINDS: Dict[str, int] = defaultdict(int)
+
 
+def classify_llm_error(e: Exception) -> str:
+    """connect | timeout | client (4xx) | server (5xx/408/429) | other"""
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
 
-def call_with_retries(fn, *, name: str) -> Any:
+    if isinstance(e, (APITimeoutError, TimeoutError)) or (httpx is not None and isinstance(e, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(e, (APIConnectionError, ConnectionError)) or (httpx is not None and isinstance(e, httpx.TransportError)):
+        return "connect"
+    if isinstance(e, APIStatusError):
+        code = int(getattr(e, "status_code", 0) or 0)
+        if code in (408, 429) or code >= 500:
+            return "server"
+        return "client"
+    return "other"
+
+
+def is_model_not_found(e: Exception) -> bool:
+    """The request named a model the server no longer has (unloaded/switched in LM Studio)."""
+    code = int(getattr(e, "status_code", 0) or 0)
+    if code == 404:
+        return True
+    msg = str(e).lower()
+    return code == 400 and "model" in msg and ("not found" in msg or "not loaded" in msg)
+
+
+class TTFTTimeoutError(TimeoutError):
+    """No first stream event within LLM_TTFT_TIMEOUT_SEC; the watchdog closed the connection."""
+
+
+def retry_backoff_sec(attempt: int) -> float:
+    # "equal jitter": half fixed, half random, so parallel retries don't line up
+    cap = min(LLM_RETRY_BACKOFF_MAX_SEC, LLM_RETRY_BACKOFF_SEC * (2 ** attempt))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def call_with_retries(fn, *, name: str, cancel_event: Optional[threading.Event] = None) -> Any:
     if CB.is_open():
         raise RuntimeError("LLM circuit breaker is open (LM Studio temporarily unavailable).")
 
@@ -492,18 +1261,471 @@ def call_with_retries(fn, *, name: str) -> Any:
             CB.on_success()
             return res
         except Exception as e:
+            # aborted by /stop: not a backend failure, don't retry
+            if cancel_event is not None and cancel_event.is_set():
+                raise
             last_exc = e
-            CB.on_failure()
-            record_error(f"{name} failed: {type(e).__name__}: {e}")
-            if attempt >= LLM_MAX_RETRIES:
+            kind = classify_llm_error(e)
+            LLM_ERROR_KINDS[kind] += 1
+            record_error(f"{name} failed [{kind}]: {type(e).__name__}: {e}")
+
+            # Only "server is down/broken" errors open the breaker: a slow request (timeout)
+            # or a bad request (4xx) says nothing about other users' requests.
+            if kind in ("connect", "server", "other"):
+                CB.on_failure()
+            if kind == "client" and is_model_not_found(e):
+                # the catalog snapshot is stale: don't wait MODEL_ID_TTL_SEC for the next refresh
+                model_catalog.refresh_now()
+            # a backend that did not start answering within the TTFT deadline won't do better
+            # on a retry; the hedge to BASE_URL_SECONDARY is what covers a slow start
+            if kind == "client" or isinstance(e, TTFTTimeoutError) or attempt >= LLM_MAX_RETRIES:
                 break
-            sleep_s = LLM_RETRY_BACKOFF_SEC * (2 ** attempt)
-            time.sleep(sleep_s)
+
+            sleep_s = retry_backoff_sec(attempt)
+            if cancel_event is not None:
+                if cancel_event.wait(sleep_s):
+                    raise
+            else:
+                time.sleep(sleep_s)
 
     assert last_exc is not None
     raise last_exc
 
 
+class LatencyTracker:
+    def __init__(self, maxlen: int = 200) -> None:
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=maxlen)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            data = sorted(self._samples)
+        if not data:
+            return None
+        return data[min(len(data) - 1, int(len(data) * p))]
+
+
+TTFT_TRACKER = LatencyTracker()
+HEDGE_STATS: Dict[str, int] = {"hedged": 0, "secondary_won": 0}
+HEDGE_STATS_LOCK = threading.Lock()  # updated from the hedged_call threads
+
+
+def hedge_delay_sec() -> float:
+    p95 = TTFT_TRACKER.percentile(0.95)
+    if p95 is None:
+        p95 = LLM_TTFT_TIMEOUT_SEC / 4
+    return max(LLM_HEDGE_MIN_DELAY_SEC, p95)
+
+
+def hedged_call(
+    primary: Callable[[], Any],
+    secondary: Callable[[], Any],
+    delay_sec: float,
+    abort: Callable[[str], None],
+) -> Any:
+    """
+    Run primary; if it has not returned within delay_sec (or failed), also run secondary.
+    Returns the first successful result and calls abort(tag) for the losing attempt
+    ("primary" / "secondary"). Raises the last error if both fail.
+    """
+    results: "queue.Queue[Tuple[str, Any, Optional[Exception]]]" = queue.Queue()
+
+    def _run(tag: str, fn: Callable[[], Any]) -> None:
+        try:
+            results.put((tag, fn(), None))
+        except Exception as e:
+            results.put((tag, None, e))
+
+    threading.Thread(target=_run, args=("primary", primary), daemon=True).start()
+    try:
+        tag, res, err = results.get(timeout=max(0.0, delay_sec))
+        if err is None:
+            return res
+        errors: List[Exception] = [err]
+    except queue.Empty:
+        errors = []
+
+    with HEDGE_STATS_LOCK:
+        HEDGE_STATS["hedged"] += 1
+    threading.Thread(target=_run, args=("secondary", secondary), daemon=True).start()
+
+    pending = 2 - len(errors)
+    while pending:
+        tag, res, err = results.get()
+        pending -= 1
+        if err is None:
+            if tag == "secondary":
+                with HEDGE_STATS_LOCK:
+                    HEDGE_STATS["secondary_won"] += 1
+            if pending:
+                abort("secondary" if tag == "primary" else "primary")
+            return res
+        errors.append(err)
+    raise errors[-1]
+
+
+# =============================================================================
+# RETRIEVAL (BM25)
+# =============================================================================
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_RU_VOWEL_ENDINGS = "аяоеёыиуюйь"
+
+
+def bm25_terms(text: str) -> List[str]:
+    # crude stemming (vowel endings off + 6-char prefix): кот/кота/коту -> "кот" without a morphology library
+    out: List[str] = []
+    for w in _WORD_RE.findall(text.lower()):
+        while len(w) > 3 and w[-1] in _RU_VOWEL_ENDINGS:
+            w = w[:-1]
+        if len(w) > 1:
+            out.append(w[:6])
+    return out
+
+
+class BM25Index:
+    """Okapi BM25 with an inverted index; documents can be appended, terms are computed once."""
+
+    def __init__(self, docs: Optional[List[str]] = None, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)  # term -> [(doc, tf)]
+        self._len: List[int] = []
+        self._total_len = 0
+        for d in docs or []:
+            self.add(d)
+
+    def __len__(self) -> int:
+        return len(self._len)
+
+    def add(self, doc: str) -> int:
+        terms = bm25_terms(doc)
+        tf: Dict[str, int] = defaultdict(int)
+        for t in terms:
+            tf[t] += 1
+        i = len(self._len)
+        self._len.append(len(terms))  # before the postings: a concurrent scores() may already see doc i
+        self._total_len += len(terms)
+        for t, f in tf.items():
+            self._postings[t].append((i, f))
+        return i
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """doc index -> score, only documents sharing a term with the query."""
+        n = len(self._len)
+        if not n:
+            return {}
+        avgdl = self._total_len / n or 1.0
+        out: Dict[int, float] = defaultdict(float)
+        for t in set(bm25_terms(query)):
+            posting = self._postings.get(t)
+            if not posting:
+                continue
+            idf = math.log(1.0 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for i, f in posting:
+                norm = self.k1 * (1.0 - self.b + self.b * self._len[i] / avgdl)
+                out[i] += idf * f * (self.k1 + 1.0) / (f + norm)
+        return out
+
+    def top_k(self, query: str, k: int, matched_only: bool = False) -> List[int]:
+        """Indices of the k best documents; ties (incl. unmatched) keep document order."""
+        sc = self.scores(query)
+        best = sorted(sc, key=lambda i: (-sc[i], i))[: max(0, k)]
+        if not matched_only:
+            best += [i for i in range(len(self._len)) if i not in sc][: max(0, k - len(best))]
+        return best
+
+
+# user -> (memory items, index); rebuilt only when the items change
+_MEMORY_INDEX: "OrderedDict[str, Tuple[Tuple[str, ...], BM25Index]]" = OrderedDict()
+_MEMORY_INDEX_LOCK = threading.Lock()
+
+
+def memory_index_for(user_id: str, items: Tuple[str, ...]) -> BM25Index:
+    with _MEMORY_INDEX_LOCK:
+        hit = _MEMORY_INDEX.get(user_id)
+        if hit is not None and hit[0] == items:
+            _MEMORY_INDEX.move_to_end(user_id)
+            return hit[1]
+    index = BM25Index(list(items))
+    with _MEMORY_INDEX_LOCK:
+        _MEMORY_INDEX[user_id] = (items, index)
+        _MEMORY_INDEX.move_to_end(user_id)
+        while len(_MEMORY_INDEX) > max(1, MEMORY_INDEX_CACHE_SIZE):
+            _MEMORY_INDEX.popitem(last=False)
+    return index
+
+
+def archive_dropped_messages(user_id: str, before: List[Dict[str, Any]], after: List[Dict[str, Any]]) -> int:
+    """Append user/assistant messages present in `before` but gone from `after` to the user's archive."""
+    # Legacy messages without _ts share a key with every identical text, so copies are counted:
+    # trimming drops the oldest messages, the newest copies are the kept ones.
+    kept = Counter(message_key(m.get("role", ""), m.get("_ts"), _content_to_plain_text(m)) for m in after)
+    rows: List[bytes] = []
+    for m in reversed(before):
+        role = m.get("role")
+        if role not in ("user", "assistant"):
+            continue
+        text = _content_to_plain_text(m)
+        if not text:
+            continue
+        key = message_key(role, m.get("_ts"), text)
+        if kept[key] > 0:
+            kept[key] -= 1
+            continue
+        rows.append(dumps_json_bytes({"ts": m.get("_ts"), "role": role, "text": text}, compact=True) + b"\n")
+    if not rows:
+        return 0
+    rows.reverse()
+    path = history_store.archive_path(user_id)
+    try:
+        with open(path, "ab") as f:
+            f.writelines(rows)
+        if history_archive is not None and os.path.getsize(path) > HISTORY_ARCHIVE_JSONL_MAX_BYTES:
+            roll_archive_jsonl(user_id)
+    except Exception as e:
+        record_error(f"archive write failed: {type(e).__name__}: {e}")
+        return 0
+    return len(rows)
+
+
+def roll_archive_jsonl(user_id: str) -> int:
+    """Move <uid>.archive.jsonl into a compressed archive segment (caller holds STATE_LOCK)."""
+    path = history_store.archive_path(user_id)
+    rows: List[Dict[str, Any]] = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except Exception:
+                continue
+    n = history_archive.add_rows(user_id, rows)
+    open(path, "wb").close()  # recall sees the shrink and rebuilds from the segments
+    logger.info("Archived %d messages of %s (%d rows read)", n, user_id, len(rows))
+    return n
+
+
+def compact_history_backups(keep: bool = False) -> Dict[str, int]:
+    """
+    Convert rotated backups (<uid>.json.N, legacy history.json.N) into archive segments.
+    A source file is removed (unless keep=True) only once every message it held is found
+    in the segments on disk; a file in an unexpected layout is left alone.
+    """
+    stats = {"files": 0, "messages": 0, "bytes_before": 0}
+    if history_archive is None:
+        return stats
+    sources: List[Tuple[str, Optional[str]]] = []
+    if os.path.isdir(HISTORY_DIR):
+        for name in sorted(os.listdir(HISTORY_DIR)):
+            base, _, n = name.rpartition(".json.")
+            if base and n.isdigit():
+                sources.append((os.path.join(HISTORY_DIR, name), base))
+    legacy = [f"{HISTORY_FILE}.{i}" for i in range(1, HISTORY_ROTATE_BACKUPS + 1)]
+    sources += [(p, None) for p in legacy if os.path.exists(p)]
+
+    for path, user_id in sources:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            data = load_json_file(path)
+            size = len(raw)
+            if user_id is not None and isinstance(data, list):
+                histories = {user_id: data}
+            elif user_id is None and isinstance(data, dict):
+                histories = {uid(k): history for k, history in data.items()}
+            else:
+                logger.warning("Archive: unexpected layout in %s (%s), file kept", path, type(data).__name__)
+                continue
+            # content hash, not the name: rotation renames backups, re-converting one adds nothing
+            source = hashlib.sha1(raw).hexdigest()[:16]
+            archived = True
+            for k, history in histories.items():
+                rows = history_archive.history_rows(history, source)
+                stats["messages"] += history_archive.add_rows(k, rows)
+                archived = archived and history_archive.has_rows(k, rows)
+            if not archived:
+                logger.warning("Archive: %s is not fully in the archive, file kept", path)
+                record_error(f"archive {os.path.basename(path)}: verification failed, file kept")
+                continue
+            if not keep:
+                os.remove(path)
+            stats["files"] += 1
+            stats["bytes_before"] += size
+        except Exception as e:
+            logger.warning("Archive: failed to convert %s: %s", path, e)
+            record_error(f"archive {os.path.basename(path)}: {type(e).__name__}: {e}")
+    if stats["files"]:
+        logger.info("Archived %d backup files (%d new messages)", stats["files"], stats["messages"])
+    return stats
+
+
+class RecallIndex:
+    """
+    BM25 over one user's past messages: <uid>.archive.jsonl (read incrementally from the last offset),
+    archive segments (read once), rotated <uid>.json.N and legacy history.json.N backups
+    (re-read only when changed).
+    """
+
+    def __init__(self) -> None:
+        self.docs: List[Tuple[Any, str, str]] = []   # (ts, role, text)
+        self.bm25 = BM25Index()
+        self._keys: set[str] = set()
+        self._sources: Dict[str, Tuple[float, int]] = {}   # path -> (mtime, size) or (0, offset) for the archive
+
+    def _add(self, ts: Any, role: str, text: str) -> None:
+        key = message_key(role, ts, text)
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        self.docs.append((ts, role, text))
+        self.bm25.add(text)
+
+    def _add_history(self, history: Any) -> None:
+        if not isinstance(history, list):
+            return
+        for m in history:
+            if isinstance(m, dict) and m.get("role") in ("user", "assistant"):
+                text = _content_to_plain_text(m)
+                if text:
+                    self._add(m.get("_ts"), m["role"], text)
+
+    def update(self, user_id: str) -> bool:
+        """Index what is new on disk. False = the archive was rewritten, the index must be rebuilt."""
+        path = history_store.archive_path(user_id)
+        _, offset = self._sources.get(path, (0.0, 0))
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size < offset:
+                return False
+            if size > offset:
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break  # partial line of a concurrent append: next time
+                        offset += len(line)
+                        try:
+                            row = json.loads(line)
+                            self._add(row.get("ts"), str(row.get("role") or ""), str(row.get("text") or ""))
+                        except Exception:
+                            continue
+                self._sources[path] = (0.0, offset)
+
+        if history_archive is not None:
+            for p in history_archive.segments(user_id):
+                if p in self._sources:
+                    continue  # segments are immutable
+                try:
+                    for row in history_archive.read_segment(p):
+                        self._add(row.get("ts"), str(row.get("role") or ""), str(row.get("text") or ""))
+                    self._sources[p] = (0.0, 0)
+                except Exception as e:
+                    logger.warning("Recall: failed to index %s: %s", p, e)
+
+        backups = history_store.backup_paths(user_id)
+        legacy = [f"{HISTORY_FILE}.{i}" for i in range(1, HISTORY_ROTATE_BACKUPS + 1)]
+        for p in backups + [p for p in legacy if os.path.exists(p)]:
+            try:
+                st = os.stat(p)
+                if self._sources.get(p) == (st.st_mtime, st.st_size):
+                    continue
+                data = load_json_file(p)
+                self._add_history(data.get(user_id) if isinstance(data, dict) else data)
+                self._sources[p] = (st.st_mtime, st.st_size)
+            except Exception as e:
+                logger.warning("Recall: failed to index %s: %s", p, e)
+        return True
+
+
+class RecallStore:
+    """Per-user RecallIndex cache. Indexing runs on the idle path; search never touches the disk."""
+
+    def __init__(self, max_users: int, max_docs: int) -> None:
+        self.max_users = max(1, max_users)
+        self.max_docs = max(100, max_docs)
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()  # one indexer at a time; searches don't wait for it
+        self._indexes: "OrderedDict[str, RecallIndex]" = OrderedDict()
+        self.stats: Dict[str, int] = {"updates": 0, "searches": 0, "hits": 0}
+
+    def update(self, user_id: str) -> None:
+        with self._update_lock:
+            self._update(user_id)
+
+    def _update(self, user_id: str) -> None:
+        with self._lock:
+            idx = self._indexes.get(user_id) or RecallIndex()
+        if not idx.update(user_id):
+            idx = RecallIndex()
+            idx.update(user_id)
+        if len(idx.docs) > self.max_docs * 1.2:
+            # BM25 postings can't drop documents: rebuild from the newest max_docs
+            fresh = RecallIndex()
+            for ts, role, text in idx.docs[-self.max_docs:]:
+                fresh._add(ts, role, text)
+            fresh._sources = idx._sources
+            idx = fresh
+        with self._lock:
+            self._indexes[user_id] = idx
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            self.stats["updates"] += 1
+
+    def search(self, user_id: str, query: str, k: int, exclude: set[str]) -> List[Tuple[Any, str, str]]:
+        with self._lock:
+            idx = self._indexes.get(user_id)
+            self.stats["searches"] += 1
+        if idx is None or not query:
+            return []
+        out: List[Tuple[Any, str, str]] = []
+        for i in idx.bm25.top_k(query, k + len(exclude), matched_only=True):
+            doc = idx.docs[i]
+            if doc[2] not in exclude:
+                out.append(doc)
+            if len(out) >= k:
+                break
+        if out:
+            with self._lock:
+                self.stats["hits"] += 1
+        return out
+
+    def sizes(self) -> Tuple[int, int]:
+        with self._lock:
+            return len(self._indexes), sum(len(i.docs) for i in self._indexes.values())
+
+
+recall_store = RecallStore(RECALL_MAX_USERS, RECALL_MAX_DOCS_PER_USER)
+
+
+def recall_text_for(user_id: str, query: str, exclude: set[str], model_id: Optional[str] = None) -> str:
+    """Relevant past snippets for the prompt, at most RECALL_TOKEN_BUDGET tokens."""
+    if not RECALL_ENABLED or not query:
+        return ""
+    docs = recall_store.search(user_id, query, RECALL_TOP_K, exclude)
+    if not docs:
+        return ""
+    est = get_token_estimator(model_id)
+    header = "Фрагменты прошлых разговоров (используй, только если относятся к вопросу):"
+    lines = [header]
+    used = est.count_text_tokens(header)
+    for ts, role, text in docs:
+        if len(text) > RECALL_SNIPPET_CHARS:
+            text = text[:RECALL_SNIPPET_CHARS].rstrip() + "…"
+        when = time.strftime("%Y-%m-%d", time.localtime(ts)) if isinstance(ts, (int, float)) else "?"
+        line = f"- [{when}] {'U' if role == 'user' else 'A'}: {text}"
+        n = est.count_text_tokens(line)
+        if used + n > RECALL_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += n
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+
 # =============================================================================
 # SETTINGS / MEMORY
 # =============================================================================
@@ -515,6 +1737,7 @@ def get_settings(user_id: Union[int, str]) -> Dict[str, Any]:
     k = uid(user_id)
     changed = False
     with STATE_LOCK:
+        user_settings: Dict[str, Dict[str, Any]] = settings_store.get()
         if k not in user_settings or not isinstance(user_settings.get(k), dict):
             user_settings[k] = copy.deepcopy(DEFAULT_CFG)
             changed = True
@@ -542,7 +1765,12 @@ def get_settings(user_id: Union[int, str]) -> Dict[str, Any]:
         return user_settings[k]
 
 
-def memory_text_for(user_id: Union[int, str]) -> str:
+def memory_text_for(user_id: Union[int, str], query: Optional[str] = None) -> str:
+    """
+    Memory block for the current turn: at most MEMORY_TOP_K items.
+    With a query (the current user message) the items are ranked by BM25, the rest by recency
+    (new items are inserted first), so the prompt does not grow with the memory size.
+    """
     s = get_settings(user_id)
     mem = s.get("memory", [])
     if not mem:
@@ -556,18 +1784,27 @@ def memory_text_for(user_id: Union[int, str]) -> str:
     if not safe_items:
         return ""
 
-    lines = "\n".join(f"- {x}" for x in safe_items[:MAX_MEMORY_ITEMS])
+    safe_items = safe_items[:MAX_MEMORY_ITEMS]
+    k = max(1, MEMORY_TOP_K)
+    if query and len(safe_items) > k:
+        index = memory_index_for(uid(user_id), tuple(safe_items))
+        picked = index.top_k(query, k)
+        safe_items = [safe_items[i] for i in sorted(picked)]
+    else:
+        safe_items = safe_items[:k]
+
+    lines = "\n".join(f"- {x}" for x in safe_items)
     return "Память о пользователе (учитывай это, если уместно):\n" + lines + "\n"
 
 
 def system_prompt_for(user_id: Union[int, str]) -> str:
+    # no per-query parts here: message 0 stays byte-identical between turns, so the
+    # server can reuse the cached prompt prefix (memory goes next to the user turn)
     s = get_settings(user_id)
     role_text = ROLES.get(s.get("role", "default"), ROLES["default"])
-    mem = memory_text_for(user_id)
     return (
         f"{role_text}\n\n"
-        f"{EXECUTION_GUIDE}\n"
-        f"{mem}\n"
+        f"{EXECUTION_GUIDE}\n\n"
         f"{RESPONSE_FORMAT_INSTRUCTION}"
     ).strip()
 
@@ -575,7 +1812,9 @@ def system_prompt_for(user_id: Union[int, str]) -> str:
 def init_history(user_id: Union[int, str]) -> None:
     k = uid(user_id)
     with STATE_LOCK:
+        old = chat_histories.get(k) or []
         chat_histories[k] = [{"role": "system", "content": system_prompt_for(k)}]
+        archive_dropped_messages(k, old, [])
         history_store.save()
 
 
@@ -607,41 +1846,249 @@ def get_token_status(user_id: Union[int, str]) -> TokenStatus:
     k = uid(user_id)
     with STATE_LOCK:
         history = chat_histories.get(k) or []
-        used = token_estimator.estimate_messages(history)
-    return TokenStatus(used=used, left=TOKEN_LIMIT - used)
+        used = get_token_estimator().estimate_messages(history)
+    limit = history_token_budget()
+    return TokenStatus(used=used, left=limit - used, limit=limit)
+
+
+# =============================================================================
+# LM STUDIO MODEL CATALOG (background refresh)
+# =============================================================================
+
+@dataclass(frozen=True)
+class ModelInfo:
+    id: str
+    type: str = "llm"                              # llm | vlm | embeddings (REST API only)
+    state: str = "unknown"                         # loaded | not-loaded | unknown (/v1/models)
+    arch: str = ""
+    max_context_length: Optional[int] = None
+    loaded_context_length: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ModelCatalog:
+    models: Tuple[ModelInfo, ...] = ()
+    active_id: str = "local-model"
+    source: str = "none"                           # rest | openai | none
+    fetched_at: float = 0.0
+    error: str = ""
+
+    def get(self, model_id: str) -> Optional[ModelInfo]:
+        for m in self.models:
+            if m.id == model_id:
+                return m
+        return None
+
+    def loaded(self) -> List[ModelInfo]:
+        return [m for m in self.models if m.state == "loaded"]
+
+
+def _lmstudio_rest_models_url() -> str:
+    if LMSTUDIO_REST_MODELS_URL:
+        return LMSTUDIO_REST_MODELS_URL
+    root = BASE_URL.rstrip("/")
+    if root.endswith("/v1"):
+        root = root[: -len("/v1")]
+    return root + "/api/v0/models"
+
+
+def _opt_int(v: Any) -> Optional[int]:
+    try:
+        n = int(v)
+    except (TypeError, ValueError):
+        return None
+    return n if n > 0 else None
+
+
+def _fetch_catalog_rest() -> Optional[List[ModelInfo]]:
+    """LM Studio REST API: loaded state + context lengths. None = endpoint not available."""
+    if httpx is None:
+        return None
+    r = httpx.get(
+        _lmstudio_rest_models_url(),
+        headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+        timeout=httpx.Timeout(MODEL_CATALOG_TIMEOUT_SEC, connect=LLM_CONNECT_TIMEOUT_SEC),
+    )
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    data = r.json().get("data")
+    if not isinstance(data, list):
+        return None
+    out: List[ModelInfo] = []
+    for d in data:
+        if not isinstance(d, dict) or not isinstance(d.get("id"), str) or not d["id"].strip():
+            continue
+        out.append(ModelInfo(
+            id=d["id"].strip(),
+            type=str(d.get("type") or "llm"),
+            state=str(d.get("state") or "unknown"),
+            arch=str(d.get("arch") or ""),
+            max_context_length=_opt_int(d.get("max_context_length")),
+            loaded_context_length=_opt_int(d.get("loaded_context_length")),
+        ))
+    return out
+
+
+def _fetch_catalog_openai() -> List[ModelInfo]:
+    models = _openai_models_list(MODEL_CATALOG_TIMEOUT_SEC)
+    out: List[ModelInfo] = []
+    for m in getattr(models, "data", None) or []:
+        mid = getattr(m, "id", None)
+        if isinstance(mid, str) and mid.strip():
+            out.append(ModelInfo(id=mid.strip()))
+    return out
 
 
-# =============================================================================
-# LM STUDIO ACTIVE MODEL RESOLVE
-# =============================================================================
+def _pick_active_model_id(models: List[ModelInfo]) -> str:
+    chat_models = [m for m in models if m.type != "embeddings"]
+    for m in chat_models:
+        if m.state == "loaded":
+            return m.id
+    # /v1/models lists the loaded model first; REST API without a loaded model: JIT-load the first one
+    return chat_models[0].id if chat_models else "local-model"
+
+
+class ModelCatalogRefresher:
+    """
+    Keeps a ModelCatalog snapshot fresh from a background thread.
+    Readers never touch the network: they get the last snapshot (possibly stale).
+    Refresh failures don't go through call_with_retries and don't trip the circuit breaker.
+    """
+
+    def __init__(self, interval_sec: float) -> None:
+        self.interval_sec = max(5.0, interval_sec)
+        self._lock = threading.Lock()
+        self._snapshot = ModelCatalog()
+        self._wake = threading.Event()
+        self.stats: Dict[str, int] = {"refreshes": 0, "failures": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="model-catalog", daemon=True)
+            self._thread.start()
+
+    def snapshot(self) -> ModelCatalog:
+        with self._lock:
+            return self._snapshot
 
-_MODEL_ID_CACHE: Dict[str, Any] = {"value": "local-model", "ts": 0.0}
+    def refresh_now(self) -> None:
+        # async: the caller keeps the current snapshot
+        self._wake.set()
 
+    def _loop(self) -> None:
+        while not SHUTDOWN_EVENT.is_set():
+            self._refresh_once()
+            self._wake.wait(self.interval_sec)
+            self._wake.clear()
 
-def resolve_lmstudio_model_id() -> str:
-    now = time.time()
-    if MODEL_ID_TTL_SEC > 0 and (now - float(_MODEL_ID_CACHE["ts"])) < MODEL_ID_TTL_SEC:
-        v = _MODEL_ID_CACHE["value"]
-        return v if isinstance(v, str) and v else "local-model"
+    def _refresh_once(self) -> None:
+        source = "rest"
+        try:
+            try:
+                models = _fetch_catalog_rest()
+            except Exception as e:
+                logger.debug("LM Studio REST models failed, falling back to /v1/models: %s", e)
+                models = None
+            if models is None:
+                source = "openai"
+                models = _fetch_catalog_openai()
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"
+            with self._lock:
+                prev = self._snapshot
+                self._snapshot = ModelCatalog(
+                    models=prev.models, active_id=prev.active_id, source=prev.source,
+                    fetched_at=prev.fetched_at, error=err,
+                )
+                self.stats["failures"] += 1
+            if not prev.error:
+                logger.warning("Model catalog refresh failed (keeping last snapshot): %s", err)
+                record_error(f"model catalog: {err}")
+            return
 
-    def _list():
-        return _openai_models_list()
+        snap = ModelCatalog(
+            models=tuple(models),
+            active_id=_pick_active_model_id(models),
+            source=source,
+            fetched_at=time.time(),
+        )
+        with self._lock:
+            prev = self._snapshot
+            self._snapshot = snap
+            self.stats["refreshes"] += 1
+        if prev.active_id != snap.active_id or prev.error:
+            logger.info("Model catalog: active=%s source=%s models=%d", snap.active_id, source, len(models))
 
-    model_id = "local-model"
-    try:
-        models = call_with_retries(_list, name="models.list")
-        data = getattr(models, "data", None)
-        if isinstance(data, list) and data:
-            mid = getattr(data[0], "id", None)
-            if isinstance(mid, str) and mid.strip():
-                model_id = mid.strip()
-    except Exception:
-        # leave fallback
-        pass
 
-    _MODEL_ID_CACHE["value"] = model_id
-    _MODEL_ID_CACHE["ts"] = now
-    return model_id
+model_catalog = ModelCatalogRefresher(MODEL_ID_TTL_SEC)
+
+
+def resolve_lmstudio_model_id() -> str:
+    # never blocks: last snapshot from the refresher thread
+    return model_catalog.snapshot().active_id
+
+
+CONTEXT_OVERRIDES: List[Tuple[str, int]] = [
+    (pattern, int(value))
+    for pattern, value in _parse_pattern_map(MODEL_CONTEXT_OVERRIDES, "MODEL_CONTEXT_OVERRIDES")
+    if _opt_int(value)
+]
+
+
+def model_context_limit(model_id: Optional[str] = None) -> Tuple[int, str]:
+    """
+    Context window of a model -> (tokens, source).
+    override table > loaded context length > max context length (capped by TOKEN_LIMIT:
+    the model may be loaded with a smaller context than it supports) > TOKEN_LIMIT.
+    """
+    snap = model_catalog.snapshot()
+    model_id = model_id or snap.active_id
+    for pattern, n in CONTEXT_OVERRIDES:
+        if fnmatch.fnmatchcase(model_id, pattern):
+            return n, "override"
+    info = snap.get(model_id)
+    if info is not None and info.loaded_context_length:
+        return info.loaded_context_length, "loaded"
+    if info is not None and info.max_context_length:
+        return min(info.max_context_length, TOKEN_LIMIT), "max"
+    return TOKEN_LIMIT, "default"
+
+
+def history_token_budget(model_id: Optional[str] = None, max_tokens: Optional[int] = None) -> int:
+    # prompt budget = context window minus room for the answer
+    limit, _ = model_context_limit(model_id)
+    reserve = max_tokens if max_tokens else OUTPUT_TOKENS_RESERVE
+    return max(MIN_TEXT_TOKENS_TO_KEEP, limit - reserve)
+
+
+def answer_max_tokens(model_id: Optional[str] = None, max_tokens: Optional[int] = None) -> Optional[int]:
+    """
+    max_tokens for the request, so prompt (up to history_token_budget) + answer fit the window.
+    None = no cap needed (OUTPUT_TOKENS_RESERVE fits); in a window too small for the reserve
+    the answer gets what is left after MIN_TEXT_TOKENS_TO_KEEP.
+    """
+    limit, _ = model_context_limit(model_id)
+    room = max(1, limit - history_token_budget(model_id, max_tokens))
+    if max_tokens:
+        return min(max_tokens, room)
+    return room if room < OUTPUT_TOKENS_RESERVE else None
+
+
+def model_catalog_text(max_items: int = 5) -> str:
+    snap = model_catalog.snapshot()
+    if snap.fetched_at <= 0:
+        return f"(ещё не получен{': ' + snap.error if snap.error else ''})"
+    shown = snap.loaded() or list(snap.models)
+    parts = []
+    for m in shown[:max_items]:
+        ctx = m.loaded_context_length or m.max_context_length
+        parts.append(f"{m.id}{f' ctx={ctx}' if ctx else ''}{' [loaded]' if m.state == 'loaded' else ''}")
+    more = f" +{len(shown) - max_items}" if len(shown) > max_items else ""
+    age = time.time() - snap.fetched_at
+    stale = f" | ошибка: {snap.error}" if snap.error else ""
+    return f"{', '.join(parts) or '(пусто)'}{more} ({snap.source}, {age:.0f}s ago{stale})"
 
 
 # =============================================================================
@@ -650,14 +2097,19 @@ def resolve_lmstudio_model_id() -> str:
 
 def store_user_text(user_id: str, text: str, job_id: int) -> None:
     with STATE_LOCK:
-        chat_histories[user_id].append({"role": "user", "content": [{"type": "text", "text": text}], "_job_id": job_id})
+        chat_histories[user_id].append({"role": "user", "content": [{"type": "text", "text": text}], "_job_id": job_id, "_ts": time.time()})
         history_store.save()
 
 
 def store_user_photo(user_id: str, file_id: str, caption: str, job_id: int) -> None:
     with STATE_LOCK:
         chat_histories[user_id].append(
-            {"role": "user", "content": [{"type": "telegram_photo", "file_id": file_id, "caption": caption}], "_job_id": job_id}
+            {
+                "role": "user",
+                "content": [{"type": "telegram_photo", "file_id": file_id, "caption": caption}],
+                "_job_id": job_id,
+                "_ts": time.time(),
+            }
         )
         history_store.save()
 
@@ -677,7 +2129,7 @@ def insert_assistant_after_job(user_id: str, job_id: int, text: str) -> bool:
             return False
 
         history[idx].pop("_job_id", None)
-        history.insert(idx + 1, {"role": "assistant", "content": text})
+        history.insert(idx + 1, {"role": "assistant", "content": text, "_ts": time.time()})
         history_store.save()
         return True
 
@@ -799,6 +2251,51 @@ def check_rate_limit(user_id: str) -> Optional[str]:
 # QUEUE / JOBS
 # =============================================================================
 
+class CancelEvent(threading.Event):
+    """
+    threading.Event that also runs registered closers on set().
+
+    Closers abort in-flight LLM calls (close the HTTP stream/connection), so the
+    backend stops generating right away instead of on the next received token.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._closers_lock = threading.Lock()
+        self._closers: List[Callable[[], None]] = []
+        self.set_at: Optional[float] = None
+
+    def add_closer(self, fn: Callable[[], None]) -> None:
+        with self._closers_lock:
+            if not self.is_set():
+                self._closers.append(fn)
+                return
+        self._run_closer(fn)
+
+    def remove_closer(self, fn: Callable[[], None]) -> None:
+        with self._closers_lock:
+            try:
+                self._closers.remove(fn)
+            except ValueError:
+                pass
+
+    def set(self) -> None:
+        with self._closers_lock:
+            if self.set_at is None:
+                self.set_at = time.time()
+            closers, self._closers = self._closers, []
+        super().set()
+        for fn in closers:
+            self._run_closer(fn)
+
+    @staticmethod
+    def _run_closer(fn: Callable[[], None]) -> None:
+        try:
+            fn()
+        except Exception:
+            pass
+
+
 @dataclass
 class Job:
     job_id: int
@@ -808,7 +2305,9 @@ class Job:
     created_at: float
     priority: int
     has_image: bool
-    cancel_event: threading.Event = field(default_factory=threading.Event)
+    cancel_event: CancelEvent = field(default_factory=CancelEvent)
+    lane: str = "normal"   # "normal" | "fast"
+    slot: str = "normal"   # which slot pool the job occupies while running
     started: bool = False
     done: bool = False
     canceled: bool = False
@@ -820,6 +2319,14 @@ user_busy: Dict[str, bool] = {}
 active_job_by_user: Dict[str, int] = {}
 active_global: int = 0
 
+# fast lane: own FIFO + slot counter + metrics
+fast_queue: Deque[int] = deque()
+active_fast: int = 0
+FAST_LANE_STATS: Dict[str, int] = {"enqueued": 0, "started": 0, "borrowed": 0, "truncated": 0, "continued": 0}
+# truncated fast-lane answers waiting for a normal slot; each one reserves the next free normal slot
+fast_continuations_waiting: int = 0
+LANE_WAITS: Dict[str, Deque[float]] = {"normal": deque(maxlen=200), "fast": deque(maxlen=200)}
+
 
 def compute_priority(user_id: str, prompt_tokens_estimate: int, used_tokens_estimate: int, has_image: bool) -> int:
     is_owner = False
@@ -839,6 +2346,16 @@ def compute_priority(user_id: str, prompt_tokens_estimate: int, used_tokens_esti
     return pr
 
 
+def is_fast_lane_candidate(user_id: str, prompt_tokens_estimate: int, has_image: bool) -> bool:
+    if not FAST_LANE_ENABLED or has_image:
+        return False
+    if prompt_tokens_estimate > FAST_LANE_MAX_PROMPT_TOKENS:
+        return False
+    # only when the user has nothing else queued/running, so per-user order is kept
+    with SCHED_LOCK:
+        return not user_busy.get(user_id, False) and not has_pending_for_user(user_id)
+
+
 def get_or_create_user_queue(user_id: str) -> Deque[int]:
     q = user_queues.get(user_id)
     if q is None:
@@ -865,47 +2382,90 @@ def enqueue_job(job: Job) -> bool:
 
         q.append(job.job_id)
         jobs[job.job_id] = job
+        if job.lane == "fast":
+            fast_queue.append(job.job_id)
+            FAST_LANE_STATS["enqueued"] += 1
         SCHED_COND.notify_all()
         return True
 
 
-def select_next_job_id() -> Optional[int]:
-    global active_global
-    with SCHED_LOCK:
-        if active_global >= MAX_ACTIVE_GLOBAL:
-            return None
+def _select_fast_lane_job_id() -> Optional[int]:
+    while fast_queue:
+        j = jobs.get(fast_queue[0])
+        if not j or j.canceled or j.done or j.started:
+            fast_queue.popleft()
+        else:
+            break
+
+    for jid in fast_queue:
+        j = jobs.get(jid)
+        if not j or j.canceled or j.done or user_busy.get(j.user_id, False):
+            continue
+        q = user_queues.get(j.user_id)
+        if q and q[0] == jid:
+            return jid
+    return None
 
-        best: Optional[Tuple[int, float, int]] = None  # (priority, created_at, job_id)
 
-        for u, q in user_queues.items():
-            if not q:
-                continue
-            if user_busy.get(u, False):
-                continue
+def _select_normal_job_id() -> Optional[int]:
+    best: Optional[Tuple[int, float, int]] = None  # (priority, created_at, job_id)
 
-            while q:
-                j = jobs.get(q[0])
-                if not j or j.canceled or j.done:
-                    q.popleft()
-                else:
-                    break
-            if not q:
-                continue
+    for u, q in user_queues.items():
+        if not q:
+            continue
+        if user_busy.get(u, False):
+            continue
 
-            jid = q[0]
-            j = jobs.get(jid)
+        while q:
+            j = jobs.get(q[0])
             if not j or j.canceled or j.done:
                 q.popleft()
-                continue
+            else:
+                break
+        if not q:
+            continue
+
+        jid = q[0]
+        j = jobs.get(jid)
+        if not j or j.canceled or j.done:
+            q.popleft()
+            continue
+        if j.lane == "fast":
+            # fast-lane jobs only take normal slots through _select_fast_lane_job_id (FAST_LANE_BORROW_NORMAL_SLOTS)
+            continue
+
+        cand = (j.priority, j.created_at, jid)
+        if best is None or cand[0] > best[0] or (cand[0] == best[0] and cand[1] < best[1]):
+            best = cand
+
+    return best[2] if best is not None else None
+
+
+def select_next_job_id() -> Optional[int]:
+    global active_global, active_fast
+    with SCHED_LOCK:
+        normal_free = (active_global - active_fast + fast_continuations_waiting) < MAX_ACTIVE_GLOBAL
+        fast_free = FAST_LANE_ENABLED and active_fast < FAST_LANE_SLOTS
+        if not normal_free and not fast_free:
+            return None
 
-            cand = (j.priority, j.created_at, jid)
-            if best is None or cand[0] > best[0] or (cand[0] == best[0] and cand[1] < best[1]):
-                best = cand
+        jid: Optional[int] = None
+        slot = "normal"
 
-        if best is None:
+        if FAST_LANE_ENABLED:
+            fast_jid = _select_fast_lane_job_id()
+            if fast_jid is not None and fast_free:
+                jid, slot = fast_jid, "fast"
+            elif fast_jid is not None and normal_free and FAST_LANE_BORROW_NORMAL_SLOTS:
+                jid = fast_jid
+                FAST_LANE_STATS["borrowed"] += 1
+
+        if jid is None and normal_free:
+            jid = _select_normal_job_id()
+
+        if jid is None:
             return None
 
-        jid = best[2]
         j = jobs.get(jid)
         if not j:
             return None
@@ -918,22 +2478,60 @@ def select_next_job_id() -> Optional[int]:
                 q.remove(jid)
             except ValueError:
                 pass
+        if j.lane == "fast":
+            try:
+                fast_queue.remove(jid)
+            except ValueError:
+                pass
+            FAST_LANE_STATS["started"] += 1
+
+        j.slot = slot
+        LANE_WAITS[j.lane].append(time.time() - j.created_at)
 
         user_busy[j.user_id] = True
         active_job_by_user[j.user_id] = jid
         active_global += 1
+        if slot == "fast":
+            active_fast += 1
         return jid
 
 
 def mark_job_finished(user_id: str, job_id: int) -> None:
-    global active_global
+    global active_global, active_fast
     with SCHED_LOCK:
         user_busy[user_id] = False
         if active_job_by_user.get(user_id) == job_id:
             active_job_by_user.pop(user_id, None)
         if active_global > 0:
             active_global -= 1
+        j = jobs.get(job_id)
+        if j and j.slot == "fast" and active_fast > 0:
+            active_fast -= 1
+        SCHED_COND.notify_all()
+
+
+def move_job_to_normal_slot(job: Job) -> bool:
+    """
+    Hand a running fast-lane job's fast slot back and take the next free normal slot
+    (ahead of queued jobs). Blocks until one frees up; False if the job was stopped meanwhile.
+    """
+    global active_fast, fast_continuations_waiting
+    with SCHED_LOCK:
+        if job.slot != "fast":
+            return True
+        fast_continuations_waiting += 1
+        try:
+            while (active_global - active_fast) >= MAX_ACTIVE_GLOBAL:
+                if job.cancel_event.is_set() or SHUTDOWN_EVENT.is_set():
+                    return False
+                SCHED_COND.wait(timeout=1.0)
+        finally:
+            fast_continuations_waiting -= 1
+        job.slot = "normal"
+        active_fast -= 1
+        FAST_LANE_STATS["continued"] += 1
         SCHED_COND.notify_all()
+        return True
 
 
 def has_pending_for_user(user_id: str) -> bool:
@@ -1013,7 +2611,7 @@ def main_menu_keyboard(user_id: Union[int, str]) -> types.InlineKeyboardMarkup:
     s = get_settings(user_id)
 
     markup = types.InlineKeyboardMarkup(row_width=2)
-    markup.add(types.InlineKeyboardButton(f"🧠 Tokens: {st.used}/{TOKEN_LIMIT}", callback_data="show_tokens"))
+    markup.add(types.InlineKeyboardButton(f"🧠 Tokens: {st.used}/{st.limit}", callback_data="show_tokens"))
     markup.add(types.InlineKeyboardButton("🗑️ Новый чат", callback_data="new_chat"))
     markup.add(types.InlineKeyboardButton(f"🎭 Роль: {s['role']}", callback_data="menu_roles"))
     markup.add(types.InlineKeyboardButton(f"🌡️ Temp: {s['temperature']}", callback_data="menu_temp"))
@@ -1059,28 +2657,438 @@ def memory_keyboard() -> types.InlineKeyboardMarkup:
 # TELEGRAM UTILS
 # =============================================================================
 
-def safe_delete(chat_id: int, message_id: int) -> None:
-    try:
-        bot.delete_message(chat_id, message_id)
-    except Exception:
-        pass
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = max(0.01, rate)
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
 
 
-def safe_edit_text(chat_id: int, message_id: int, text: str, reply_markup: Optional[Any] = None) -> None:
+def telegram_retry_after(e: Exception) -> Optional[float]:
+    """retry_after (sec) for a Telegram 429 error, None for any other error."""
+    if getattr(e, "error_code", None) != 429:
+        return None
+    params = (getattr(e, "result_json", None) or {}).get("parameters") or {}
     try:
-        bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
-    except Exception:
+        return float(params.get("retry_after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+@dataclass
+class _OutboundOp:
+    chat_id: int
+    fn: Callable[[], Any]
+    edit_key: Optional[Tuple[int, int]] = None
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+
+
+class OutboundScheduler:
+    """
+    Single sender thread for all Telegram calls that post into chats (and callback answers).
+
+    Per-chat FIFO order is kept; chats are served round-robin under a per-chat and a
+    global token bucket. A chat's bucket outlives its queue until it has refilled, so
+    a burst split into separate submits is still rate-limited. A 429 blocks the chat
+    for retry_after and re-queues the call. A queued edit of a message is replaced by
+    a newer edit of the same message.
+    """
+
+    def __init__(self, per_chat_rate: float, per_chat_burst: float, global_rate: float) -> None:
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._cond = threading.Condition()
+        self._chats: "OrderedDict[int, Deque[_OutboundOp]]" = OrderedDict()
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._global = TokenBucket(global_rate, global_rate)
+        self._pending_edits: Dict[Tuple[int, int], _OutboundOp] = {}
+        self._last_prune = 0.0
+        self.stats: Dict[str, int] = {"sent": 0, "collapsed": 0, "flood_429": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._loop, name="tg-outbound", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        chat_id: int,
+        fn: Callable[[], Any],
+        *,
+        edit_key: Optional[Tuple[int, int]] = None,
+        wait: bool = True,
+    ) -> Any:
+        with self._cond:
+            if edit_key is not None and edit_key in self._pending_edits:
+                op = self._pending_edits[edit_key]
+                op.fn = fn
+                self.stats["collapsed"] += 1
+            else:
+                op = _OutboundOp(chat_id=chat_id, fn=fn, edit_key=edit_key)
+                self._chats.setdefault(chat_id, deque()).append(op)
+                if edit_key is not None:
+                    self._pending_edits[edit_key] = op
+                self._cond.notify()
+        if not wait:
+            return None
+        return op.future.result()
+
+    def drop_edits(self, edit_key: Tuple[int, int]) -> None:
+        # the message is being deleted: queued edits of it are pointless
+        with self._cond:
+            op = self._pending_edits.pop(edit_key, None)
+            if op is None:
+                return
+            dq = self._chats.get(op.chat_id)
+            if dq is not None:
+                try:
+                    dq.remove(op)
+                except ValueError:
+                    pass
+            op.future.set_result(None)
+            self.stats["collapsed"] += 1
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(dq) for dq in self._chats.values())
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            b = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._buckets[chat_id] = b
+        return b
+
+    def _prune_idle(self, now: float) -> None:
+        # a bucket that has refilled to capacity is the same as a fresh one: safe to forget
+        if now - self._last_prune < 1.0:
+            return
+        self._last_prune = now
+        for chat_id in [c for c in self._buckets if c not in self._chats]:
+            if self._buckets[chat_id].is_full(now) and self._blocked_until.get(chat_id, 0.0) <= now:
+                self._buckets.pop(chat_id, None)
+                self._blocked_until.pop(chat_id, None)
+
+    def _next_op(self) -> _OutboundOp:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune_idle(now)
+                wait_s = self._global.wait_time(now)
+                if wait_s <= 0:
+                    wait_s = 1.0
+                    for chat_id, dq in list(self._chats.items()):
+                        if not dq:
+                            self._chats.pop(chat_id, None)
+                            continue
+                        w = max(self._blocked_until.get(chat_id, 0.0) - now, self._bucket(chat_id).wait_time(now))
+                        if w > 0:
+                            wait_s = min(wait_s, w)
+                            continue
+                        op = dq.popleft()
+                        self._chats.move_to_end(chat_id)  # round-robin between chats
+                        self._bucket(chat_id).take(now)
+                        self._global.take(now)
+                        if op.edit_key is not None and self._pending_edits.get(op.edit_key) is op:
+                            self._pending_edits.pop(op.edit_key, None)
+                        return op
+                self._cond.wait(timeout=wait_s if self._chats else (1.0 if self._buckets else None))
+
+    def _loop(self) -> None:
+        while True:
+            op = self._next_op()
+            op.attempts += 1
+            try:
+                res = op.fn()
+            except Exception as e:
+                retry_after = telegram_retry_after(e)
+                if retry_after is not None and op.attempts <= TG_MAX_429_RETRIES:
+                    self.stats["flood_429"] += 1
+                    with self._cond:
+                        self._blocked_until[op.chat_id] = time.monotonic() + retry_after
+                        self._chats.setdefault(op.chat_id, deque()).appendleft(op)
+                    continue
+                self.stats["failed"] += 1
+                record_error(f"telegram send failed (chat {op.chat_id}): {type(e).__name__}: {e}")
+                op.future.set_exception(e)
+                continue
+            self.stats["sent"] += 1
+            op.future.set_result(res)
+
+
+outbound = OutboundScheduler(TG_PER_CHAT_RATE, TG_PER_CHAT_BURST, TG_GLOBAL_RATE)
+
+
+def tg_send(chat_id: int, text: str, reply_markup: Optional[Any] = None, wait: bool = True, **kwargs: Any) -> Any:
+    return outbound.submit(
+        chat_id,
+        lambda: bot.send_message(chat_id, text, reply_markup=reply_markup, **kwargs),
+        wait=wait,
+    )
+
+
+def tg_reply(message: types.Message, text: str, reply_markup: Optional[Any] = None, **kwargs: Any) -> Any:
+    return outbound.submit(
+        message.chat.id,
+        lambda: bot.reply_to(message, text, reply_markup=reply_markup, **kwargs),
+    )
+
+
+def tg_send_document(chat_id: int, document: Any, caption: Optional[str] = None, **kwargs: Any) -> Any:
+    def _op() -> Any:
+        # a 429 re-runs the op: the previous attempt already read the file to EOF
+        if callable(getattr(document, "seek", None)):
+            document.seek(0)
+        return bot.send_document(chat_id, document, caption=caption, **kwargs)
+
+    return outbound.submit(chat_id, _op)
+
+
+def tg_answer_callback(call: types.CallbackQuery, text: Optional[str] = None) -> None:
+    def _op() -> None:
         try:
-            bot.send_message(chat_id, text, reply_markup=reply_markup)
-        except Exception:
-            pass
+            bot.answer_callback_query(call.id, text)
+        except Exception as e:
+            # a stale query (answered late) is not worth an error
+            if telegram_retry_after(e) is not None:
+                raise
+
+    chat_id = call.message.chat.id if call.message else call.from_user.id
+    outbound.submit(chat_id, _op, wait=False)
+
+
+def safe_delete(chat_id: int, message_id: int) -> None:
+    def _op() -> None:
+        try:
+            bot.delete_message(chat_id, message_id)
+        except Exception as e:
+            if telegram_retry_after(e) is not None:
+                raise
+
+    outbound.drop_edits((chat_id, message_id))
+    outbound.submit(chat_id, _op, wait=False)
+
+
+def safe_edit_text(
+    chat_id: int,
+    message_id: int,
+    text: str,
+    reply_markup: Optional[Any] = None,
+    parse_mode: Optional[str] = None,
+    fallback_send: bool = True,
+) -> None:
+    def _op() -> Any:
+        try:
+            return bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup, parse_mode=parse_mode)
+        except Exception as e:
+            if telegram_retry_after(e) is not None:
+                raise
+            if "message is not modified" in str(e) or not fallback_send:
+                return None
+            return bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+    outbound.submit(chat_id, _op, edit_key=(chat_id, message_id), wait=False)
+
+
+def html_escape(s: str) -> str:
+    return (
+        s.replace("&", "&amp;")
+         .replace("<", "&lt;")
+         .replace(">", "&gt;")
+    )
+
+
+def looks_like_code(text: str) -> bool:
+    """
+    Heuristic: if the answer is mostly code-like and multiline.
+    We use this only if model forgot to add ``` fences.
+    """
+    if "```" in text:
+        return False
+    if "\n" not in text:
+        return False
+    code_markers = ("import ", "def ", "class ", "{", "};", "function ", "#include", "SELECT ", "FROM ", "->", "=>")
+    hits = sum(1 for m in code_markers if m in text)
+    lines = [ln for ln in text.splitlines() if ln.strip()]
+    if len(lines) < 4:
+        return False
+    indent_lines = sum(1 for ln in lines if ln.startswith(("    ", "\t")))
+    return hits >= 1 or indent_lines >= max(2, len(lines) // 3)
+
+
+TG_CODE_OPEN = "<pre><code>"
+TG_CODE_CLOSE = "</code></pre>"
+
+
+class TelegramHtmlStream:
+    """
+    Single-pass ``` fences -> Telegram HTML formatter for streamed text.
+
+    feed() takes deltas and returns finished chunks (<= max_len chars). A code block
+    cut by a chunk boundary is closed and reopened in the next chunk; HTML entities
+    are never split. preview() renders the unfinished chunk with tags balanced.
+    """
+
+    def __init__(self, max_len: int = 3900) -> None:
+        self.max_len = max(80, max_len)  # room for the longest code tags + an entity
+        self._parts: List[str] = []
+        self._len = 0
+        self._done: List[str] = []
+        self._in_code = False
+        self._code_open = TG_CODE_OPEN
+        self._ticks = 0                 # pending backticks (a fence may span deltas)
+        self._lang: Optional[List[str]] = None  # collecting the language tag after an opening fence
+
+    def _room(self) -> int:
+        return self.max_len - self._len - (len(TG_CODE_CLOSE) if self._in_code else 0)
+
+    def _push(self, s: str) -> None:
+        self._parts.append(s)
+        self._len += len(s)
+
+    def _code_is_empty(self) -> bool:
+        return bool(self._parts) and self._parts[-1] == self._code_open
+
+    def _render(self) -> str:
+        if not self._in_code:
+            return "".join(self._parts)
+        if self._code_is_empty():
+            return "".join(self._parts[:-1])
+        return "".join(self._parts) + TG_CODE_CLOSE
+
+    def _emit_chunk(self) -> None:
+        html = self._render()
+        if html.strip():
+            self._done.append(html)
+        self._parts = []
+        self._len = 0
+        if self._in_code:
+            self._push(self._code_open)
+
+    def _write_escaped(self, s: str) -> None:
+        while s:
+            room = self._room()
+            if len(s) <= room:
+                self._push(s)
+                return
+            head = s[:max(0, room)]
+            amp = head.rfind("&")
+            if amp != -1 and amp > head.rfind(";"):
+                head = head[:amp]
+            if head:
+                self._push(head)
+                s = s[len(head):]
+            self._emit_chunk()
+
+    def _open_code(self, lang: str) -> None:
+        safe_lang = "".join(ch for ch in lang if ch.isalnum() or ch in "+-_#")[:16]
+        tag = f'<pre><code class="language-{safe_lang}">' if safe_lang else TG_CODE_OPEN
+        if self._room() < len(tag) + len(TG_CODE_CLOSE) + 1:
+            self._emit_chunk()
+        self._in_code = True
+        self._code_open = tag
+        self._push(tag)
+
+    def _close_code(self) -> None:
+        if self._code_is_empty():
+            self._len -= len(self._parts.pop())
+        else:
+            self._push(TG_CODE_CLOSE)
+        self._in_code = False
+
+    def _resolve_ticks(self) -> None:
+        ticks, self._ticks = self._ticks, 0
+        if ticks >= 3:
+            if self._in_code:
+                self._close_code()
+            else:
+                self._lang = []
+            ticks -= 3
+        if ticks:
+            self._write_escaped("`" * ticks)
+
+    def feed(self, delta: str) -> List[str]:
+        i, n = 0, len(delta)
+        while i < n:
+            if self._lang is not None:
+                j = delta.find("\n", i)
+                if j == -1:
+                    self._lang.append(delta[i:])
+                    break
+                self._lang.append(delta[i:j])
+                lang, self._lang = "".join(self._lang).strip(), None
+                self._open_code(lang)
+                i = j + 1
+                continue
+            if delta[i] == "`":
+                self._ticks += 1
+                i += 1
+                continue
+            if self._ticks:
+                self._resolve_ticks()
+                continue
+            j = delta.find("`", i)
+            if j == -1:
+                j = n
+            self._write_escaped(html_escape(delta[i:j]))
+            i = j
+
+        done, self._done = self._done, []
+        return done
+
+    def flush(self) -> List[str]:
+        if self._ticks:
+            self._resolve_ticks()
+        if self._lang is not None:
+            # fence without a newline till the end -> empty code block
+            self._lang = None
+        if self._in_code:
+            self._close_code()
+        self._emit_chunk()
+        done, self._done = self._done, []
+        return done
+
+    def preview(self) -> str:
+        return self._render()
+
+
+def format_telegram_html_chunks(text: str, max_len: int = TG_MESSAGE_MAX_LEN) -> List[str]:
+    fmt = TelegramHtmlStream(max_len)
+    chunks: List[str] = []
+    if looks_like_code(text):
+        chunks += fmt.feed("```\n")
+    chunks += fmt.feed(text or "")
+    chunks += fmt.flush()
+    return chunks or ["…"]
 
 
 def send_long_message(chat_id: int, text: str, reply_markup: Optional[Any] = None) -> None:
-    max_len = 3900
-    chunks = [text[i:i + max_len] for i in range(0, len(text), max_len)] or [""]
+    chunks = format_telegram_html_chunks(text)
     for i, chunk in enumerate(chunks):
-        bot.send_message(chat_id, chunk, reply_markup=reply_markup if i == len(chunks) - 1 else None)
+        tg_send(
+            chat_id,
+            chunk,
+            reply_markup=reply_markup if i == len(chunks) - 1 else None,
+            wait=False,
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
 
 
 # =============================================================================
@@ -1184,15 +3192,23 @@ def _rebuild_history(sys0: Dict[str, Any], summary: Optional[Dict[str, Any]], ta
     return out
 
 
-def enforce_token_budget_strict_list(user_id: str, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def enforce_token_budget_strict_list(
+    user_id: str,
+    history: List[Dict[str, Any]],
+    limit: Optional[int] = None,
+    model_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    limit = limit or history_token_budget(model_id)
+    token_estimator = get_token_estimator(model_id)
+    system_prompt = system_prompt_for(user_id)
     if not history:
-        return [{"role": "system", "content": system_prompt_for(user_id)}]
+        return [{"role": "system", "content": system_prompt}]
 
     history = copy.deepcopy(history)
     if history[0].get("role") == "system":
-        history[0]["content"] = system_prompt_for(user_id)
+        history[0]["content"] = system_prompt
     else:
-        history.insert(0, {"role": "system", "content": system_prompt_for(user_id)})
+        history.insert(0, {"role": "system", "content": system_prompt})
 
     for m in history:
         m.pop("_job_id", None)
@@ -1202,11 +3218,11 @@ def enforce_token_budget_strict_list(user_id: str, history: List[Dict[str, Any]]
     tail = _non_system_msgs(history)
 
     candidate = _rebuild_history(sys0, summary, tail)
-    while len(tail) > 1 and token_estimator.estimate_messages(candidate) > TOKEN_LIMIT:
+    while len(tail) > 1 and token_estimator.estimate_messages(candidate) > limit:
         tail = tail[1:]
         candidate = _rebuild_history(sys0, summary, tail)
 
-    if token_estimator.estimate_messages(candidate) > TOKEN_LIMIT and tail:
+    if token_estimator.estimate_messages(candidate) > limit and tail:
         last = copy.deepcopy(tail[-1])
         content = last.get("content")
 
@@ -1241,7 +3257,7 @@ def enforce_token_budget_strict_list(user_id: str, history: List[Dict[str, Any]]
 
             base_candidate = _rebuild_history(sys0, summary, tail[:-1] + [last_copy])
             base_tokens = token_estimator.estimate_messages(base_candidate)
-            allowance = max(0, TOKEN_LIMIT - base_tokens)
+            allowance = max(0, limit - base_tokens)
             allowance = max(allowance, MIN_TEXT_TOKENS_TO_KEEP)
             truncated = token_estimator.truncate_text_to_tokens_keep_tail(joined_text, allowance)
 
@@ -1276,21 +3292,41 @@ def find_job_user_message_index(history: List[Dict[str, Any]], job_id: int) -> O
     return None
 
 
-def snapshot_history_for_job(user_id: str, job_id: int) -> List[Dict[str, Any]]:
+def insert_turn_context(history: List[Dict[str, Any]], content: str) -> None:
+    # per-query context goes right before the current user turn: everything above it
+    # stays an unchanged prefix from the previous request
+    pos = len(history) - 1 if len(history) > 1 and history[-1].get("role") == "user" else len(history)
+    history.insert(pos, {"role": "system", "content": content})
+
+
+def snapshot_history_for_job(
+    user_id: str,
+    job_id: int,
+    limit: Optional[int] = None,
+    model_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     with STATE_LOCK:
         history = chat_histories.get(user_id) or [{"role": "system", "content": system_prompt_for(user_id)}]
         idx = find_job_user_message_index(history, job_id)
         snap = copy.deepcopy(history[: idx + 1]) if idx is not None else copy.deepcopy(history)
 
-    if snap and snap[0].get("role") == "system":
-        snap[0]["content"] = system_prompt_for(user_id)
-    else:
-        snap.insert(0, {"role": "system", "content": system_prompt_for(user_id)})
+    # the job's own message selects the memory items and past snippets for this turn
+    query = _content_to_plain_text(snap[-1]) if snap and snap[-1].get("role") == "user" else None
 
     for m in snap:
         m.pop("_job_id", None)
 
-    return enforce_token_budget_strict_list(user_id, snap)
+    recall = recall_text_for(user_id, query or "", {_content_to_plain_text(m) for m in snap}, model_id)
+    context = "\n\n".join(x for x in (memory_text_for(user_id, query).strip(), recall) if x)
+    limit = limit or history_token_budget(model_id)
+    if context:
+        cost = get_token_estimator(model_id).count_text_tokens(context) + TOKENS_PER_MESSAGE_OVERHEAD
+        limit = max(MIN_TEXT_TOKENS_TO_KEEP, limit - cost)
+
+    trimmed = enforce_token_budget_strict_list(user_id, snap, limit=limit, model_id=model_id)
+    if context:
+        insert_turn_context(trimmed, context)
+    return trimmed
 
 
 def message_has_image(message: types.Message) -> bool:
@@ -1301,48 +3337,142 @@ def message_has_image(message: types.Message) -> bool:
 # COMPLETION (STREAMING + STOP SUPPORT + retries)
 # =============================================================================
 
+def _open_stream(
+    llm: Any, kwargs: Dict[str, Any], close: Optional[Callable[[], None]] = None
+) -> Tuple[Any, Iterator[Any]]:
+    """
+    Waits for the first event, so "request accepted" means "model started answering".
+    The first-token deadline is a watchdog that tears the connection down (via close);
+    after that the stream only has the regular LLM_TIMEOUT_SEC read timeout between chunks.
+    """
+    t0 = time.time()
+    fired = threading.Event()
+    watchdog: Optional[threading.Timer] = None
+    if close is not None:
+        def _fire() -> None:
+            fired.set()
+            CancelEvent._run_closer(close)
+
+        watchdog = threading.Timer(LLM_TTFT_TIMEOUT_SEC, _fire)
+        watchdog.daemon = True
+        watchdog.start()
+    try:
+        stream = _openai_chat_create(llm, stream=True, **kwargs)
+        it = iter(stream)
+        first = next(it, None)
+    except Exception as e:
+        if fired.is_set():
+            raise TTFTTimeoutError(f"no first token within {LLM_TTFT_TIMEOUT_SEC:g}s") from e
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    if fired.is_set():
+        # fired right as the first event arrived: the connection is already gone
+        raise TTFTTimeoutError(f"no first token within {LLM_TTFT_TIMEOUT_SEC:g}s")
+    TTFT_TRACKER.add(time.time() - t0)
+    return stream, (itertools.chain([first], it) if first is not None else it)
+
+
 def run_completion_streaming(
     api_messages: List[Dict[str, Any]],
     temperature: float,
-    cancel_event: threading.Event,
+    cancel_event: CancelEvent,
+    max_tokens: Optional[int] = None,
+    model_id: Optional[str] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
+    meta: Optional[Dict[str, Any]] = None,
 ) -> str:
-    model_id = resolve_lmstudio_model_id()
+    """Returns the answer text; if meta is given, meta["finish_reason"] is set ("stop", "length", ...)."""
+    model_id = model_id or resolve_lmstudio_model_id()
+    meta = meta if meta is not None else {}
     chunks: List[str] = []
+    kwargs: Dict[str, Any] = {"model": model_id, "messages": api_messages, "temperature": temperature}
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+
+    opened: List[Callable[[], None]] = []
+
+    def _llm_for(base: Any) -> Tuple[Any, Optional[Callable[[], None]]]:
+        llm, close = _cancellable_client(base)
+        if close is not None:
+            opened.append(close)
+            cancel_event.add_closer(close)
+        return llm, close
 
     def _stream_call():
-        return _openai_chat_create(
-            model=model_id,
-            messages=api_messages,
-            temperature=temperature,
-            stream=True,
+        llm, close = _llm_for(primary_llm.get())
+        secondary = secondary_llm.get() if LLM_HEDGE_ENABLED else None
+        if secondary is None:
+            return _open_stream(llm, kwargs, close)
+
+        llm2, close2 = _llm_for(secondary)
+        closers = {"primary": close, "secondary": close2}
+
+        def _abort(tag: str) -> None:
+            fn = closers.get(tag)
+            if fn is not None:
+                CancelEvent._run_closer(fn)
+
+        return hedged_call(
+            lambda: _open_stream(llm, kwargs, close),
+            lambda: _open_stream(llm2, kwargs, close2),
+            delay_sec=hedge_delay_sec(),
+            abort=_abort,
         )
 
     def _nonstream_call():
-        return _openai_chat_create(
-            model=model_id,
-            messages=api_messages,
-            temperature=temperature,
-        )
+        llm, _close = _llm_for(primary_llm.get())
+        return _openai_chat_create(llm, **kwargs)
 
-    # Prefer streaming, fallback to non-stream.
     try:
-        stream = call_with_retries(_stream_call, name="chat.create(stream)")
-        for ev in stream:
-            if cancel_event.is_set():
-                break
-            delta = None
+        # Prefer streaming, fallback to non-stream.
+        try:
+            stream, events = call_with_retries(_stream_call, name="chat.create(stream)", cancel_event=cancel_event)
+            close_stream = getattr(stream, "close", None)
+            if callable(close_stream):
+                cancel_event.add_closer(close_stream)
             try:
-                delta = ev.choices[0].delta.content  # type: ignore[attr-defined]
-            except Exception:
-                delta = None
-            if isinstance(delta, str) and delta:
-                chunks.append(delta)
-        return "".join(chunks)
-    except Exception as e:
-        record_error(f"stream failed -> fallback non-stream: {type(e).__name__}: {e}")
+                for ev in events:
+                    if cancel_event.is_set():
+                        break
+                    delta = None
+                    try:
+                        delta = ev.choices[0].delta.content  # type: ignore[attr-defined]
+                        meta["finish_reason"] = ev.choices[0].finish_reason or meta.get("finish_reason")  # type: ignore[attr-defined]
+                    except Exception:
+                        delta = None
+                    if isinstance(delta, str) and delta:
+                        chunks.append(delta)
+                        if on_delta is not None:
+                            try:
+                                on_delta(delta)
+                            except Exception as e:
+                                record_error(f"on_delta failed: {type(e).__name__}: {e}")
+            finally:
+                if callable(close_stream):
+                    cancel_event.remove_closer(close_stream)
+                    CancelEvent._run_closer(close_stream)
+            return "".join(chunks)
+        except Exception as e:
+            if cancel_event.is_set():
+                return "".join(chunks)
+            if isinstance(e, TTFTTimeoutError):
+                raise  # a non-stream call to the same backend would hang just as long
+            record_error(f"stream failed -> fallback non-stream: {type(e).__name__}: {e}")
 
-    completion = call_with_retries(_nonstream_call, name="chat.create")
-    return completion.choices[0].message.content or ""
+        try:
+            completion = call_with_retries(_nonstream_call, name="chat.create", cancel_event=cancel_event)
+        except Exception:
+            if cancel_event.is_set():
+                return ""
+            raise
+        meta["finish_reason"] = getattr(completion.choices[0], "finish_reason", None)
+        return completion.choices[0].message.content or ""
+    finally:
+        for close in opened:
+            cancel_event.remove_closer(close)
+            CancelEvent._run_closer(close)
 
 
 # =============================================================================
@@ -1356,6 +3486,9 @@ def postprocess_user_history_if_idle(user_id: str) -> None:
     if busy or pending:
         return
 
+    with STATE_LOCK:
+        before = list(chat_histories.get(user_id) or [])
+
     refresh_system_prompt_in_history(user_id)
     compression_engine_inplace(user_id)
 
@@ -1363,13 +3496,106 @@ def postprocess_user_history_if_idle(user_id: str) -> None:
         current = chat_histories.get(user_id) or [{"role": "system", "content": system_prompt_for(user_id)}]
         trimmed = enforce_token_budget_strict_list(user_id, current)
         chat_histories[user_id] = trimmed
+        archive_dropped_messages(user_id, before, trimmed)
         history_store.save()
 
+    if RECALL_ENABLED:
+        try:
+            recall_store.update(user_id)
+        except Exception as e:
+            record_error(f"recall index update failed: {type(e).__name__}: {e}")
+
 
 # =============================================================================
 # WORKER THREADS
 # =============================================================================
 
+ANSWER_PREFIX = "ОТВЕТ:"
+
+
+def make_live_preview(job: Job) -> Callable[[str], None]:
+    """
+    on_delta callback: formats streamed text in one pass and edits the status message
+    with the current (last) chunk at most every STREAM_EDIT_INTERVAL_SEC.
+    """
+    fmt = TelegramHtmlStream(TG_MESSAGE_MAX_LEN)
+    state: Dict[str, Any] = {"raw": "", "started": False, "last_edit": 0.0}
+
+    def _on_delta(delta: str) -> None:
+        if not state["started"]:
+            # don't show the "ОТВЕТ:" prefix the prompt asks for
+            state["raw"] += delta
+            raw = state["raw"]
+            idx = raw.find(ANSWER_PREFIX)
+            if idx != -1:
+                delta = raw[idx + len(ANSWER_PREFIX):].lstrip()
+            elif len(raw) > 2 * len(ANSWER_PREFIX):
+                delta = raw
+            else:
+                return
+            state["started"] = True
+        fmt.feed(delta)
+
+        now = time.monotonic()
+        if now - state["last_edit"] < STREAM_EDIT_INTERVAL_SEC:
+            return
+        state["last_edit"] = now
+        preview = fmt.preview()
+        if preview.strip():
+            safe_edit_text(
+                job.chat_id,
+                job.status_message_id,
+                preview,
+                reply_markup=stop_keyboard(job.job_id),
+                parse_mode="HTML",
+                fallback_send=False,
+            )
+
+    return _on_delta
+
+
+FAST_LANE_CONTINUE_PROMPT = (
+    "Твой предыдущий ответ оборвался из-за лимита длины. Продолжи его ровно с того места, "
+    "где он оборвался, ничего не повторяя и без префикса."
+)
+TRUNCATED_NOTE = "\n\n✂️ Ответ обрезан по лимиту длины."
+
+
+def continue_fast_lane_answer(
+    job: Job,
+    api_messages: List[Dict[str, Any]],
+    partial: str,
+    temperature: float,
+    on_delta: Optional[Callable[[str], None]],
+) -> str:
+    """
+    A fast-lane answer stopped at FAST_LANE_MAX_TOKENS: finish it on a normal slot
+    with the regular model and no token cap. Falls back to marking the answer as cut.
+    """
+    with SCHED_LOCK:
+        FAST_LANE_STATS["truncated"] += 1
+    if not FAST_LANE_CONTINUE_ON_LENGTH or not move_job_to_normal_slot(job):
+        return partial + TRUNCATED_NOTE
+    try:
+        rest = run_completion_streaming(
+            api_messages=api_messages + [
+                {"role": "assistant", "content": partial},
+                {"role": "user", "content": FAST_LANE_CONTINUE_PROMPT},
+            ],
+            temperature=temperature,
+            cancel_event=job.cancel_event,
+            max_tokens=answer_max_tokens(),
+            on_delta=on_delta,
+        )
+    except Exception as e:
+        record_error(f"fast lane continuation failed: {type(e).__name__}: {e}")
+        return partial + TRUNCATED_NOTE
+    if rest.lstrip().startswith(ANSWER_PREFIX):
+        rest = rest.lstrip()[len(ANSWER_PREFIX):].lstrip()
+    # the cut may fall mid-word: glue as is, the model supplies its own leading space
+    return partial + rest
+
+
 def worker_loop(worker_id: int) -> None:
     logger.info("Worker #%d started", worker_id)
 
@@ -1398,23 +3624,37 @@ def worker_loop(worker_id: int) -> None:
         )
 
         try:
-            snap = snapshot_history_for_job(job.user_id, job.job_id)
+            fast = job.lane == "fast"
+            model_id = (FAST_LANE_MODEL or None) if fast else None
+            max_tokens = answer_max_tokens(model_id, FAST_LANE_MAX_TOKENS if fast else None)
+            snap = snapshot_history_for_job(
+                job.user_id, job.job_id, limit=history_token_budget(model_id, max_tokens), model_id=model_id
+            )
             api_messages = materialize_for_api(snap)
+            on_delta = make_live_preview(job) if STREAM_PREVIEW_ENABLED else None
+            meta: Dict[str, Any] = {}
 
             raw = run_completion_streaming(
                 api_messages=api_messages,
                 temperature=temperature,
                 cancel_event=job.cancel_event,
+                max_tokens=max_tokens,
+                model_id=model_id,
+                on_delta=on_delta,
+                meta=meta,
             )
 
             canceled = job.cancel_event.is_set() or SHUTDOWN_EVENT.is_set()
+            if fast and not canceled and meta.get("finish_reason") == "length":
+                raw = continue_fast_lane_answer(job, api_messages, raw, temperature, on_delta)
+                canceled = job.cancel_event.is_set() or SHUTDOWN_EVENT.is_set()
 
             if canceled and SMART_STOP_DISCARD_PARTIAL:
                 response = "Остановлено."
             else:
                 response = raw or ""
-                if "ОТВЕТ:" in response:
-                    response = response.split("ОТВЕТ:", 1)[1].strip()
+                if ANSWER_PREFIX in response:
+                    response = response.split(ANSWER_PREFIX, 1)[1].strip()
                 if canceled and not response.strip():
                     response = "Остановлено."
 
@@ -1428,19 +3668,26 @@ def worker_loop(worker_id: int) -> None:
         except Exception as e:
             record_error(f"worker error: {type(e).__name__}: {e}")
             safe_delete(job.chat_id, job.status_message_id)
-            bot.send_message(job.chat_id, f"Ошибка: {e}", reply_markup=main_menu_keyboard(job.user_id))
+            tg_send(job.chat_id, f"Ошибка: {e}", reply_markup=main_menu_keyboard(job.user_id))
         finally:
             job.done = True
             mark_job_finished(job.user_id, job.job_id)
+            if job.cancel_event.set_at is not None:
+                record_stop_latency(job.job_id, time.time() - job.cancel_event.set_at)
             postprocess_user_history_if_idle(job.user_id)
             cleanup_jobs()
 
 
 _workers: List[threading.Thread] = []
-for i in range(max(1, WORKER_COUNT)):
-    t = threading.Thread(target=worker_loop, args=(i + 1,), daemon=True)
-    _workers.append(t)
-    t.start()
+
+
+def start_workers() -> None:
+    # a reserved fast-lane slot is useless without a worker to run it
+    total = max(1, WORKER_COUNT, MAX_ACTIVE_GLOBAL + FAST_LANE_SLOTS if FAST_LANE_ENABLED else 0)
+    for i in range(len(_workers), total):
+        t = threading.Thread(target=worker_loop, args=(i + 1,), daemon=True)
+        _workers.append(t)
+        t.start()
 
 
 # =============================================================================
@@ -1454,32 +3701,108 @@ def cmd_start(message: types.Message) -> None:
         if user_id not in chat_histories:
             init_history(user_id)
     refresh_system_prompt_in_history(user_id)
-    bot.reply_to(message, "⚙️ Панель управления:", reply_markup=main_menu_keyboard(user_id))
+    tg_reply(message, "⚙️ Панель управления:", reply_markup=main_menu_keyboard(user_id))
+
+
+def parse_export_args(text: str) -> Tuple[str, Optional[int], Optional[float]]:
+    """
+    /export [json|jsonl] [last N] [since YYYY-MM-DD]
+    Returns (fmt, last_n, since_ts). Raises ValueError on bad arguments.
+    """
+    fmt = "json"
+    last_n: Optional[int] = None
+    since_ts: Optional[float] = None
+
+    args = text.split()[1:]
+    i = 0
+    while i < len(args):
+        a = args[i].lower()
+        if a in ("json", "jsonl"):
+            fmt = a
+        elif a == "last" and i + 1 < len(args):
+            last_n = max(1, int(args[i + 1]))
+            i += 1
+        elif a == "since" and i + 1 < len(args):
+            since_ts = datetime.strptime(args[i + 1], "%Y-%m-%d").timestamp()
+            i += 1
+        else:
+            raise ValueError(a)
+        i += 1
+    return fmt, last_n, since_ts
+
+
+def select_export_messages(
+    history: List[Dict[str, Any]],
+    last_n: Optional[int],
+    since_ts: Optional[float],
+) -> List[Dict[str, Any]]:
+    out = history
+    if since_ts is not None:
+        # messages stored before timestamps were added have no "_ts" and are skipped
+        out = [m for m in out if isinstance(m.get("_ts"), (int, float)) and m["_ts"] >= since_ts]
+    if last_n is not None:
+        out = out[-last_n:]
+    return out
+
+
+def write_export(fileobj: Any, meta: Dict[str, Any], messages: List[Dict[str, Any]], fmt: str) -> None:
+    """Streams the export as gzip-compressed JSON or JSONL, one message at a time."""
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6) as gz:
+        if fmt == "jsonl":
+            gz.write(json.dumps({"type": "meta", **meta}, ensure_ascii=False).encode("utf-8") + b"\n")
+            for m in messages:
+                gz.write(json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n")
+            return
+
+        # {**meta, "history": [...]} without building the whole document in memory
+        gz.write(json.dumps(meta, ensure_ascii=False)[:-1].encode("utf-8") + b', "history": [')
+        for i, m in enumerate(messages):
+            if i:
+                gz.write(b",\n")
+            gz.write(json.dumps(m, ensure_ascii=False).encode("utf-8"))
+        gz.write(b"]}")
 
 
 @bot.message_handler(commands=["export"])
 def cmd_export(message: types.Message) -> None:
     user_id = uid(message.from_user.id)
+    try:
+        fmt, last_n, since_ts = parse_export_args(message.text or "")
+    except ValueError:
+        tg_reply(
+            message,
+            "Использование: /export [json|jsonl] [last N] [since YYYY-MM-DD]",
+            reply_markup=main_menu_keyboard(user_id),
+        )
+        return
+
+    # only take references under the lock; all heavy work happens after it is released
     with STATE_LOCK:
         if user_id not in chat_histories:
             init_history(user_id)
-
-        payload = {
-            "user_id": user_id,
-            "settings": get_settings(user_id),
-            "token_status_estimate": {
-                "used": get_token_status(user_id).used,
-                "left": get_token_status(user_id).left,
-                "limit": TOKEN_LIMIT,
-            },
-            "lmstudio_loaded_model_id_estimate": resolve_lmstudio_model_id(),
-            "history": chat_histories.get(user_id, []),
-        }
-
-    data = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
-    bio = io.BytesIO(data)
-    bio.name = f"export_{user_id}.json"
-    bot.send_document(message.chat.id, bio, caption="📦 Экспорт истории и настроек (JSON).")
+        settings = copy.deepcopy(get_settings(user_id))
+        history = [dict(m) for m in chat_histories.get(user_id, [])]
+
+    used = get_token_estimator().estimate_messages(history)
+    limit = history_token_budget()
+    meta = {
+        "user_id": user_id,
+        "settings": settings,
+        "token_status_estimate": {"used": used, "left": limit - used, "limit": limit},
+        "lmstudio_loaded_model_id_estimate": resolve_lmstudio_model_id(),
+        "range": {"last": last_n, "since": since_ts},
+    }
+    messages = select_export_messages(history, last_n, since_ts)
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES) as spool:
+        write_export(spool, meta, messages, fmt)
+        spool.seek(0)
+        tg_send_document(
+            message.chat.id,
+            spool,
+            caption=f"📦 Экспорт истории и настроек ({fmt.upper()}, gzip), сообщений: {len(messages)}.",
+            visible_file_name=f"export_{user_id}.{fmt}.gz",
+        )
 
 
 @bot.message_handler(commands=["profile"])
@@ -1502,7 +3825,7 @@ def cmd_profile(message: types.Message) -> None:
         lines.append("(пусто)")
     lines.append("")
     lines.append("Команды: /remember <текст>, /forget <n|all>, /queue, /stop, /status")
-    bot.send_message(message.chat.id, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
+    tg_send(message.chat.id, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
 
 
 @bot.message_handler(commands=["status"])
@@ -1520,6 +3843,39 @@ def cmd_status(message: types.Message) -> None:
         users_in_queue = sum(1 for qq in user_queues.values() if len(qq) > 0)
         active_users = sum(1 for v in user_busy.values() if v)
 
+    hist = history_store.stats
+    with SCHED_LOCK:
+        fast_pending = len(fast_queue)
+        fast_active = active_fast
+        fast_stats = dict(FAST_LANE_STATS)
+        waits = {lane: sorted(v) for lane, v in LANE_WAITS.items()}
+    wait_text = " ".join(
+        f"{lane}_p50={w[len(w) // 2]:.1f}s" if w else f"{lane}_p50=-" for lane, w in waits.items()
+    )
+    fast_text = (
+        f"⚡ Fast lane: active={fast_active}/{FAST_LANE_SLOTS} pending={fast_pending} "
+        f"enqueued={fast_stats['enqueued']} started={fast_stats['started']} borrowed={fast_stats['borrowed']} "
+        f"truncated={fast_stats['truncated']} continued={fast_stats['continued']} "
+        f"borrow={'on' if FAST_LANE_BORROW_NORMAL_SLOTS else 'off'}\n"
+        if FAST_LANE_ENABLED else "⚡ Fast lane: off\n"
+    )
+    ttft_p95 = TTFT_TRACKER.percentile(0.95)
+    tok = get_token_estimator()
+    recall_users, recall_docs = recall_store.sizes()
+    recall_stats = dict(recall_store.stats)
+    err_kinds = " ".join(f"{k}={v}" for k, v in sorted(LLM_ERROR_KINDS.items())) or "(нет)"
+    with HEDGE_STATS_LOCK:
+        hedge_stats = dict(HEDGE_STATS)
+    hedge_text = (
+        f"🪁 Hedge: delay={hedge_delay_sec():.1f}s hedged={hedge_stats['hedged']} "
+        f"secondary_won={hedge_stats['secondary_won']}\n"
+        if BASE_URL_SECONDARY and LLM_HEDGE_ENABLED else ""
+    )
+    ob = dict(outbound.stats)
+    stop_lat = sorted(STOP_LATENCIES)
+    stop_text = (
+        f"p50={stop_lat[len(stop_lat) // 2]:.2f}s max={stop_lat[-1]:.2f}s n={len(stop_lat)}" if stop_lat else "(нет)"
+    )
     last_errs = list(RECENT_ERRORS)[-8:]
     err_text = "\n".join(
         f"- {time.strftime('%H:%M:%S', time.localtime(ts))}: {msg}" for ts, msg in last_errs
@@ -1529,17 +3885,30 @@ def cmd_status(message: types.Message) -> None:
         "🛠 /status\n"
         f"⏱ Uptime: {uptime:.0f}s\n"
         f"🤖 LM Studio model: {resolve_lmstudio_model_id()}\n"
-        f"⚙️ Active(global): {global_active_now}/{MAX_ACTIVE_GLOBAL} | workers={WORKER_COUNT}\n"
+        f"📚 Models: {model_catalog_text()}\n"
+        f"🔤 Tokenizer: {tok.name} ({tok.backend}) cache hits={tok.stats['hits']} misses={tok.stats['misses']}\n"
+        f"⚙️ Active(global): {global_active_now}/{MAX_ACTIVE_GLOBAL} | workers={len(_workers)}\n"
         f"📥 Pending(global): {global_pending} | users_in_queue={users_in_queue}\n"
         f"👥 Active users: {active_users}\n"
+        f"🗂 History in RAM: {history_store.resident_count()} users | loads={hist['loads']} "
+        f"evictions={hist['evictions']} writes={hist['writes']}\n"
+        f"🔎 Recall: users={recall_users} docs={recall_docs} searches={recall_stats['searches']} "
+        f"hits={recall_stats['hits']}\n"
+        f"🛑 Stop → slot freed: {stop_text}\n"
+        f"{fast_text}"
+        f"📤 Telegram out: pending={outbound.pending()} sent={ob['sent']} collapsed={ob['collapsed']} "
+        f"429={ob['flood_429']} failed={ob['failed']}\n"
+        f"⏳ Queue wait: {wait_text}\n"
         "\n"
         f"🧯 Circuit breaker: open={cb['open']} fail_streak={cb['fail_streak']} "
         f"threshold={cb['failure_threshold']} reset={cb['reset_timeout_sec']}s\n"
+        f"📶 LLM errors: {err_kinds} | TTFT p95: {f'{ttft_p95:.1f}s' if ttft_p95 is not None else '-'}\n"
+        f"{hedge_text}"
         "\n"
         "❗ Последние ошибки:\n"
         f"{err_text}"
     )
-    bot.reply_to(message, text, reply_markup=main_menu_keyboard(uid(message.from_user.id)))
+    tg_reply(message, text, reply_markup=main_menu_keyboard(uid(message.from_user.id)))
 
 
 @bot.message_handler(commands=["remember"])
@@ -1548,7 +3917,7 @@ def cmd_remember(message: types.Message) -> None:
     text = (message.text or "").strip()
     parts = text.split(maxsplit=1)
     if len(parts) < 2 or not parts[1].strip():
-        bot.reply_to(message, "Использование: /remember <что запомнить>", reply_markup=main_menu_keyboard(user_id))
+        tg_reply(message, "Использование: /remember <что запомнить>", reply_markup=main_menu_keyboard(user_id))
         return
 
     item = parts[1].strip()
@@ -1567,7 +3936,7 @@ def cmd_remember(message: types.Message) -> None:
         settings_store.save()
 
     refresh_system_prompt_in_history(user_id)
-    bot.reply_to(message, "✅ Запомнил.", reply_markup=main_menu_keyboard(user_id))
+    tg_reply(message, "✅ Запомнил.", reply_markup=main_menu_keyboard(user_id))
 
 
 @bot.message_handler(commands=["forget"])
@@ -1585,13 +3954,13 @@ def cmd_forget(message: types.Message) -> None:
 
         if len(parts) < 2:
             if not mem:
-                bot.reply_to(message, "Память пустая.", reply_markup=main_menu_keyboard(user_id))
+                tg_reply(message, "Память пустая.", reply_markup=main_menu_keyboard(user_id))
                 return
             lines = ["🧾 Память:"]
             for i, item in enumerate(mem[:MAX_MEMORY_ITEMS], 1):
                 lines.append(f"{i}) {item}")
             lines.append("Удаление: /forget <номер> или /forget all")
-            bot.reply_to(message, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
+            tg_reply(message, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
             return
 
         arg = parts[1].strip().lower()
@@ -1602,17 +3971,17 @@ def cmd_forget(message: types.Message) -> None:
             try:
                 n = int(arg)
                 if n < 1 or n > len(mem):
-                    bot.reply_to(message, "Неверный номер.", reply_markup=main_menu_keyboard(user_id))
+                    tg_reply(message, "Неверный номер.", reply_markup=main_menu_keyboard(user_id))
                     return
                 mem.pop(n - 1)
                 s["memory"] = mem
                 settings_store.save()
             except ValueError:
-                bot.reply_to(message, "Использование: /forget <номер> или /forget all", reply_markup=main_menu_keyboard(user_id))
+                tg_reply(message, "Использование: /forget <номер> или /forget all", reply_markup=main_menu_keyboard(user_id))
                 return
 
     refresh_system_prompt_in_history(user_id)
-    bot.reply_to(message, "✅ Готово.", reply_markup=main_menu_keyboard(user_id))
+    tg_reply(message, "✅ Готово.", reply_markup=main_menu_keyboard(user_id))
 
 
 @bot.message_handler(commands=["stop"])
@@ -1621,13 +3990,13 @@ def cmd_stop(message: types.Message) -> None:
     with SCHED_LOCK:
         jid = active_job_by_user.get(user_id)
     if not jid:
-        bot.reply_to(message, "Сейчас нет активной генерации.", reply_markup=main_menu_keyboard(user_id))
+        tg_reply(message, "Сейчас нет активной генерации.", reply_markup=main_menu_keyboard(user_id))
         return
 
     j = jobs.get(jid)
     if j and not j.done and not j.canceled:
         j.cancel_event.set()
-    bot.reply_to(message, "🛑 Останавливаю…", reply_markup=main_menu_keyboard(user_id))
+    tg_reply(message, "🛑 Останавливаю…", reply_markup=main_menu_keyboard(user_id))
 
 
 @bot.message_handler(commands=["queue"])
@@ -1650,7 +4019,7 @@ def cmd_queue(message: types.Message) -> None:
     ]
     if q:
         lines.append("Твои pending job_id: " + ", ".join(str(x) for x in list(q)[:10]) + ("…" if len(q) > 10 else ""))
-    bot.send_message(message.chat.id, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
+    tg_send(message.chat.id, "\n".join(lines), reply_markup=main_menu_keyboard(user_id))
 
 
 # =============================================================================
@@ -1670,10 +4039,10 @@ def callback_handler(call: types.CallbackQuery) -> None:
             busy = user_busy.get(user_id, False)
             pending = has_pending_for_user(user_id)
         if busy or pending:
-            bot.send_message(call.message.chat.id, "Сначала дождись/останови текущие задачи.", reply_markup=main_menu_keyboard(user_id))
+            tg_send(call.message.chat.id, "Сначала дождись/останови текущие задачи.", reply_markup=main_menu_keyboard(user_id))
             return
         init_history(user_id)
-        bot.send_message(call.message.chat.id, "🧹 История очищена.", reply_markup=main_menu_keyboard(user_id))
+        tg_send(call.message.chat.id, "🧹 История очищена.", reply_markup=main_menu_keyboard(user_id))
 
     elif call.data == "menu_roles":
         safe_edit_text(call.message.chat.id, call.message.message_id, "🎭 Выберите роль:", reply_markup=roles_keyboard(user_id))
@@ -1681,7 +4050,7 @@ def callback_handler(call: types.CallbackQuery) -> None:
     elif call.data.startswith("set_role_"):
         role = call.data.replace("set_role_", "", 1)
         if role not in ROLES:
-            bot.answer_callback_query(call.id, "Неизвестная роль.")
+            tg_answer_callback(call, "Неизвестная роль.")
             return
         with STATE_LOCK:
             s["role"] = role
@@ -1703,12 +4072,14 @@ def callback_handler(call: types.CallbackQuery) -> None:
 
     elif call.data == "show_tokens":
         st = get_token_status(user_id)
+        ctx_limit, ctx_source = model_context_limit()
         cb = CB.status()
-        bot.send_message(
+        tg_send(
             call.message.chat.id,
-            f"🧠 Tokens (оценка): {st.used}/{TOKEN_LIMIT}\n"
+            f"🧠 Tokens (оценка): {st.used}/{st.limit}\n"
             f"📉 Осталось (оценка): {st.left}\n"
             f"🤖 LM Studio model: {resolve_lmstudio_model_id()}\n"
+            f"🪟 Context: {ctx_limit} ({ctx_source}), под ответ: {OUTPUT_TOKENS_RESERVE}\n"
             f"🧯 CB open={cb['open']} fail_streak={cb['fail_streak']}\n"
             f"📦 Экспорт: /export\n"
             f"📌 Очередь: /queue",
@@ -1743,18 +4114,18 @@ def callback_handler(call: types.CallbackQuery) -> None:
         try:
             job_id = int(call.data.split(":", 1)[1])
         except Exception:
-            bot.answer_callback_query(call.id, "Неверный job id.")
+            tg_answer_callback(call, "Неверный job id.")
             return
 
         job = jobs.get(job_id)
         if not job:
-            bot.answer_callback_query(call.id, "Задача не найдена/устарела.")
+            tg_answer_callback(call, "Задача не найдена/устарела.")
             return
         if job.user_id != user_id:
-            bot.answer_callback_query(call.id, "Нельзя остановить чужую задачу.")
+            tg_answer_callback(call, "Нельзя остановить чужую задачу.")
             return
         if job.done or job.canceled:
-            bot.answer_callback_query(call.id, "Уже завершено.")
+            tg_answer_callback(call, "Уже завершено.")
             return
 
         job.cancel_event.set()
@@ -1778,7 +4149,7 @@ def callback_handler(call: types.CallbackQuery) -> None:
         else:
             safe_edit_text(job.chat_id, job.status_message_id, "🛑 Останавливаю…", reply_markup=None)
 
-        bot.answer_callback_query(call.id, "Ок.")
+        tg_answer_callback(call, "Ок.")
 
 
 # =============================================================================
@@ -1797,18 +4168,18 @@ def handle_message(message: types.Message) -> None:
 
     # не принимаем новые задачи при shutdown
     if SHUTDOWN_EVENT.is_set() or not ACCEPTING_JOBS:
-        bot.send_message(message.chat.id, "Бот сейчас перезапускается/останавливается. Попробуй позже.")
+        tg_send(message.chat.id, "Бот сейчас перезапускается/останавливается. Попробуй позже.")
         return
 
     # rate limit
     rl = check_rate_limit(user_id)
     if rl:
-        bot.send_message(message.chat.id, rl, reply_markup=main_menu_keyboard(user_id))
+        tg_send(message.chat.id, rl, reply_markup=main_menu_keyboard(user_id))
         return
 
     # circuit breaker (LM Studio недоступна)
     if CB.is_open():
-        bot.send_message(
+        tg_send(
             message.chat.id,
             "LLM временно недоступна (перегруз/ошибка). Попробуй чуть позже.",
             reply_markup=main_menu_keyboard(user_id),
@@ -1821,7 +4192,7 @@ def handle_message(message: types.Message) -> None:
     refresh_system_prompt_in_history(user_id)
 
     job_id = next_job_id()
-    status_msg = bot.reply_to(message, "⏳ Добавляю в очередь…", reply_markup=stop_keyboard(job_id))
+    status_msg = tg_reply(message, "⏳ Добавляю в очередь…", reply_markup=stop_keyboard(job_id))
 
     has_img = message_has_image(message)
     try:
@@ -1833,24 +4204,23 @@ def handle_message(message: types.Message) -> None:
             text = (message.text or "").strip()
             if not text:
                 safe_delete(message.chat.id, status_msg.message_id)
-                bot.send_message(message.chat.id, "Пустое сообщение.", reply_markup=main_menu_keyboard(user_id))
+                tg_send(message.chat.id, "Пустое сообщение.", reply_markup=main_menu_keyboard(user_id))
                 return
             store_user_text(user_id, text=text, job_id=job_id)
     except Exception as e:
         record_error(f"history write error: {type(e).__name__}: {e}")
         safe_delete(message.chat.id, status_msg.message_id)
-        bot.send_message(message.chat.id, f"Ошибка записи истории: {e}", reply_markup=main_menu_keyboard(user_id))
+        tg_send(message.chat.id, f"Ошибка записи истории: {e}", reply_markup=main_menu_keyboard(user_id))
         return
 
     # Оценка для приоритета
     try:
         snap = snapshot_history_for_job(user_id, job_id)
-        prompt_cost = token_estimator.estimate_messages(snap)
+        prompt_cost = get_token_estimator().estimate_messages(snap)
         used_cost = get_token_status(user_id).used
     except Exception as e:
         record_error(f"priority estimate failed: {type(e).__name__}: {e}")
-        prompt_cost = TOKEN_LIMIT // 2
-        used_cost = TOKEN_LIMIT // 2
+        prompt_cost = used_cost = history_token_budget() // 2
 
     pr = compute_priority(
         user_id=user_id,
@@ -1858,6 +4228,7 @@ def handle_message(message: types.Message) -> None:
         used_tokens_estimate=used_cost,
         has_image=has_img,
     )
+    lane = "fast" if is_fast_lane_candidate(user_id, prompt_cost, has_img) else "normal"
 
     job = Job(
         job_id=job_id,
@@ -1867,13 +4238,14 @@ def handle_message(message: types.Message) -> None:
         created_at=time.time(),
         priority=pr,
         has_image=has_img,
+        lane=lane,
     )
 
     ok = enqueue_job(job)
     if not ok:
         remove_user_message_by_job(user_id, job_id)
         safe_delete(message.chat.id, status_msg.message_id)
-        bot.send_message(
+        tg_send(
             message.chat.id,
             f"Очередь переполнена (лимит {MAX_PENDING_PER_USER}). Подожди или /stop текущую генерацию.",
             reply_markup=main_menu_keyboard(user_id),
@@ -1884,7 +4256,7 @@ def handle_message(message: types.Message) -> None:
     lines = [
         "📌 Запрос поставлен в очередь.",
         f"🧷 Job ID: {job_id}",
-        f"⭐ Приоритет: {qs.priority}",
+        f"⭐ Приоритет: {qs.priority}" + (" ⚡ fast lane" if lane == "fast" else ""),
         f"👤 У тебя впереди задач: {qs.user_ahead} (активная: {'да' if qs.user_has_active else 'нет'})",
         f"🔢 Твоя позиция у тебя: {qs.user_position}",
         f"⚙️ Active(global): {qs.global_active}/{MAX_ACTIVE_GLOBAL}",
@@ -1954,7 +4326,63 @@ except Exception:
 # BOOT
 # =============================================================================
 
+def _warmup_step(name: str, fn: Callable[[], Any]) -> threading.Thread:
+    def _run() -> None:
+        try:
+            fn()
+        except Exception as e:
+            logger.warning("Warmup %s failed (will retry on first use): %s", name, e)
+            record_error(f"warmup {name}: {type(e).__name__}: {e}")
+
+    t = threading.Thread(target=_run, name=f"warmup-{name}", daemon=True)
+    t.start()
+    return t
+
+
+def start_warmup(compact_archive: bool = True) -> List[threading.Thread]:
+    """Heavy init runs concurrently with polling; a handler that needs a piece waits only for it."""
+    steps = [
+        _warmup_step("openai", primary_llm.get),
+        _warmup_step("openai-secondary", secondary_llm.get),
+        _warmup_step("tokenizer", lambda: get_token_estimator().count_text_tokens("warmup")),
+        _warmup_step("settings", settings_store.get),
+        _warmup_step("history", history_store.warm),
+    ]
+    if compact_archive:
+        # converts and deletes history backups: not something a dry run may do
+        steps.append(_warmup_step("archive", lambda: history_archive is not None and compact_history_backups()))
+    return steps
+
+
+def print_startup_profile(warmup: List[threading.Thread]) -> None:
+    ready_to_poll = time.perf_counter() - _T_START
+    for t in warmup:
+        t.join()
+    warm_total = time.perf_counter() - _T_START
+    print(f"{'step':<32} {'ms':>9}")
+    print("-" * 42)
+    for name, sec in STARTUP_TIMINGS.items():
+        print(f"{name:<32} {sec * 1000:>9.1f}")
+    print("-" * 42)
+    print(f"{'ready to poll (since import)':<32} {ready_to_poll * 1000:>9.1f}")
+    print(f"{'warmup done (since import)':<32} {warm_total * 1000:>9.1f}")
+
+
+STARTUP_TIMINGS["import bot6 (total)"] = time.perf_counter() - _T_START
+
+
 if __name__ == "__main__":
+    profile_only = "--profile-startup" in sys.argv[1:]
+    warmup_threads = start_warmup(compact_archive=not profile_only)
+
+    if profile_only:
+        # timings only: no polling, no workers / catalog refresher, no archive compaction
+        print_startup_profile(warmup_threads)
+        sys.exit(0)
+
+    model_catalog.start()
+    start_workers()
+
     logger.info(
         "BOT READY ✔ owner=%s base_url=%s workers=%d max_active_global=%d skip_pending=%s",
         BOT_OWNER_ID,
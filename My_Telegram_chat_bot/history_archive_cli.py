@@ -0,0 +1,125 @@
+"""
+History archive CLI (see bot6.HistoryArchive).
+
+    python history_archive_cli.py stats
+    python history_archive_cli.py compact [--keep]
+    python history_archive_cli.py users
+    python history_archive_cli.py query --user 123 [--since 2025-01-01] [--until 2025-02-01]
+                                        [--grep nginx] [--role user] [--limit 50] [--json]
+
+Uses the same HISTORY_DIR / HISTORY_FILE / HISTORY_ARCHIVE_DIR environment as the bot.
+`compact` converts rotated backups into archive segments (the bot also does this at startup).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+from bot6 import (
+    HISTORY_ARCHIVE_DIR,
+    HISTORY_DIR,
+    HISTORY_FILE,
+    HISTORY_ROTATE_BACKUPS,
+    compact_history_backups,
+    history_archive,
+)
+
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value).timestamp()
+
+
+def backups_size() -> int:
+    total = 0
+    if os.path.isdir(HISTORY_DIR):
+        for name in os.listdir(HISTORY_DIR):
+            base, _, n = name.rpartition(".json.")
+            if base and n.isdigit():
+                total += os.path.getsize(os.path.join(HISTORY_DIR, name))
+    for i in range(1, HISTORY_ROTATE_BACKUPS + 1):
+        p = f"{HISTORY_FILE}.{i}"
+        if os.path.exists(p):
+            total += os.path.getsize(p)
+    return total
+
+
+def cmd_stats(_args: argparse.Namespace) -> None:
+    segments, size = history_archive.disk_usage()
+    print(f"archive:  {HISTORY_ARCHIVE_DIR} ({history_archive.codec})")
+    print(f"users:    {len(history_archive.users())}")
+    print(f"segments: {segments}, {size / 1024:.0f} KB")
+    print(f"rotated backups not archived yet: {backups_size() / 1024:.0f} KB")
+
+
+def cmd_compact(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    before = backups_size()
+    _, size_before = history_archive.disk_usage()
+    st = compact_history_backups(keep=args.keep)
+    _, size_after = history_archive.disk_usage()
+    added = size_after - size_before
+    ratio = f"{st['bytes_before'] / added:.1f}x" if added > 0 else "-"
+    print(
+        f"files={st['files']} new_messages={st['messages']} backups={before / 1024:.0f} KB "
+        f"-> archive +{added / 1024:.0f} KB ({ratio}) in {time.perf_counter() - t0:.1f}s"
+    )
+
+
+def cmd_users(_args: argparse.Namespace) -> None:
+    for u in history_archive.users():
+        print(u, len(history_archive.segments(u)))
+
+
+def cmd_query(args: argparse.Namespace) -> None:
+    needle = (args.grep or "").lower()
+    n = 0
+    for row in history_archive.iter_rows(args.user, parse_date(args.since), parse_date(args.until)):
+        if args.role and row.get("role") != args.role:
+            continue
+        text = str(row.get("text") or "")
+        if needle and needle not in text.lower():
+            continue
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            ts = row.get("ts")
+            when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") if ts else "?"
+            print(f"[{when}] {row.get('role')}: {text}")
+        n += 1
+        if args.limit and n >= args.limit:
+            break
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats").set_defaults(fn=cmd_stats)
+    p = sub.add_parser("compact")
+    p.add_argument("--keep", action="store_true", help="keep the backup files after archiving")
+    p.set_defaults(fn=cmd_compact)
+    sub.add_parser("users").set_defaults(fn=cmd_users)
+    p = sub.add_parser("query")
+    p.add_argument("--user", required=True)
+    p.add_argument("--since", help="ISO date/time, e.g. 2025-01-31 or 2025-01-31T12:00")
+    p.add_argument("--until")
+    p.add_argument("--grep", help="case-insensitive substring")
+    p.add_argument("--role", choices=["user", "assistant"])
+    p.add_argument("--limit", type=int, default=0)
+    p.add_argument("--json", action="store_true", help="print raw JSON rows")
+    p.set_defaults(fn=cmd_query)
+    args = ap.parse_args()
+
+    if history_archive is None:
+        sys.exit("HISTORY_ARCHIVE_ENABLED=0: archive is disabled")
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()